@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Optional, Set, Tuple
+import time
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.services.users import UserRecord
+
+class AuthCache:
+    """Bounded LRU cache of verified tokens and the user they belong to
+
+    Entries expire after a fixed TTL or when the token itself expires, whichever
+    comes first. Code that changes a user record drops that user's entries
+    with invalidate_user, so this process sees the change on the next request;
+    other API processes keep theirs for up to AUTH_CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any], UserRecord]]" = OrderedDict()
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional["UserRecord"]:
+        """Return the cached user for a token, or None on a miss"""
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, _, user = entry
+        if expires_at <= time.monotonic():
+            self._remove(token)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, claims: Dict[str, Any], user: "UserRecord"):
+        """Cache the verified claims and user record for a token"""
+        ttl = self.ttl
+        if "exp" in claims:
+            ttl = min(ttl, claims["exp"] - time.time())
+        if ttl <= 0:
+            return
+
+        if token in self._entries:
+            self._remove(token)
+        self._entries[token] = (time.monotonic() + ttl, claims, user)
+        self._tokens_by_user.setdefault(user.user_id, set()).add(token)
+
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: str):
+        """Drop every cached token of a user, e.g. after the user record changed"""
+        for token in self._tokens_by_user.pop(user_id, set()):
+            self._entries.pop(token, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, token: str):
+        _, _, user = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.user_id]
+
+auth_cache = AuthCache(max_size=settings.auth_cache_size, ttl=settings.auth_cache_ttl_seconds)
@@ -1,3 +1,4 @@
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from typing import Optional
 import os
@@ -8,11 +9,78 @@ load_dotenv()
 class Settings(BaseSettings):
     mongodb_url: str = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
     database_name: str = os.getenv("DATABASE_NAME", "virtual_try_on")
+    mongodb_max_pool_size: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+    mongodb_min_pool_size: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+    mongodb_max_idle_time_ms: int = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+    mongodb_wait_queue_timeout_ms: int = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+    mongodb_server_selection_timeout_ms: int = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+    mongodb_compressors: str = os.getenv("MONGODB_COMPRESSORS", "")
+    readiness_max_ping_ms: float = float(os.getenv("READINESS_MAX_PING_MS", "250"))
     jwt_secret: str = os.getenv("JWT_SECRET", "change-this-secret-key")
     jwt_algorithm: str = os.getenv("JWT_ALGORITHM", "HS256")
     jwt_expiration_hours: int = int(os.getenv("JWT_EXPIRATION_HOURS", "24"))
+    auth_cache_size: int = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+    auth_cache_ttl_seconds: float = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+    user_batch_window_ms: float = float(os.getenv("USER_BATCH_WINDOW_MS", "1"))
+    user_batch_max_size: int = int(os.getenv("USER_BATCH_MAX_SIZE", "100"))
     upload_dir: str = os.getenv("UPLOAD_DIR", "uploads")
+    storage_backend: str = os.getenv("STORAGE_BACKEND", "local")
+    storage_presign_expires: int = int(os.getenv("STORAGE_PRESIGN_EXPIRES", "900"))
+    s3_endpoint_url: str = os.getenv("S3_ENDPOINT_URL", "https://s3.amazonaws.com")
+    s3_bucket: str = os.getenv("S3_BUCKET", "")
+    s3_region: str = os.getenv("S3_REGION", "us-east-1")
+    s3_access_key_id: str = os.getenv("S3_ACCESS_KEY_ID", "")
+    s3_secret_access_key: str = os.getenv("S3_SECRET_ACCESS_KEY", "")
+    s3_path_style: bool = os.getenv("S3_PATH_STYLE", "true").lower() == "true"
+    s3_public_url: str = os.getenv("S3_PUBLIC_URL", "")
+    s3_timeout_seconds: float = float(os.getenv("S3_TIMEOUT_SECONDS", "30"))
     max_upload_size: int = int(os.getenv("MAX_UPLOAD_SIZE", "10485760"))
+    max_image_pixels: int = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+    max_bulk_upload_files: int = int(os.getenv("MAX_BULK_UPLOAD_FILES", "10"))
+    upload_session_ttl_hours: int = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+    upload_session_max_per_user: int = int(os.getenv("UPLOAD_SESSION_MAX_PER_USER", "10"))
+    upload_session_sweep_seconds: float = float(os.getenv("UPLOAD_SESSION_SWEEP_SECONDS", "600"))
+    media_max_age: int = int(os.getenv("MEDIA_MAX_AGE", "31536000"))
+    media_accel_redirect: str = os.getenv("MEDIA_ACCEL_REDIRECT", "")
+    upload_chunk_size: int = int(os.getenv("UPLOAD_CHUNK_SIZE", "1048576"))
+    image_workers: int = int(os.getenv("IMAGE_WORKERS", "2"))
+    rate_limit_enabled: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    rate_limit_backend: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    rate_limit_shards: int = int(os.getenv("RATE_LIMIT_SHARDS", "64"))
+    rate_limit_max_keys: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+    rate_limit_otp_per_phone: str = os.getenv("RATE_LIMIT_OTP_PER_PHONE", "5/600")
+    rate_limit_otp_per_ip: str = os.getenv("RATE_LIMIT_OTP_PER_IP", "20/600")
+    rate_limit_verify_per_phone: str = os.getenv("RATE_LIMIT_VERIFY_PER_PHONE", "10/600")
+    rate_limit_verify_per_ip: str = os.getenv("RATE_LIMIT_VERIFY_PER_IP", "30/600")
+    rate_limit_ai_per_user: str = os.getenv("RATE_LIMIT_AI_PER_USER", "10/60")
+    rate_limit_ai_per_ip: str = os.getenv("RATE_LIMIT_AI_PER_IP", "30/60")
+    host: str = os.getenv("HOST", "0.0.0.0")
+    port: int = int(os.getenv("PORT", "8000"))
+    web_concurrency: int = int(os.getenv("WEB_CONCURRENCY", "0"))
+    worker_max_requests: int = int(os.getenv("WORKER_MAX_REQUESTS", "10000"))
+    worker_max_requests_jitter: int = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "1000"))
+    worker_max_memory_mb: int = int(os.getenv("WORKER_MAX_MEMORY_MB", "1024"))
+    graceful_timeout: int = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+    profiler_token: str = os.getenv("PROFILER_TOKEN", "")
+    profiler_sample_rate: float = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+    profiler_interval_ms: float = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+    profiler_output_dir: str = os.getenv("PROFILER_OUTPUT_DIR", "profiles")
+    profiler_max_files: int = int(os.getenv("PROFILER_MAX_FILES", "200"))
+    ai_worker_concurrency: int = int(os.getenv("AI_WORKER_CONCURRENCY", "4"))
+    inference_backend: str = os.getenv("INFERENCE_BACKEND", "stub")
+    inference_max_batch_size: int = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+    inference_max_wait_ms: float = float(os.getenv("INFERENCE_MAX_WAIT_MS", "20"))
+    inference_threads: int = int(os.getenv("INFERENCE_THREADS", "1"))
+    ai_job_poll_interval: float = float(os.getenv("AI_JOB_POLL_INTERVAL", "1.0"))
+    ai_job_lease_seconds: int = int(os.getenv("AI_JOB_LEASE_SECONDS", "300"))
+    ai_job_max_attempts: int = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+    ai_job_max_running_per_user: int = int(os.getenv("AI_JOB_MAX_RUNNING_PER_USER", "2"))
+    # Must be positive: each turn has to add credit, or no job is ever picked
+    ai_fair_share_quantum: float = Field(default=float(os.getenv("AI_FAIR_SHARE_QUANTUM", "1")), gt=0)
+    ai_job_events_poll_seconds: float = float(os.getenv("AI_JOB_EVENTS_POLL_SECONDS", "2"))
+    ai_job_retention_hours: int = int(os.getenv("AI_JOB_RETENTION_HOURS", "168"))
+    avatar_cache_max_entries: int = int(os.getenv("AVATAR_CACHE_MAX_ENTRIES", "50000"))
+    avatar_cache_ttl_hours: int = int(os.getenv("AVATAR_CACHE_TTL_HOURS", "720"))
     
     class Config:
         env_file = ".env"
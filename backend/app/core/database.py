@@ -1,16 +1,83 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Optional
+from pymongo import monitoring
+from typing import Dict, Optional
+import asyncio
 import logging
+import threading
+import time
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Track connection pool usage from pymongo's pool events
+
+    Events arrive on the driver's threads, so counters are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+
+    def _add(self, field: str, delta: int):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_size": settings.mongodb_max_pool_size,
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "waiting": self.waiting,
+                "checkout_failures": self.checkout_failures,
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_check_out_started(self, event):
+        self._add("waiting", 1)
+
+    def connection_check_out_failed(self, event):
+        self._add("waiting", -1)
+        self._add("checkout_failures", 1)
+
+    def connection_checked_out(self, event):
+        self._add("waiting", -1)
+        self._add("checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
 class Database:
     client: Optional[AsyncIOMotorClient] = None
     database = None
 
 db = Database()
+pool_monitor = PoolMonitor()
 
 async def get_database():
     return db.database
@@ -18,13 +85,27 @@ async def get_database():
 async def init_database():
     """Initialize database connection"""
     try:
-        db.client = AsyncIOMotorClient(settings.mongodb_url)
+        client_options = {
+            "maxPoolSize": settings.mongodb_max_pool_size,
+            "minPoolSize": settings.mongodb_min_pool_size,
+            "maxIdleTimeMS": settings.mongodb_max_idle_time_ms,
+            "waitQueueTimeoutMS": settings.mongodb_wait_queue_timeout_ms,
+            "serverSelectionTimeoutMS": settings.mongodb_server_selection_timeout_ms,
+            "event_listeners": [pool_monitor],
+        }
+        if settings.mongodb_compressors:
+            client_options["compressors"] = settings.mongodb_compressors
+        
+        db.client = AsyncIOMotorClient(settings.mongodb_url, **client_options)
         db.database = db.client[settings.database_name]
         
         # Test the connection
-        await db.client.admin.command('ismaster')
+        await db.client.admin.command('ping')
         logger.info(f"Connected to MongoDB at {settings.mongodb_url}")
         
+        # Open the minimum number of pooled connections before serving traffic
+        await warm_up_pool(settings.mongodb_min_pool_size)
+        
         # Create indexes
         await create_indexes()
         
@@ -32,23 +113,82 @@ async def init_database():
         logger.error(f"Failed to connect to MongoDB: {e}")
         raise
 
+async def warm_up_pool(connections: int):
+    """Open pooled connections up front by running concurrent pings"""
+    if connections <= 1:
+        return
+    await asyncio.gather(*(db.client.admin.command('ping') for _ in range(connections)))
+    logger.info(f"Warmed up MongoDB pool with {pool_monitor.stats()['open']} connections")
+
+async def ping_database() -> float:
+    """Ping MongoDB and return the round-trip latency in milliseconds"""
+    start_time = time.perf_counter()
+    await db.client.admin.command('ping')
+    return (time.perf_counter() - start_time) * 1000
+
+async def ensure_index(collection: str, keys, **options) -> bool:
+    """Create one index, logging rather than raising when it fails
+
+    Each index is created on its own, so one that conflicts with an existing
+    index or with the data does not keep the others from being created.
+    """
+    try:
+        await db.database[collection].create_index(keys, **options)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to create index {keys} on {collection}: {e}")
+        return False
+
 async def create_indexes():
     """Create necessary database indexes"""
-    try:
+    results = [
         # Users collection indexes
-        await db.database.users.create_index("phone_number", unique=True)
-        await db.database.users.create_index("user_id", unique=True)
+        await ensure_index("users", "phone_number", unique=True),
+        await ensure_index("users", "user_id", unique=True),
         
         # OTP collection indexes (TTL index for auto-expiry)
-        await db.database.otps.create_index("expires_at", expireAfterSeconds=0)
-        await db.database.otps.create_index("phone_number")
+        await ensure_index("otps", "expires_at", expireAfterSeconds=0),
+        
+        # User photos (one per user and URL, paginated newest first by _id)
+        await ensure_index("photos", [("user_id", 1), ("url", 1)], unique=True),
+        await ensure_index("photos", [("user_id", 1), ("_id", -1)]),
+        
+        # Content-addressed upload blobs
+        await ensure_index("blobs", "sha256", unique=True),
         
+        # Resumable upload sessions (lookup, per-user limit, sweeper; not TTL, the files go too)
+        await ensure_index("upload_sessions", "upload_id", unique=True),
+        await ensure_index("upload_sessions", [("user_id", 1), ("expires_at", 1)]),
+        await ensure_index("upload_sessions", "expires_at"),
+        
+        # AI job queue indexes (claim order, per-user fair-share claims, lookup, TTL for finished jobs)
+        await ensure_index("ai_jobs", "job_id", unique=True),
+        await ensure_index("ai_jobs", [("status", 1), ("created_at", 1)]),
+        await ensure_index("ai_jobs", [("status", 1), ("user_id", 1), ("priority", 1), ("created_at", 1)]),
+        await ensure_index("ai_jobs", "expires_at", expireAfterSeconds=0),
+        await ensure_index("ai_jobs", "active_key", unique=True, sparse=True),
+        
+        # Avatar result cache (lookup, LRU eviction, TTL)
+        await ensure_index("avatar_cache", "key", unique=True),
+        await ensure_index("avatar_cache", "last_used_at"),
+        await ensure_index("avatar_cache", "expires_at", expireAfterSeconds=0),
+    ]
+    
+    # One OTP per phone number; deployments that had a plain index or duplicate
+    # OTPs get it from migrations.otp_phone_unique
+    if not await ensure_index("otps", "phone_number", unique=True):
+        logger.error("Run `python -m migrations.otp_phone_unique` to deduplicate OTPs and replace the old phone_number index")
+        results.append(False)
+    
+    if all(results):
         logger.info("Database indexes created successfully")
-    except Exception as e:
-        logger.error(f"Failed to create indexes: {e}")
+    else:
+        logger.error(f"{results.count(False)} database indexes could not be created")
 
 async def close_database():
     """Close database connection"""
     if db.client:
         db.client.close()
+        db.client = None
+        db.database = None
         logger.info("Disconnected from MongoDB")
\ No newline at end of file
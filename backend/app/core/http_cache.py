@@ -0,0 +1,35 @@
+from fastapi import Request
+from fastapi.responses import Response
+from typing import Any, Optional
+import hashlib
+import json
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header against an ETag (weak comparison, per RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+class CachedJSON:
+    """JSON payload serialized once, served with a strong ETag and Cache-Control
+
+    Meant for read-mostly routes: build one instance when the data changes and
+    return ``instance.response(request)`` from the handler. Clients that send a
+    matching If-None-Match get an empty 304.
+    """
+
+    def __init__(self, content: Any, max_age: int = 3600):
+        self.body = json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self.headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={max_age}",
+        }
+
+    def response(self, request: Request) -> Response:
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=self.headers)
+        return Response(content=self.body, media_type="application/json", headers=self.headers)
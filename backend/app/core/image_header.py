@@ -0,0 +1,183 @@
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+import struct
+
+# Give up looking for the dimensions after this much data (a JPEG's EXIF and ICC
+# segments come before its frame header); the decoder's own limit still applies
+HEADER_SCAN_LIMIT = 512 * 1024
+
+class ImageInfo(NamedTuple):
+    content_type: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+class InvalidImageHeader(Exception):
+    """Raised when the first bytes are not a JPEG, PNG or WebP header"""
+
+class UnknownImageFormat(InvalidImageHeader):
+    """Raised when the magic bytes match none of the accepted formats"""
+
+class TooManyPixels(Exception):
+    """Raised when the header declares more pixels than MAX_IMAGE_PIXELS"""
+
+    def __init__(self, width: int, height: int, limit: int):
+        super().__init__(f"{width}x{height} image exceeds {limit} pixels")
+        self.width = width
+        self.height = height
+
+def detect_format(head: bytes) -> Optional[str]:
+    """Content type from magic bytes (needs the first 12 bytes)"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+# Each returns (width, height), or None while more bytes are needed
+
+def _png_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 24:
+        return None
+    if head[12:16] != b"IHDR":
+        raise InvalidImageHeader("PNG without IHDR chunk")
+    return struct.unpack(">II", head[16:24])
+
+def _webp_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 30:
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        if head[23:26] != b"\x9d\x01\x2a":
+            raise InvalidImageHeader("Bad VP8 frame header")
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        if head[20] != 0x2F:
+            raise InvalidImageHeader("Bad VP8L signature")
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    raise InvalidImageHeader("Unknown WebP chunk")
+
+# Start-of-frame markers; C4 (DHT), C8 (JPG) and CC (DAC) share the range but are not frames
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def _exif_orientation(segment: bytes) -> int:
+    """EXIF orientation tag from an APP1 segment body, 1 when absent or unreadable"""
+    if not segment.startswith(b"Exif\x00\x00"):
+        return 1
+    tiff = segment[6:]
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None or len(tiff) < 8:
+        return 1
+    ifd = struct.unpack(order + "I", tiff[4:8])[0]
+    if ifd + 2 > len(tiff):
+        return 1
+    count = struct.unpack(order + "H", tiff[ifd:ifd + 2])[0]
+    for entry in range(ifd + 2, min(ifd + 2 + 12 * count, len(tiff) - 11), 12):
+        if struct.unpack(order + "H", tiff[entry:entry + 2])[0] == 0x0112:
+            return struct.unpack(order + "H", tiff[entry + 8:entry + 10])[0]
+    return 1
+
+def _jpeg_size(head: bytes) -> Optional[Tuple[int, int]]:
+    orientation = 1
+    i = 2
+    while True:
+        if i + 4 > len(head):
+            return None
+        if head[i] != 0xFF:
+            raise InvalidImageHeader("Corrupt JPEG marker")
+        marker = head[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise InvalidImageHeader("JPEG scan data before a frame header")
+        length = struct.unpack(">H", head[i + 2:i + 4])[0]
+        if length < 2:
+            raise InvalidImageHeader("Corrupt JPEG segment length")
+        if marker in _JPEG_SOF:
+            if i + 9 > len(head):
+                return None
+            height, width = struct.unpack(">HH", head[i + 5:i + 9])
+            # Orientations 5-8 rotate by 90 degrees; report the size as displayed
+            return (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+        if marker == 0xE1 and orientation == 1:
+            if i + 2 + length > len(head):
+                return None
+            orientation = _exif_orientation(head[i + 4:i + 2 + length])
+        i += 2 + length
+
+_PARSERS: Dict[str, Callable[[bytes], Optional[Tuple[int, int]]]] = {
+    "image/jpeg": _jpeg_size,
+    "image/png": _png_size,
+    "image/webp": _webp_size,
+}
+
+class ImageSniffer:
+    """Inspect an upload's first bytes as they arrive
+
+    Detects the real format from magic bytes and reads the dimensions from the
+    header alone, so a non-image or a decompression bomb is rejected before
+    the rest of the body is stored or decoded.
+    """
+
+    def __init__(self, max_pixels: int):
+        self.max_pixels = max_pixels
+        self.content_type: Optional[str] = None
+        self.size: Optional[Tuple[int, int]] = None
+        self._head = bytearray()
+        self._done = False
+
+    @property
+    def done(self) -> bool:
+        """Whether the header has been read (later chunks are ignored)"""
+        return self._done
+
+    def feed(self, chunk: bytes):
+        """Inspect the next chunk; raises InvalidImageHeader or TooManyPixels"""
+        if self._done:
+            return
+        self._head += chunk[:HEADER_SCAN_LIMIT - len(self._head)]
+        head = bytes(self._head)
+
+        if self.content_type is None:
+            if len(head) < 12:
+                return
+            self.content_type = detect_format(head)
+            if self.content_type is None:
+                raise UnknownImageFormat("Not a JPEG, PNG or WebP image")
+
+        try:
+            size = _PARSERS[self.content_type](head)
+        except struct.error:
+            raise InvalidImageHeader("Truncated image header")
+        if size is None:
+            if len(head) >= HEADER_SCAN_LIMIT:
+                # Dimensions unknown; leave it to the decoder's limit
+                self._done = True
+                self._head = bytearray()
+            return
+
+        width, height = size
+        if width <= 0 or height <= 0:
+            raise InvalidImageHeader(f"Invalid image dimensions {width}x{height}")
+        if width * height > self.max_pixels:
+            raise TooManyPixels(width, height, self.max_pixels)
+        self.size = size
+        self._done = True
+        self._head = bytearray()
+
+    def result(self) -> ImageInfo:
+        """What was learned, once the whole body has been fed"""
+        if not self._done:
+            raise InvalidImageHeader("Upload ended inside the image header")
+        width, height = self.size or (None, None)
+        return ImageInfo(self.content_type, width, height)
@@ -0,0 +1,196 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class InferenceError(Exception):
+    """Raised when the backend fails a batch or returns the wrong number of outputs"""
+
+class InferenceBackend(ABC):
+    """Runs a model on a batch of inputs; one call per micro-batch"""
+
+    @abstractmethod
+    def run_batch(self, model: str, inputs: List[Dict[str, Any]]) -> List[Any]:
+        """One output per input, in order (blocking; runs on the inference threads)
+
+        An output may be an exception instance to fail just that input.
+        """
+
+    def close(self):
+        """Release resources held by the backend"""
+
+class StubBackend(InferenceBackend):
+    """Deterministic stand-in model with the cost profile of a batched CPU model
+
+    A batch costs a fixed overhead (loading weights into cache, setting up the
+    graph) plus a smaller amount per input, so larger batches are cheaper per
+    item. The output is a digest of the model and input.
+    """
+
+    batch_seconds = 0.4
+    item_seconds = 0.1
+
+    def run_batch(self, model: str, inputs: List[Dict[str, Any]]) -> List[Any]:
+        time.sleep(self.batch_seconds + self.item_seconds * len(inputs))
+        return [
+            {"output": hashlib.sha256(json.dumps({"model": model, "input": item}, sort_keys=True).encode()).hexdigest()}
+            for item in inputs
+        ]
+
+def create_inference_backend() -> InferenceBackend:
+    """The backend selected by INFERENCE_BACKEND"""
+    if settings.inference_backend == "stub":
+        return StubBackend()
+    raise ValueError(f"Unknown INFERENCE_BACKEND: {settings.inference_backend}")
+
+class PendingInference(NamedTuple):
+    inputs: Dict[str, Any]
+    future: asyncio.Future
+    enqueued_at: float
+
+class InferenceScheduler:
+    """Groups concurrent inference requests for the same model into micro-batches
+
+    Each model has its own queue and batching loop. A batch is sent to the
+    backend once it holds INFERENCE_MAX_BATCH_SIZE requests or its oldest
+    request has waited INFERENCE_MAX_WAIT_MS, whichever comes first; while a
+    batch runs, the next one fills up. Under light load a request waits at most
+    the window, under heavy load the backend always gets full batches.
+    """
+
+    def __init__(self):
+        self._backend: Optional[InferenceBackend] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[str, Deque[PendingInference]] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._loops: Dict[str, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def backend(self) -> InferenceBackend:
+        if self._backend is None:
+            self._backend = create_inference_backend()
+        return self._backend
+
+    async def submit(self, model: str, inputs: Dict[str, Any]) -> Any:
+        """Run one input through the model as part of the next batch for it"""
+        loop = asyncio.get_running_loop()
+        if model not in self._loops:
+            self._pending[model] = deque()
+            self._wakeups[model] = asyncio.Event()
+            self._stats[model] = {"requests": 0, "batches": 0, "largest_batch": 0, "queue_wait_seconds": 0.0}
+            self._loops[model] = loop.create_task(self._batch_loop(model), name=f"inference-{model}")
+
+        future = loop.create_future()
+        self._pending[model].append(PendingInference(inputs, future, time.monotonic()))
+        self._stats[model]["requests"] += 1
+        self._wakeups[model].set()
+        return await future
+
+    async def _batch_loop(self, model: str):
+        pending = self._pending[model]
+        wakeup = self._wakeups[model]
+        max_size = settings.inference_max_batch_size
+        max_wait = settings.inference_max_wait_ms / 1000
+
+        while True:
+            while not pending:
+                wakeup.clear()
+                await wakeup.wait()
+
+            # The window starts when the oldest request arrived, so requests that
+            # queued behind the previous batch are sent without further delay
+            deadline = pending[0].enqueued_at + max_wait
+            while len(pending) < max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [pending.popleft() for _ in range(min(max_size, len(pending)))]
+            # Requests whose caller gave up are not run
+            batch = [item for item in batch if not item.future.done()]
+            if batch:
+                await self._run(model, batch)
+
+    async def _run(self, model: str, batch: List[PendingInference]):
+        stats = self._stats[model]
+        started = time.monotonic()
+        stats["batches"] += 1
+        stats["largest_batch"] = max(stats["largest_batch"], len(batch))
+        stats["queue_wait_seconds"] += sum(started - item.enqueued_at for item in batch)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=settings.inference_threads, thread_name_prefix="inference")
+        try:
+            outputs = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.backend.run_batch, model, [item.inputs for item in batch]
+            )
+            if len(outputs) != len(batch):
+                raise InferenceError(f"Model {model} returned {len(outputs)} outputs for {len(batch)} inputs")
+        except asyncio.CancelledError:
+            self._fail(batch, InferenceError("Inference scheduler stopped"))
+            raise
+        except Exception as e:
+            logger.error(f"Inference batch of {len(batch)} for model {model} failed: {e}")
+            self._fail(batch, e)
+            return
+
+        for item, output in zip(batch, outputs):
+            if isinstance(output, Exception):
+                self._fail([item], output)
+            elif not item.future.done():
+                item.future.set_result(output)
+        logger.debug(f"Ran batch of {len(batch)} for model {model} in {time.monotonic() - started:.3f}s")
+
+    def _fail(self, batch: List[PendingInference], error: Exception):
+        for item in batch:
+            if not item.future.done():
+                item.future.set_exception(error)
+                # Mark it retrieved in case the caller already gave up
+                item.future.exception()
+
+    async def stop(self):
+        """Stop the batching loops, failing requests that have not run yet"""
+        loops = list(self._loops.values())
+        for task in loops:
+            task.cancel()
+        await asyncio.gather(*loops, return_exceptions=True)
+
+        for pending in self._pending.values():
+            self._fail(list(pending), InferenceError("Inference scheduler stopped"))
+        self._loops, self._pending, self._wakeups = {}, {}, {}
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per model: requests, batches, largest batch, requests waiting and total queue wait"""
+        return {
+            model: {
+                **stats,
+                "queue_wait_seconds": round(stats["queue_wait_seconds"], 3),
+                "pending": len(self._pending.get(model, ())),
+            }
+            for model, stats in self._stats.items()
+        }
+
+# Scheduler shared by all AI job handlers in this process
+inference = InferenceScheduler()
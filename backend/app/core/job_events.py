@@ -0,0 +1,112 @@
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+import asyncio
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.config import settings
+from app.core.jobs import JobQueue, JobStatus
+
+# Sent when nothing else was, so proxies keep the connection and dead clients are noticed
+HEARTBEAT_SECONDS = 15
+
+# Clients reconnecting after a drop wait this long (SSE "retry")
+RECONNECT_MS = 3000
+
+Event = Tuple[str, Dict[str, Any]]
+
+class JobEventState:
+    """What a client was already told, so only changes become events"""
+
+    def __init__(self):
+        self.run: Optional[Tuple[str, int]] = None
+        self.percent: Optional[float] = None
+        self.previews: Set[Tuple[str, str]] = set()
+
+    def diff(self, job: Dict[str, Any]):
+        """Events for the job's changes since the last call"""
+        events = []
+        status = job["status"]
+        run = (status, job.get("attempts", 0))
+        if run != self.run and status in (JobStatus.QUEUED, JobStatus.RUNNING):
+            self.run = run
+            if status == JobStatus.QUEUED:
+                events.append(("queued", {"job_id": job["job_id"], "priority": job.get("priority"), "created_at": job["created_at"]}))
+            else:
+                events.append(("started", {"job_id": job["job_id"], "started_at": job.get("started_at"), "attempt": job.get("attempts")}))
+
+        # Partial outputs, e.g. {"avatars": {"casual": {...}}}, once each
+        progress = job.get("progress") or {}
+        for field, values in progress.items():
+            if not isinstance(values, dict):
+                continue
+            for key, value in values.items():
+                if (field, key) not in self.previews:
+                    self.previews.add((field, key))
+                    events.append(("preview", {"job_id": job["job_id"], field: {key: value}}))
+
+        percent = progress.get("percent")
+        if percent is not None and percent != self.percent:
+            self.percent = percent
+            events.append(("progress", {"job_id": job["job_id"], "percent": percent}))
+
+        if status in (JobStatus.COMPLETED, JobStatus.FAILED):
+            events.append(("done", {
+                "job_id": job["job_id"],
+                "status": status,
+                "result": job.get("result"),
+                "error": job.get("error"),
+                "finished_at": job.get("finished_at"),
+            }))
+        return events
+
+async def job_events(queue: JobQueue, job_id: str) -> AsyncIterator[Optional[Event]]:
+    """Progress of a job as (event, data) pairs, ending with "done"; None is a heartbeat
+
+    Events: queued, started (again on a retry), progress (percent), preview
+    (each partial output) and done (status, result, error). A client joining
+    late first gets the events describing the job's current state. The job
+    document is the source of truth: a change made in this process is sent at
+    once, one made by a worker in another process within
+    AI_JOB_EVENTS_POLL_SECONDS.
+    """
+    state = JobEventState()
+    last_sent = time.monotonic()
+    with queue.watch(job_id) as changed:
+        while True:
+            # Cleared before reading, so a change made meanwhile triggers another read
+            changed.clear()
+            job = await queue.get(job_id)
+            if job is None:
+                # Expired or deleted while watched
+                yield "done", {"job_id": job_id, "status": None, "result": None, "error": "Job not found", "finished_at": None}
+                return
+
+            events = state.diff(job)
+            for event in events:
+                yield event
+            if events:
+                last_sent = time.monotonic()
+                if events[-1][0] == "done":
+                    return
+
+            try:
+                await asyncio.wait_for(changed.wait(), settings.ai_job_events_poll_seconds)
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_sent >= HEARTBEAT_SECONDS:
+                    last_sent = time.monotonic()
+                    yield None
+
+def event_json(data: Dict[str, Any]) -> str:
+    return json.dumps(jsonable_encoder(data), separators=(",", ":"))
+
+async def server_sent_events(queue: JobQueue, job_id: str) -> AsyncIterator[str]:
+    """job_events in text/event-stream framing"""
+    yield f"retry: {RECONNECT_MS}\n\n"
+    async for item in job_events(queue, job_id):
+        if item is None:
+            yield ": heartbeat\n\n"
+            continue
+        event, data = item
+        yield f"event: {event}\ndata: {event_json(data)}\n\n"
@@ -0,0 +1,445 @@
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set
+import asyncio
+import logging
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.core.database import db
+from app.core.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+# Queue waits range from milliseconds when idle to minutes for background work under load
+QUEUE_WAIT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class JobPriority:
+    INTERACTIVE = "interactive"
+    BACKGROUND = "background"
+
+# Claimed strictly in this order: background work only runs when no interactive job can
+PRIORITIES = (JobPriority.INTERACTIVE, JobPriority.BACKGROUND)
+
+class DeficitRoundRobin:
+    """Chooses whose job runs next so users share workers equally by job cost
+
+    Deficit round robin: users take turns, each turn adds QUANTUM to the user's
+    credit and the user's oldest job runs once the credit covers its cost, so a
+    job of five style passes waits for five single-pass jobs of other users. A
+    user with nothing eligible is dropped from the ring and loses their credit.
+    """
+
+    def __init__(self, quantum: float):
+        if quantum <= 0:
+            raise ValueError("Fair share quantum must be positive")
+        self.quantum = quantum
+        # Insertion order is the ring order
+        self._deficits: Dict[Optional[str], float] = {}
+        self._current: Optional[str] = None
+
+    def pick(self, costs: Dict[Optional[str], float]) -> Optional[str]:
+        """The user to serve next, given the cost of each eligible user's oldest job
+
+        The user is not charged until charge() is called for the job actually
+        claimed, so losing that job to another process costs them nothing.
+        """
+        for user_id in [user_id for user_id in self._deficits if user_id not in costs]:
+            del self._deficits[user_id]
+        for user_id in costs:
+            self._deficits.setdefault(user_id, 0.0)
+
+        ring = list(self._deficits)
+        if self._current in self._deficits:
+            index = ring.index(self._current)
+        else:
+            index = 0
+            self._deficits[ring[0]] += self.quantum
+        while self._deficits[ring[index]] < costs[ring[index]]:
+            index = (index + 1) % len(ring)
+            self._deficits[ring[index]] += self.quantum
+
+        self._current = ring[index]
+        return self._current
+
+    def charge(self, user_id: Optional[str], cost: float):
+        """Spend the user's credit on a job claimed for them"""
+        if user_id in self._deficits:
+            self._deficits[user_id] -= cost
+
+class JobQueue:
+    """Background job queue persisted in MongoDB and drained by a pool of workers
+
+    Jobs are claimed atomically with a lease, so several API processes can share
+    one collection and a job abandoned by a crashed worker is picked up again
+    once its lease runs out. Workers renew the lease while the handler runs,
+    and only the latest attempt may record progress or the outcome.
+
+    Queued jobs are dispatched fairly rather than oldest first: interactive jobs
+    before background ones, users within a priority class in deficit round
+    robin by job cost, and no user gets more than AI_JOB_MAX_RUNNING_PER_USER
+    jobs running at once across processes.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self._handlers: Dict[str, JobHandler] = {}
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        # Claims in one process are serialized so the fair-share choice and per-user caps hold between its workers
+        self._claim_lock = asyncio.Lock()
+        self._fair_share = {priority: DeficitRoundRobin(settings.ai_fair_share_quantum) for priority in PRIORITIES}
+        self._watchers: Dict[str, Set[asyncio.Event]] = {}
+        self._claimed = {priority: 0 for priority in PRIORITIES}
+        self._waited = {priority: 0.0 for priority in PRIORITIES}
+        self.running = 0
+        self.queue_wait = Histogram(
+            f"{collection_name}_queue_wait_seconds",
+            "Time jobs waited between being queued and being claimed",
+            ("priority",),
+            QUEUE_WAIT_BUCKETS
+        )
+
+    @property
+    def collection(self):
+        return db.database[self.collection_name]
+
+    def register(self, kind: str, handler: JobHandler):
+        """Register the coroutine that executes jobs of the given kind"""
+        self._handlers[kind] = handler
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        user_id: Optional[str] = None,
+        dedupe_key: Optional[str] = None,
+        priority: str = JobPriority.INTERACTIVE,
+        cost: float = 1,
+    ) -> Dict[str, Any]:
+        """Persist a new job and wake an idle worker
+
+        With a dedupe_key, a queued or running job of the same kind, user and key
+        is returned instead of creating another one (e.g. on a client retry).
+        The cost (e.g. number of model passes) is what fair sharing between
+        users is measured in.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown job priority '{priority}'")
+
+        now = datetime.utcnow()
+        job_doc = {
+            "job_id": str(uuid.uuid4()),
+            "kind": kind,
+            "user_id": user_id,
+            "payload": payload,
+            "status": JobStatus.QUEUED,
+            "priority": priority,
+            "cost": cost,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if dedupe_key:
+            job_doc["dedupe_key"] = dedupe_key
+            existing = await self._insert_unless_active(job_doc, f"{kind}:{user_id}:{dedupe_key}")
+            if existing:
+                return {**existing, "deduplicated": True}
+        else:
+            await self.collection.insert_one(job_doc)
+
+        if self._wakeup:
+            self._wakeup.set()
+        return job_doc
+
+    async def _insert_unless_active(self, job_doc: Dict[str, Any], active_key: str) -> Optional[Dict[str, Any]]:
+        """Insert the job unless one with the same active_key is queued or running; return that one
+
+        active_key is only set until a job finishes, and its unique index makes
+        the check and the insert one atomic upsert, so concurrent double-taps
+        cannot both create a job.
+        """
+        while True:
+            try:
+                return await self.collection.find_one_and_update(
+                    {"active_key": active_key},
+                    {"$setOnInsert": job_doc},
+                    projection={"_id": 0, "job_id": 1, "status": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+            except DuplicateKeyError:
+                # A concurrent enqueue inserted it first; the next attempt finds that job
+                continue
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch a job by id"""
+        return await self.collection.find_one({"job_id": job_id}, {"_id": 0, "payload": 0})
+
+    async def set_progress(self, job: Dict[str, Any], field: str, value: Any):
+        """Record partial output of a running job, visible through get() before it finishes
+
+        Ignored once the job was claimed again, so a run that lost its lease
+        cannot overwrite the progress of the one that replaced it.
+        """
+        await self.collection.update_one(
+            self._attempt_filter(job),
+            {"$set": {f"progress.{field}": value, "updated_at": datetime.utcnow()}}
+        )
+        self._notify(job["job_id"])
+
+    @contextmanager
+    def watch(self, job_id: str) -> Iterator[asyncio.Event]:
+        """An event set whenever this process updates the job; the watcher clears it
+
+        Only a hint to re-read the job: a job running in another process
+        changes without it, so watchers also re-read periodically.
+        """
+        event = asyncio.Event()
+        self._watchers.setdefault(job_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            watchers = self._watchers.get(job_id)
+            if watchers is not None:
+                watchers.discard(event)
+                if not watchers:
+                    del self._watchers[job_id]
+
+    def _notify(self, job_id: str):
+        for event in self._watchers.get(job_id, ()):
+            event.set()
+
+    async def start(self, concurrency: int):
+        """Start the worker pool"""
+        if self._workers:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker_loop(), name=f"{self.collection_name}-worker-{i}")
+            for i in range(concurrency)
+        ]
+        logger.info(f"Started {concurrency} workers for job queue '{self.collection_name}'")
+
+    async def stop(self, timeout: float = 30.0):
+        """Stop the worker pool, letting running jobs finish within the timeout"""
+        if not self._workers:
+            return
+        self._stopping = True
+        self._wakeup.set()
+
+        done, pending = await asyncio.wait(self._workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Cancelled jobs keep their lease and are retried once it expires
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"Cancelled {len(pending)} workers of job queue '{self.collection_name}' on shutdown")
+
+        self._workers = []
+        logger.info(f"Stopped job queue '{self.collection_name}'")
+
+    async def _worker_loop(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Failed to claim job from '{self.collection_name}': {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.ai_job_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        async with self._claim_lock:
+            # Jobs abandoned by a crashed worker go first; they have waited longest
+            job = await self._claim_where({"status": JobStatus.RUNNING, "lease_expires_at": {"$lt": datetime.utcnow()}})
+            if job is None:
+                job = await self._claim_fair()
+        if job is None:
+            return None
+
+        priority = job.get("priority") or JobPriority.INTERACTIVE
+        wait = (job["started_at"] - job["created_at"]).total_seconds()
+        self.queue_wait.observe((priority,), wait)
+        self._claimed[priority] += 1
+        self._waited[priority] += wait
+
+        if job["attempts"] > settings.ai_job_max_attempts:
+            await self._finish(job, JobStatus.FAILED, error="Job exceeded maximum attempts")
+            return None
+        return job
+
+    async def _claim_fair(self) -> Optional[Dict[str, Any]]:
+        """Claim the queued job fair sharing says is next, or None if no user may run one"""
+        now = datetime.utcnow()
+        # Per user, status and priority: the number of jobs and the cost of the oldest
+        groups = await self.collection.aggregate([
+            {"$match": {"$or": [
+                {"status": JobStatus.QUEUED},
+                {"status": JobStatus.RUNNING, "lease_expires_at": {"$gte": now}},
+            ]}},
+            {"$sort": {"created_at": 1}},
+            {"$group": {
+                "_id": {
+                    "user_id": "$user_id",
+                    "status": "$status",
+                    "priority": {"$ifNull": ["$priority", JobPriority.INTERACTIVE]},
+                },
+                "count": {"$sum": 1},
+                "cost": {"$first": {"$ifNull": ["$cost", 1]}},
+            }},
+        ]).to_list(None)
+
+        running = Counter()
+        heads: Dict[str, Dict[Optional[str], float]] = {priority: {} for priority in PRIORITIES}
+        for group in groups:
+            key = group["_id"]
+            if key["status"] == JobStatus.RUNNING:
+                running[key.get("user_id")] += group["count"]
+            elif key["priority"] in heads:
+                heads[key["priority"]][key.get("user_id")] = group["cost"]
+
+        for priority in PRIORITIES:
+            # Jobs without a user are never capped
+            costs = {
+                user_id: cost for user_id, cost in heads[priority].items()
+                if user_id is None or running[user_id] < settings.ai_job_max_running_per_user
+            }
+            while costs:
+                user_id = self._fair_share[priority].pick(costs)
+                job = await self._claim_where({
+                    "status": JobStatus.QUEUED,
+                    "user_id": user_id,
+                    # Jobs queued before priorities existed count as interactive
+                    "priority": {"$in": [JobPriority.INTERACTIVE, None]} if priority == JobPriority.INTERACTIVE else priority,
+                })
+                if job is not None:
+                    self._fair_share[priority].charge(user_id, job.get("cost", 1))
+                    return job
+                # Another process claimed that user's last job in the meantime
+                del costs[user_id]
+        return None
+
+    async def _claim_where(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Lease the oldest job matching the query"""
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": JobStatus.RUNNING,
+                    "started_at": now,
+                    "updated_at": now,
+                    "lease_expires_at": now + timedelta(seconds=settings.ai_job_lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _run(self, job: Dict[str, Any]):
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            await self._finish(job, JobStatus.FAILED, error=f"Unknown job kind '{job['kind']}'")
+            return
+
+        self.running += 1
+        self._notify(job["job_id"])
+        heartbeat = asyncio.create_task(self._renew_lease(job), name=f"lease-{job['job_id']}")
+        try:
+            try:
+                result = await handler(job)
+            finally:
+                heartbeat.cancel()
+        except Exception as e:
+            logger.error(f"Job {job['job_id']} failed: {e}")
+            await self._finish(job, JobStatus.FAILED, error=str(e))
+        else:
+            await self._finish(job, JobStatus.COMPLETED, result=result)
+        finally:
+            self.running -= 1
+
+    async def _renew_lease(self, job: Dict[str, Any]):
+        """Extend the lease of a running job every third of its length until cancelled"""
+        interval = settings.ai_job_lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = await self.collection.update_one(
+                    {**self._attempt_filter(job), "status": JobStatus.RUNNING},
+                    {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=settings.ai_job_lease_seconds)}}
+                )
+            except Exception as e:
+                # The next beat tries again; the lease outlasts two missed ones
+                logger.error(f"Failed to renew lease of job {job['job_id']}: {e}")
+                continue
+            if not result.matched_count:
+                logger.warning(f"Job {job['job_id']} lost its lease (attempt {job['attempts']}); its result will be discarded")
+                return
+
+    @staticmethod
+    def _attempt_filter(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Matches the job only while it is still on the attempt this worker claimed"""
+        return {"job_id": job["job_id"], "attempts": job["attempts"]}
+
+    async def _finish(self, job: Dict[str, Any], status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        now = datetime.utcnow()
+        update = {
+            "status": status,
+            "result": result,
+            "error": error,
+            "finished_at": now,
+            "updated_at": now,
+            "expires_at": now + timedelta(hours=settings.ai_job_retention_hours),
+        }
+        if status == JobStatus.COMPLETED:
+            update["progress.percent"] = 100
+        result = await self.collection.update_one(
+            self._attempt_filter(job),
+            {"$set": update, "$unset": {"lease_expires_at": "", "active_key": ""}}
+        )
+        if not result.matched_count:
+            logger.warning(f"Discarded {status} outcome of job {job['job_id']}: attempt {job['attempts']} was superseded")
+        self._notify(job["job_id"])
+
+    def stats(self) -> Dict[str, Any]:
+        """Jobs running in this process, jobs watched by its clients, and per priority the jobs it claimed and their mean queue wait"""
+        return {
+            "running": self.running,
+            "watched": len(self._watchers),
+            **{
+                priority: {
+                    "claimed": self._claimed[priority],
+                    "mean_wait_seconds": round(self._waited[priority] / self._claimed[priority], 3) if self._claimed[priority] else 0.0,
+                }
+                for priority in PRIORITIES
+            },
+        }
+
+# Queue for AI generation work
+ai_jobs = JobQueue("ai_jobs")
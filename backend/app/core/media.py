@@ -0,0 +1,129 @@
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Mapping, NamedTuple, Optional
+import os
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+class ByteRange(NamedTuple):
+    start: int
+    end: int  # inclusive, as in Content-Range
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+class RangeNotSatisfiable(Exception):
+    """Raised for a well-formed Range header that selects no bytes of the file"""
+
+def parse_range(header: str, size: int) -> Optional[ByteRange]:
+    """Parse a single-range ``Range: bytes=...`` header
+
+    Returns None when the header should be ignored (malformed, another unit,
+    or several ranges, which are answered with the whole file).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            return ByteRange(max(0, size - suffix), size - 1)
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return ByteRange(start, min(end, size - 1))
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+def not_modified_since(if_modified_since: str, mtime: float) -> bool:
+    """True when the file has not changed since the If-Modified-Since date"""
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have one-second resolution
+    return since is not None and int(mtime) <= since.timestamp()
+
+class FileRangeResponse(Response):
+    """Send a byte range of a file, zero-copy when the ASGI server offers sendfile
+
+    Without the zero-copy extension the range is read in large chunks on a worker
+    thread. ``send_body=False`` sends headers only, for HEAD requests.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: Path,
+        byte_range: ByteRange,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        send_body: bool = True,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.path = path
+        self.byte_range = byte_range
+        self.status_code = status_code
+        self.media_type = media_type
+        self.send_body = send_body
+        self.background = background
+        self.init_headers(headers)
+        self.headers["content-length"] = str(byte_range.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        if not self.send_body or self.byte_range.length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+            with open(self.path, "rb", buffering=0) as file:
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": file,
+                    "offset": self.byte_range.start,
+                    "count": self.byte_range.length,
+                    "more_body": False,
+                })
+        else:
+            await self._send_chunks(send)
+
+        if self.background is not None:
+            await self.background()
+
+    async def _send_chunks(self, send: Send):
+        fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+        try:
+            offset = self.byte_range.start
+            remaining = self.byte_range.length
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(self.chunk_size, remaining), offset)
+                if not chunk:
+                    # File shrank underneath us; end the body rather than hang the client
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
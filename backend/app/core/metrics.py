@@ -0,0 +1,178 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Awaitable, Callable, Dict, Iterable, List, Sequence, Tuple
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+Labels = Tuple[str, ...]
+
+# Latency buckets in seconds, from sub-millisecond handlers up to long uploads
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]:
+        """Exposition lines of the metric's current values"""
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def set(self, labels: Labels, value: float):
+        """Set the value directly, e.g. to mirror a count maintained elsewhere"""
+        self._values[labels] = value
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, labels: Labels = (), amount: float = 1.0):
+        self.inc(labels, -amount)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [per-bucket counts (+Inf last), sum]
+        self._values: Dict[Labels, List] = {}
+
+    def observe(self, labels: Labels, value: float):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+class Registry:
+    """Metrics exposed at /metrics, plus collectors refreshed on every scrape"""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]):
+        """Register a coroutine that updates gauges right before they are rendered"""
+        self._collectors.append(collector)
+
+    async def render(self) -> str:
+        for collector in self._collectors:
+            await collector()
+        return "".join(metric.render() for metric in self._metrics)
+
+registry = Registry()
+
+http_requests = registry.register(Counter("http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")))
+http_latency = registry.register(Histogram("http_request_duration_seconds", "HTTP request latency", ("route", "method")))
+http_in_flight = registry.register(Gauge("http_requests_in_flight", "HTTP requests currently being served"))
+http_request_size = registry.register(Histogram("http_request_size_bytes", "HTTP request body size (from Content-Length)", ("route",), SIZE_BUCKETS))
+http_response_size = registry.register(Histogram("http_response_size_bytes", "HTTP response body size", ("route",), SIZE_BUCKETS))
+
+class MetricsMiddleware:
+    """Record per-route latency, status, size and in-flight metrics
+
+    Routes are labelled with their path template (e.g. /ai/jobs/{job_id}) so the
+    number of series stays bounded; requests that match no route share one label.
+    """
+
+    def __init__(self, app: ASGIApp, route_paths: Dict[Callable, str]):
+        self.app = app
+        self.route_paths = route_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        request_size = 0
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                request_size = int(value) if value.isdigit() else 0
+                break
+
+        status = 500
+        response_size = 0
+
+        async def send_wrapper(message: Message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start_time
+            http_in_flight.dec()
+
+            # The router records the matched endpoint in the scope
+            route = self.route_paths.get(scope.get("endpoint"), "unmatched")
+            http_requests.inc((route, method, str(status)))
+            http_latency.observe((route, method), duration)
+            http_request_size.observe((route,), request_size)
+            http_response_size.observe((route,), response_size)
+
+def route_paths(routes) -> Dict[Callable, str]:
+    """Map each route's endpoint to its path template"""
+    paths = {}
+    for route in routes:
+        endpoint = getattr(route, "endpoint", None) or getattr(route, "app", None)
+        if endpoint is not None and hasattr(route, "path"):
+            paths[endpoint] = route.path
+    return paths
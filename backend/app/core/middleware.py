@@ -0,0 +1,57 @@
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Dict, Optional
+
+class RequestBodyLimitMiddleware:
+    """Reject request bodies above a size limit before they are fully received
+
+    Limits are given per path prefix and the longest matching prefix applies.
+    Requests that declare a larger Content-Length are answered with 413 without
+    reading the body; chunked bodies are cut off as soon as the running total
+    goes over the limit.
+    """
+
+    def __init__(self, app: ASGIApp, limits: Dict[str, int]):
+        self.app = app
+        # Longest prefix first, so the most specific limit wins
+        self.limits = sorted(limits.items(), key=lambda item: -len(item[0]))
+
+    def limit_for(self, path: str) -> Optional[int]:
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        max_body_size = self.limit_for(scope["path"]) if scope["type"] == "http" else None
+        if max_body_size is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > max_body_size:
+                    response = JSONResponse(
+                        {"detail": f"Request body too large. Maximum size is {max_body_size} bytes"},
+                        status_code=413,
+                    )
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Request body too large. Maximum size is {max_body_size} bytes",
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,241 @@
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, NamedTuple, Optional
+from urllib.parse import quote, urlencode
+import hashlib
+import hmac
+import logging
+import os
+import time
+import uuid
+
+import aiofiles
+import anyio
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Local scratch space (under UPLOAD_DIR) for files on their way into or out of the store
+SCRATCH_DIR = ".tmp"
+
+class ObjectInfo(NamedTuple):
+    size: int
+    mtime: float
+    etag: Optional[str] = None
+
+class PresignedRequest(NamedTuple):
+    """A request the client may send straight to storage until it expires (None: never)"""
+    method: str
+    url: str
+    headers: Dict[str, str]
+    expires_at: Optional[datetime]
+
+class ObjectStoreError(Exception):
+    """Raised when the storage backend fails a request"""
+
+class InvalidKey(ValueError):
+    """Raised for keys that are empty, absolute, hidden or escape the store"""
+
+def check_key(key: str) -> str:
+    parts = key.split("/")
+    if not key or key.startswith("/") or any(part in ("", ".", "..") or part.startswith(".") for part in parts):
+        raise InvalidKey(key)
+    return key
+
+def scratch_path(suffix: str = "") -> Path:
+    """A fresh path in the scratch directory, on the same filesystem as a local store"""
+    scratch = Path(settings.upload_dir) / SCRATCH_DIR
+    scratch.mkdir(parents=True, exist_ok=True)
+    return scratch / f"{uuid.uuid4().hex}{suffix}"
+
+class ObjectStore(ABC):
+    """Async storage of uploaded files by key ("ab/<sha256>.jpg")
+
+    Keys never start with a dot, so in-progress files and scratch space kept
+    under UPLOAD_DIR are never visible as objects.
+    """
+
+    # Whether objects are files under UPLOAD_DIR that the API can serve itself
+    local = False
+
+    @abstractmethod
+    async def put_file(self, key: str, path: Path, content_type: str):
+        """Store a local file under the key; the file is consumed"""
+
+    @abstractmethod
+    async def put(self, key: str, data: bytes, content_type: str):
+        """Store bytes under the key"""
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        """Whole content of an object"""
+
+    @abstractmethod
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Content of an object (bytes start..end inclusive) in chunks"""
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        """Size and modification time of an object, or None when it does not exist"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Delete an object; deleting a missing object is not an error"""
+
+    @abstractmethod
+    async def presign(
+        self,
+        method: str,
+        key: str,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        sha256: Optional[str] = None,
+    ) -> PresignedRequest:
+        """A GET or PUT of the key clients can send without going through the API workers
+
+        For PUT, the content type, length and SHA-256 (hex) are bound into the
+        signature, so storage rejects any other body.
+        """
+
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        """A local file with the object's content, e.g. for image decoding, removed afterwards"""
+        path = scratch_path(Path(key).suffix)
+        try:
+            async with aiofiles.open(path, "wb") as out:
+                async for chunk in self.stream(key):
+                    await out.write(chunk)
+            yield path
+        finally:
+            path.unlink(missing_ok=True)
+
+    async def close(self):
+        """Release connections held by the backend"""
+
+def presign_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=settings.storage_presign_expires)
+
+class LocalObjectStore(ObjectStore):
+    """Objects as files under UPLOAD_DIR, served by the /uploads route
+
+    Presigned PUTs target ``PUT /uploads/<key>`` with an HMAC signature, so
+    clients use the same direct-upload flow as with S3 (the bytes do pass
+    through the API here, which is fine for a single node or development).
+    """
+
+    local = True
+    chunk_size = 256 * 1024
+
+    def __init__(self, root: str, secret: str):
+        self.root = Path(root)
+        self._secret = secret.encode()
+
+    def path(self, key: str) -> Path:
+        return self.root / check_key(key)
+
+    async def put_file(self, key: str, path: Path, content_type: str):
+        destination = self.path(key)
+        try:
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, destination)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+
+    async def put(self, key: str, data: bytes, content_type: str):
+        tmp_path = scratch_path()
+        async with aiofiles.open(tmp_path, "wb") as out:
+            await out.write(data)
+        await self.put_file(key, tmp_path, content_type)
+
+    async def get(self, key: str) -> bytes:
+        async with aiofiles.open(self.path(key), "rb") as f:
+            return await f.read()
+
+    async def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        fd = await anyio.to_thread.run_sync(os.open, self.path(key), os.O_RDONLY)
+        try:
+            offset = start
+            while end is None or offset <= end:
+                size = self.chunk_size if end is None else min(self.chunk_size, end - offset + 1)
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, size, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            result = await anyio.to_thread.run_sync(os.stat, self.path(key))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return ObjectInfo(size=result.st_size, mtime=result.st_mtime)
+
+    async def delete(self, key: str):
+        self.path(key).unlink(missing_ok=True)
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        # Already a local file; no copy needed
+        yield self.path(key)
+
+    def signature(self, method: str, key: str, expires: int, content_type: str, content_length: int, sha256: str) -> str:
+        material = "\n".join([method, key, str(expires), content_type, str(content_length), sha256])
+        return hmac.new(self._secret, material.encode(), hashlib.sha256).hexdigest()
+
+    def verify(self, method: str, key: str, expires: int, signature: str, content_type: str, content_length: int, sha256: str) -> bool:
+        """Check a presigned request against its signature and expiry"""
+        if expires < time.time():
+            return False
+        expected = self.signature(method, key, expires, content_type, content_length, sha256)
+        return hmac.compare_digest(expected, signature)
+
+    async def presign(
+        self,
+        method: str,
+        key: str,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        sha256: Optional[str] = None,
+    ) -> PresignedRequest:
+        url = f"/uploads/{quote(check_key(key))}"
+        if method == "GET":
+            return PresignedRequest("GET", url, {}, None)
+
+        content_type = content_type or "application/octet-stream"
+        expires = int(time.time()) + settings.storage_presign_expires
+        signature = self.signature(method, key, expires, content_type, content_length or 0, sha256 or "")
+        query = urlencode({"expires": expires, "sha256": sha256 or "", "signature": signature})
+        headers = {"Content-Type": content_type}
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+        return PresignedRequest(method, f"{url}?{query}", headers, datetime.utcfromtimestamp(expires))
+
+def create_object_store() -> ObjectStore:
+    """The backend selected by STORAGE_BACKEND"""
+    if settings.storage_backend == "local":
+        return LocalObjectStore(settings.upload_dir, settings.jwt_secret)
+    if settings.storage_backend == "s3":
+        # httpx is only needed with this backend
+        from app.core.s3 import S3ObjectStore
+        return S3ObjectStore(
+            endpoint_url=settings.s3_endpoint_url,
+            bucket=settings.s3_bucket,
+            region=settings.s3_region,
+            access_key_id=settings.s3_access_key_id,
+            secret_access_key=settings.s3_secret_access_key,
+            path_style=settings.s3_path_style,
+            public_url=settings.s3_public_url,
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {settings.storage_backend}")
+
+# Storage of uploaded photos and their variants
+object_store = create_object_store()
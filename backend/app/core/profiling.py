@@ -0,0 +1,167 @@
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import List
+import asyncio
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = Path(code.co_filename)
+    return f"{code.co_qualname} ({'/'.join(path.parts[-2:])}:{frame.f_lineno})"
+
+class StackSampler(threading.Thread):
+    """Sample the stack of one asyncio task at a fixed interval from a side thread
+
+    While the task runs, the event loop thread's real stack is sampled; while it
+    is suspended, its chain of awaiting coroutines is walked instead and the leaf
+    names what it waits on (e.g. a Future from a Mongo or file I/O executor), so
+    the profile shows wall-clock time including awaits.
+    """
+
+    def __init__(self, task: asyncio.Task, loop: asyncio.AbstractEventLoop, root_code, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.task = task
+        self.loop = loop
+        self.root_code = root_code
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                stack = self._sample()
+            except Exception:
+                # Frames can change under us; drop the sample rather than the request
+                continue
+            if stack:
+                self.samples[";".join(stack)] += 1
+
+    def stop(self):
+        """Ask the thread to stop; join() it off the event loop, it may be mid-interval"""
+        self._stop_event.set()
+
+    def _sample(self) -> List[str]:
+        if asyncio.current_task(self.loop) is self.task:
+            return self._thread_stack()
+        return self._await_stack()
+
+    def _thread_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self.thread_id)
+        frames = []
+        while frame is not None and frame.f_code is not self.root_code:
+            frames.append(frame)
+            frame = frame.f_back
+        return [_frame_label(f) for f in reversed(frames)]
+
+    def _await_stack(self) -> List[str]:
+        stack = []
+        started = False
+        awaitable = self.task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                stack.append(f"[await {type(awaitable).__name__}]")
+                break
+            if started:
+                stack.append(_frame_label(frame))
+            elif frame.f_code is self.root_code:
+                started = True
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return stack if started else []
+
+class ProfilerMiddleware:
+    """Profile individual requests on demand and write folded stacks for flamegraphs
+
+    A request is profiled when it carries ``X-Profile: <PROFILER_TOKEN>`` or is
+    picked by ``PROFILER_SAMPLE_RATE``. Output goes to ``PROFILER_OUTPUT_DIR`` in
+    the collapsed-stack format read by flamegraph.pl and speedscope, keeping the
+    newest ``PROFILER_MAX_FILES`` files.
+
+    Only the request's own task is sampled. The body of a streaming response
+    (e.g. job events over SSE) is sent from a child task, so a profile of one
+    covers the endpoint up to the response start but not the streaming.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.token = settings.profiler_token.encode()
+        self.sample_rate = settings.profiler_sample_rate
+        self.output_dir = Path(settings.profiler_output_dir)
+
+    def _should_profile(self, scope: Scope) -> bool:
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        sampler = StackSampler(
+            asyncio.current_task(),
+            loop,
+            ProfilerMiddleware.__call__.__code__,
+            settings.profiler_interval_ms / 1000,
+        )
+        filename = self._filename(scope)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-profile-id", filename.encode()))
+            await send(message)
+
+        start_time = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            await loop.run_in_executor(None, self._write, filename, sampler, duration_ms)
+
+    def _filename(self, scope: Scope) -> str:
+        path = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        return f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{scope['method']}-{path[:60]}.folded"
+
+    def _write(self, filename: str, sampler: StackSampler, duration_ms: float):
+        sampler.join()
+        samples = sampler.samples
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.output_dir / filename, "w") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"Wrote request profile {filename} ({duration_ms:.1f}ms, {sum(samples.values())} samples)")
+            self._rotate()
+        except OSError as e:
+            logger.error(f"Failed to write request profile {filename}: {e}")
+
+    def _rotate(self):
+        profiles = sorted(self.output_dir.glob("*.folded"), key=os.path.getmtime)
+        for path in profiles[: max(0, len(profiles) - settings.profiler_max_files)]:
+            path.unlink(missing_ok=True)
+
+def profiler_enabled() -> bool:
+    return bool(settings.profiler_token) or settings.profiler_sample_rate > 0
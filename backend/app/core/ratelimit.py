@@ -0,0 +1,156 @@
+from abc import ABC, abstractmethod
+from fastapi import HTTPException, Request
+from typing import Awaitable, Callable, Collection, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import json
+import math
+import time
+import zlib
+
+from app.core.config import settings
+
+KeyFunc = Callable[[Request], Awaitable[Optional[str]]]
+CostFunc = Callable[[Request], Awaitable[float]]
+
+class RateLimit(NamedTuple):
+    capacity: float
+    period: float
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.period
+
+    @classmethod
+    def parse(cls, value: str) -> "RateLimit":
+        """Parse '<requests>/<seconds>', e.g. '5/600' for five requests per ten minutes"""
+        count, _, seconds = value.partition("/")
+        return cls(capacity=float(count), period=float(seconds or 1))
+
+class RateLimitBackend(ABC):
+    """Storage for token buckets"""
+
+    @abstractmethod
+    async def acquire(self, buckets: Sequence[Tuple[str, RateLimit]], cost: float = 1.0) -> float:
+        """Take tokens from every bucket or from none
+
+        Returns 0 when allowed, else the seconds until all of them hold enough
+        tokens. A request stopped by one limit spends nothing on the others.
+        """
+
+class ShardedMemoryBackend(RateLimitBackend):
+    """In-process token buckets spread over independent shards
+
+    Each acquire is a read-modify-write with no await in between, so on the
+    event loop it is atomic without locks. Sharding keeps every dict small and
+    bounds the work of pruning idle buckets, which are equivalent to full ones.
+    A bucket keeps the capacity and rate of its own limit, so pruning never
+    mistakes a partly drained strict bucket for an idle one.
+    """
+
+    def __init__(self, shards: int, max_keys: int):
+        # key -> [tokens, updated_at, capacity, refill_rate]
+        self._shards: List[Dict[str, List[float]]] = [{} for _ in range(shards)]
+        self._max_keys_per_shard = max(1, max_keys // shards)
+
+    async def acquire(self, buckets: Sequence[Tuple[str, RateLimit]], cost: float = 1.0) -> float:
+        now = time.monotonic()
+        states = [self._refill(key, limit, now) for key, limit in buckets]
+
+        retry_after = max((((cost - state[0]) / state[3]) for state in states if state[0] < cost), default=0.0)
+        if retry_after == 0:
+            for state in states:
+                state[0] -= cost
+        return retry_after
+
+    def _refill(self, key: str, limit: RateLimit, now: float) -> List[float]:
+        shard = self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+        bucket = shard.get(key)
+        if bucket is None:
+            if len(shard) >= self._max_keys_per_shard:
+                self._prune(shard, now)
+            bucket = shard[key] = [limit.capacity, now, limit.capacity, limit.refill_rate]
+        else:
+            tokens, updated_at, _, _ = bucket
+            bucket[0] = min(limit.capacity, tokens + (now - updated_at) * limit.refill_rate)
+            bucket[1:] = [now, limit.capacity, limit.refill_rate]
+        return bucket
+
+    def _prune(self, shard: Dict[str, List[float]], now: float):
+        for key, (tokens, updated_at, capacity, refill_rate) in list(shard.items()):
+            if tokens + (now - updated_at) * refill_rate >= capacity:
+                del shard[key]
+        if len(shard) >= self._max_keys_per_shard:
+            # Everything is active; drop the least recently touched half
+            for key, _ in sorted(shard.items(), key=lambda item: item[1][1])[: len(shard) // 2]:
+                del shard[key]
+
+BACKENDS: Dict[str, Callable[[], RateLimitBackend]] = {
+    "memory": lambda: ShardedMemoryBackend(settings.rate_limit_shards, settings.rate_limit_max_keys),
+}
+
+class Rule(NamedTuple):
+    scope: str
+    key: KeyFunc
+    limit: RateLimit
+
+class RateLimiter:
+    def __init__(self, backend: RateLimitBackend):
+        self.backend = backend
+
+    async def check(self, route: str, rules: List[Rule], request: Request, cost: float = 1.0):
+        """Consume cost tokens from every rule's bucket, raising 429 with Retry-After when any is short"""
+        buckets = []
+        for rule in rules:
+            key = await rule.key(request)
+            if key is not None:
+                buckets.append((f"{route}:{rule.scope}:{key}", rule.limit))
+        if not buckets:
+            return
+
+        retry_after = await self.backend.acquire(buckets, cost)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+limiter = RateLimiter(BACKENDS[settings.rate_limit_backend]())
+
+def rate_limit(route: str, *rules: Rule, cost: Optional[CostFunc] = None):
+    """Route dependency enforcing the given rules before the handler runs
+
+    Each request takes one token per rule, or what cost returns for it.
+    """
+    async def dependency(request: Request):
+        if settings.rate_limit_enabled:
+            await limiter.check(route, list(rules), request, await cost(request) if cost else 1.0)
+    return dependency
+
+async def client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+def body_field(name: str) -> KeyFunc:
+    """Key on a field of the JSON body (already read and cached by FastAPI)"""
+    async def key(request: Request) -> Optional[str]:
+        try:
+            value = json.loads(await request.body()).get(name)
+        except (ValueError, AttributeError):
+            return None
+        return str(value) if value is not None else None
+    return key
+
+def body_count(name: str, allowed: Collection[str]) -> CostFunc:
+    """Cost of one token per distinct allowed item of a list in the JSON body, at least 1
+
+    Items the handler will reject are not counted, so a padded list cannot ask
+    for more tokens than a bucket holds.
+    """
+    async def cost(request: Request) -> float:
+        try:
+            values = json.loads(await request.body()).get(name)
+        except (ValueError, AttributeError):
+            return 1.0
+        if not isinstance(values, list):
+            return 1.0
+        return float(max(1, len({value for value in values if isinstance(value, str) and value in allowed})))
+    return cost
@@ -0,0 +1,230 @@
+"""
+S3-protocol object store (AWS S3, MinIO, Cloudflare R2, ...) over httpx
+
+Requests are signed with AWS Signature Version 4. Payloads are sent as
+UNSIGNED-PAYLOAD, so files stream from disk without hashing them twice.
+"""
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import quote, unquote, urlsplit
+import base64
+import hashlib
+import hmac
+import logging
+
+import aiofiles
+import httpx
+
+from app.core.object_store import ObjectInfo, ObjectStore, ObjectStoreError, PresignedRequest, check_key, presign_expiry
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+ALGORITHM = "AWS4-HMAC-SHA256"
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+def _uri_encode(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+class SigV4Signer:
+    """AWS Signature Version 4 for the header and query-string (presigned) forms"""
+
+    def __init__(self, access_key_id: str, secret_access_key: str, region: str, service: str = "s3"):
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self.service = service
+
+    def _scope(self, now: datetime) -> str:
+        return f"{now:%Y%m%d}/{self.region}/{self.service}/aws4_request"
+
+    def _signature(self, method: str, url: str, query: Dict[str, str], headers: Dict[str, str], payload_hash: str, now: datetime) -> str:
+        parts = urlsplit(url)
+        canonical_headers = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+        signed_headers = ";".join(sorted(canonical_headers))
+        canonical_request = "\n".join([
+            method,
+            # Encoded exactly once, whether or not the URL path already was
+            _uri_encode(unquote(parts.path) or "/", safe="/-_.~"),
+            "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in sorted(query.items())),
+            "".join(f"{name}:{canonical_headers[name]}\n" for name in sorted(canonical_headers)),
+            signed_headers,
+            payload_hash,
+        ])
+        string_to_sign = "\n".join([
+            ALGORITHM,
+            f"{now:%Y%m%dT%H%M%SZ}",
+            self._scope(now),
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        key = _hmac(f"AWS4{self.secret_access_key}".encode(), f"{now:%Y%m%d}")
+        for part in (self.region, self.service, "aws4_request"):
+            key = _hmac(key, part)
+        return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def sign_headers(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        payload_hash: str = UNSIGNED_PAYLOAD,
+        now: Optional[datetime] = None,
+    ) -> Dict[str, str]:
+        """Headers for a request authenticated with the Authorization header"""
+        now = now or datetime.utcnow()
+        headers = {
+            **(headers or {}),
+            "host": urlsplit(url).netloc,
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": f"{now:%Y%m%dT%H%M%SZ}",
+        }
+        signature = self._signature(method, url, {}, headers, payload_hash, now)
+        signed_headers = ";".join(sorted(name.lower() for name in headers))
+        headers["Authorization"] = (
+            f"{ALGORITHM} Credential={self.access_key_id}/{self._scope(now)}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        del headers["host"]
+        return headers
+
+    def presign_url(
+        self,
+        method: str,
+        url: str,
+        expires: int,
+        headers: Optional[Dict[str, str]] = None,
+        now: Optional[datetime] = None,
+    ) -> str:
+        """URL carrying its own authentication; the given headers must be sent with it"""
+        now = now or datetime.utcnow()
+        headers = {**(headers or {}), "host": urlsplit(url).netloc}
+        query = {
+            "X-Amz-Algorithm": ALGORITHM,
+            "X-Amz-Credential": f"{self.access_key_id}/{self._scope(now)}",
+            "X-Amz-Date": f"{now:%Y%m%dT%H%M%SZ}",
+            "X-Amz-Expires": str(expires),
+            "X-Amz-SignedHeaders": ";".join(sorted(name.lower() for name in headers)),
+        }
+        query["X-Amz-Signature"] = self._signature(method, url, query, headers, UNSIGNED_PAYLOAD, now)
+        return f"{url}?" + "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in query.items())
+
+class S3ObjectStore(ObjectStore):
+    """Objects in an S3 bucket, shared by every API replica
+
+    Reads by clients go to presigned URLs (or S3_PUBLIC_URL, e.g. a CDN in front
+    of a public bucket) instead of through the API.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        region: str,
+        access_key_id: str,
+        secret_access_key: str,
+        path_style: bool = True,
+        public_url: str = "",
+    ):
+        endpoint = urlsplit(endpoint_url.rstrip("/"))
+        if path_style:
+            self.base_url = f"{endpoint.scheme}://{endpoint.netloc}/{bucket}"
+        else:
+            self.base_url = f"{endpoint.scheme}://{bucket}.{endpoint.netloc}"
+        self.public_url = public_url.rstrip("/")
+        self.signer = SigV4Signer(access_key_id, secret_access_key, region)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(settings.s3_timeout_seconds))
+        return self._client
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{quote(check_key(key))}"
+
+    async def _request(self, method: str, key: str, headers: Optional[Dict[str, str]] = None, content=None, ok=(200,)) -> httpx.Response:
+        url = self.url(key)
+        response = await self.client.request(method, url, headers=self.signer.sign_headers(method, url, headers), content=content)
+        if response.status_code not in ok:
+            raise ObjectStoreError(f"S3 {method} {key} failed with {response.status_code}: {response.text[:200]}")
+        return response
+
+    async def put_file(self, key: str, path: Path, content_type: str):
+        async def body():
+            async with aiofiles.open(path, "rb") as f:
+                while chunk := await f.read(self.chunk_size):
+                    yield chunk
+
+        # S3 needs the length up front; the payload is unsigned so the file streams without a hashing pass
+        headers = {"content-type": content_type, "content-length": str(path.stat().st_size)}
+        try:
+            await self._request("PUT", key, headers, content=body())
+        finally:
+            path.unlink(missing_ok=True)
+
+    async def put(self, key: str, data: bytes, content_type: str):
+        await self._request("PUT", key, {"content-type": content_type}, content=data)
+
+    async def get(self, key: str) -> bytes:
+        return (await self._request("GET", key)).content
+
+    async def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        url = self.url(key)
+        headers = {}
+        if start or end is not None:
+            headers["range"] = f"bytes={start}-{'' if end is None else end}"
+        async with self.client.stream("GET", url, headers=self.signer.sign_headers("GET", url, headers)) as response:
+            if response.status_code not in (200, 206):
+                await response.aread()
+                raise ObjectStoreError(f"S3 GET {key} failed with {response.status_code}: {response.text[:200]}")
+            async for chunk in response.aiter_bytes(self.chunk_size):
+                yield chunk
+
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        response = await self._request("HEAD", key, ok=(200, 404))
+        if response.status_code == 404:
+            return None
+        modified = response.headers.get("last-modified")
+        return ObjectInfo(
+            size=int(response.headers.get("content-length", 0)),
+            mtime=parsedate_to_datetime(modified).timestamp() if modified else 0.0,
+            etag=response.headers.get("etag"),
+        )
+
+    async def delete(self, key: str):
+        await self._request("DELETE", key, ok=(200, 204, 404))
+
+    async def presign(
+        self,
+        method: str,
+        key: str,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        sha256: Optional[str] = None,
+    ) -> PresignedRequest:
+        if method == "GET" and self.public_url:
+            return PresignedRequest("GET", f"{self.public_url}/{quote(check_key(key))}", {}, None)
+
+        headers = {}
+        if content_type:
+            headers["Content-Type"] = content_type
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+        if sha256:
+            # S3 verifies the body against this checksum, so the key's hash can be trusted
+            headers["x-amz-checksum-sha256"] = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.signer.presign_url(method, self.url(key), settings.storage_presign_expires, headers)
+        return PresignedRequest(method, url, headers, presign_expiry())
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,252 @@
+from fastapi import UploadFile
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from pathlib import Path
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from typing import AsyncIterator, Dict, NamedTuple, Optional
+import aiofiles
+import asyncio
+import hashlib
+import logging
+import re
+import uuid
+
+from app.core.config import settings
+from app.core.database import db
+from app.core.image_header import HEADER_SCAN_LIMIT, ImageInfo, ImageSniffer
+from app.core.object_store import object_store
+
+logger = logging.getLogger(__name__)
+
+# File extension for each accepted image type, so a blob's name depends only on its content
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+}
+
+# /uploads/ab/<sha256>.jpg and its variants (/uploads/ab/<sha256>.thumbnail.webp)
+BLOB_URL_PATTERN = re.compile(r"/uploads/[0-9a-f]{2}/([0-9a-f]{64})(?:\.[a-z]+)+$")
+
+# A blob whose last reference is dropped is marked deleting while its objects are removed;
+# new references wait for that, and take the deletion over once it is this old (its deleter died)
+BLOB_DELETE_TIMEOUT_SECONDS = 30
+BLOB_DELETE_POLL_SECONDS = 0.05
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+class StoredFile(NamedTuple):
+    path: Path
+    size: int
+    sha256: str
+    image: Optional[ImageInfo] = None
+
+class Blob(NamedTuple):
+    sha256: str
+    size: int
+    url: str
+    key: str
+    variants: Optional[Dict[str, str]] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    content_type: Optional[str] = None
+
+async def save_upload(file: UploadFile, dest_dir: Path, max_size: int, sniffer: Optional[ImageSniffer] = None) -> StoredFile:
+    """Stream an upload to a temporary file in fixed-size chunks
+
+    The body is hashed while it is copied, so memory use does not depend on the
+    file size. The caller decides where the file ends up once the hash is known.
+    """
+    async def chunks():
+        while chunk := await file.read(settings.upload_chunk_size):
+            yield chunk
+
+    return await save_stream(chunks(), dest_dir, max_size, sniffer)
+
+async def save_stream(
+    chunks: AsyncIterator[bytes],
+    dest_dir: Path,
+    max_size: int,
+    sniffer: Optional[ImageSniffer] = None
+) -> StoredFile:
+    """Like save_upload, for a raw request body
+
+    With a sniffer, each chunk is inspected before it is written, so a body
+    that is not an acceptable image stops the copy at its first bytes.
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest_dir / f".{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(f"Upload exceeds {max_size} bytes")
+                if sniffer is not None:
+                    sniffer.feed(chunk)
+                digest.update(chunk)
+                await out.write(chunk)
+        image = sniffer.result() if sniffer is not None else None
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    return StoredFile(path=tmp_path, size=size, sha256=digest.hexdigest(), image=image)
+
+def blob_key(sha256: str, content_type: str) -> str:
+    """Relative storage key of a blob, sharded by hash prefix"""
+    return f"{sha256[:2]}/{sha256}{CONTENT_TYPE_EXTENSIONS[content_type]}"
+
+def blob_sha256_from_url(url: str) -> Optional[str]:
+    """Content hash of a blob from its /uploads URL, or None for other URLs"""
+    match = BLOB_URL_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def hash_file(path: Path) -> str:
+    """SHA-256 of a file, read in upload-sized chunks (blocking; run it off the event loop)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(settings.upload_chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def sniff_object(key: str) -> ImageInfo:
+    """Format and dimensions of a stored image, from a ranged read of its header"""
+    sniffer = ImageSniffer(settings.max_image_pixels)
+    async with aclosing(object_store.stream(key, 0, HEADER_SCAN_LIMIT - 1)) as chunks:
+        async for chunk in chunks:
+            sniffer.feed(chunk)
+            if sniffer.done:
+                break
+    return sniffer.result()
+
+async def find_blob(sha256: str) -> Optional[dict]:
+    """Key and content type recorded for the bytes, unless the blob is missing or being deleted"""
+    return await db.database.blobs.find_one(
+        {"sha256": sha256, "deleting_at": {"$exists": False}},
+        {"_id": 0, "key": 1, "content_type": 1}
+    )
+
+async def store_blob(file: UploadFile) -> Blob:
+    """Store an uploaded image content-addressed by SHA-256 and take a reference to it
+
+    The format comes from the file's own bytes, not the client's content type.
+    """
+    sniffer = ImageSniffer(settings.max_image_pixels)
+    stored = await save_upload(file, Path(settings.upload_dir), settings.max_upload_size, sniffer)
+    return await commit_blob(stored)
+
+async def commit_blob(stored: StoredFile) -> Blob:
+    """Move a fully written, sniffed temporary image into the object store and take a reference to it
+
+    Identical bytes are kept once: when the blob already exists the temporary
+    copy is discarded and only its reference count goes up. The reference is
+    taken first, so the blob cannot be deleted between checking for its object
+    and using it.
+    """
+    try:
+        blob = await reference_blob(stored.sha256, blob_key(stored.sha256, stored.image.content_type), stored.size, stored.image)
+    except BaseException:
+        stored.path.unlink(missing_ok=True)
+        raise
+
+    try:
+        if await object_store.exists(blob.key):
+            stored.path.unlink()
+        else:
+            # New, or its upload never finished; the bytes are the same whatever the key
+            await object_store.put_file(blob.key, stored.path, blob.content_type)
+    except BaseException:
+        stored.path.unlink(missing_ok=True)
+        await release_blob(blob.sha256)
+        raise
+    return blob
+
+async def reference_blob(sha256: str, key: str, size: int, image: ImageInfo) -> Blob:
+    """Take a reference to a blob, recording it under the key when it is new
+
+    The dimensions read from the header are kept with the blob, so nothing
+    downstream has to open the file to learn them. Bytes recorded before keep
+    their key, which may differ from the one given (older blobs were named
+    after the client's content type). A blob that is being deleted is waited
+    for and then recorded afresh.
+    """
+    while True:
+        try:
+            blob_doc = await db.database.blobs.find_one_and_update(
+                {"sha256": sha256, "deleting_at": {"$exists": False}},
+                {
+                    "$setOnInsert": {
+                        "key": key,
+                        "size": size,
+                        "content_type": image.content_type,
+                        "width": image.width,
+                        "height": image.height,
+                        "created_at": datetime.utcnow(),
+                    },
+                    "$inc": {"refcount": 1},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            await wait_for_blob_deletion(sha256)
+
+    key = blob_doc["key"]
+    return Blob(
+        sha256=sha256,
+        size=blob_doc.get("size", size),
+        url=f"/uploads/{key}",
+        key=key,
+        variants=blob_doc.get("variants"),
+        width=blob_doc.get("width"),
+        height=blob_doc.get("height"),
+        content_type=blob_doc.get("content_type") or image.content_type,
+    )
+
+async def wait_for_blob_deletion(sha256: str):
+    """Wait a moment for a blob marked deleting to go, finishing the deletion if it stalled"""
+    stalled = datetime.utcnow() - timedelta(seconds=BLOB_DELETE_TIMEOUT_SECONDS)
+    blob_doc = await db.database.blobs.find_one_and_update(
+        {"sha256": sha256, "deleting_at": {"$lt": stalled}},
+        {"$set": {"deleting_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if blob_doc:
+        logger.warning(f"Taking over stalled deletion of blob {sha256}")
+        await delete_blob(blob_doc)
+    else:
+        await asyncio.sleep(BLOB_DELETE_POLL_SECONDS)
+
+async def release_blob(sha256: str):
+    """Drop one reference to a blob, deleting it once nothing refers to it"""
+    blob_doc = await db.database.blobs.find_one_and_update(
+        {"sha256": sha256},
+        {"$inc": {"refcount": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not blob_doc or blob_doc["refcount"] > 0:
+        return
+
+    # Mark it first: no new reference can be taken while its objects are removed
+    blob_doc = await db.database.blobs.find_one_and_update(
+        {"sha256": sha256, "refcount": {"$lte": 0}, "deleting_at": {"$exists": False}},
+        {"$set": {"deleting_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if blob_doc:
+        await delete_blob(blob_doc)
+
+async def delete_blob(blob_doc: dict):
+    """Remove the objects of a blob marked deleting, then its record"""
+    for key in [blob_doc["key"], *blob_doc.get("variants", {}).values()]:
+        await object_store.delete(key)
+    await db.database.blobs.delete_one({"_id": blob_doc["_id"], "deleting_at": blob_doc["deleting_at"]})
+    logger.info(f"Deleted unreferenced blob {blob_doc['sha256']}")
@@ -1,17 +1,44 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-import os
 
 from app.core.config import settings
-from app.core.database import init_database
-from app.routers import auth, upload, ai, health
+from app.core.database import init_database, close_database
+from app.core.inference import inference
+from app.core.metrics import MetricsMiddleware, route_paths
+from app.core.middleware import RequestBodyLimitMiddleware
+from app.core.object_store import object_store
+from app.core.profiling import ProfilerMiddleware, profiler_enabled
+from app.core.jobs import ai_jobs
+from app.routers import auth, upload, ai, health, media
+from app.services.avatar import AVATAR_BATCH_JOB, AVATAR_JOB, generate_avatar_batch_job, generate_avatar_job
+from app.services.images import shutdown_pool
+from app.services.uploads import upload_sessions
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the database pool and background workers, and drain them on shutdown"""
+    await init_database()
+    ai_jobs.register(AVATAR_JOB, generate_avatar_job)
+    ai_jobs.register(AVATAR_BATCH_JOB, generate_avatar_batch_job)
+    await ai_jobs.start(settings.ai_worker_concurrency)
+    upload_sessions.start()
+    try:
+        yield
+    finally:
+        await upload_sessions.stop()
+        await ai_jobs.stop(timeout=settings.graceful_timeout)
+        await inference.stop()
+        shutdown_pool()
+        await object_store.close()
+        await close_database()
 
 def create_app() -> FastAPI:
     app = FastAPI(
         title="Virtual Try-On API",
         description="Backend API for Virtual Try-On Mobile Application",
         version="1.0.0",
+        lifespan=lifespan,
     )
 
     # CORS middleware
@@ -23,24 +50,36 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
-    # Static files for uploaded images
-    if os.path.exists("uploads"):
-        app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+    # Reject oversized uploads before the body is read (allowance covers multipart framing)
+    part_limit = settings.max_upload_size + 64 * 1024
+    app.add_middleware(
+        RequestBodyLimitMiddleware,
+        limits={
+            "/upload": part_limit,
+            "/uploads": part_limit,
+            "/upload/photos": part_limit * settings.max_bulk_upload_files,
+        },
+    )
 
     # Include routers
     app.include_router(health.router)
     app.include_router(auth.router, prefix="/auth", tags=["authentication"])
     app.include_router(upload.router, prefix="/upload", tags=["upload"])
     app.include_router(ai.router, prefix="/ai", tags=["ai"])
+    app.include_router(media.router, prefix="/uploads", tags=["media"])
+
+    # On-demand request profiling; not installed at all unless configured
+    if profiler_enabled():
+        app.add_middleware(ProfilerMiddleware)
+
+    # Metrics middleware goes outermost so its timings include every other middleware
+    app.add_middleware(MetricsMiddleware, route_paths=route_paths(app.routes))
 
     return app
 
 app = create_app()
 
-@app.on_event("startup")
-async def startup_event():
-    await init_database()
-
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Production launcher; use `uvicorn app.main:app --reload` while developing
+    from app.server import main
+    main()
\ No newline at end of file
@@ -1,21 +1,104 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Literal, Optional
 
 class UploadResponse(BaseModel):
     success: bool
     message: str
     file_url: Optional[str] = None
     file_id: Optional[str] = None
+    variants: Optional[Dict[str, str]] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    filename: Optional[str] = None
+
+class BulkUploadResponse(BaseModel):
+    success: bool
+    message: str
+    uploaded: int
+    results: List[UploadResponse]
+
+class PhotoItem(BaseModel):
+    file_id: Optional[str] = None
+    file_url: str
+    variants: Optional[Dict[str, str]] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    created_at: datetime
+
+class PhotoListResponse(BaseModel):
+    photos: List[PhotoItem]
+    next_cursor: Optional[str] = None
+    total: int
+
+class UploadSessionCreate(BaseModel):
+    length: int = Field(gt=0)
+    content_type: str
+    filename: Optional[str] = None
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    offset: int
+    length: int
+    content_type: str
+    expires_at: datetime
+    upload_url: str
+
+class DirectUploadRequest(BaseModel):
+    content_type: str
+    length: int = Field(gt=0)
+    sha256: str = Field(pattern="^[0-9a-f]{64}$")
+
+class DirectUploadTicket(BaseModel):
+    file_id: str
+    upload_url: Optional[str] = None  # None when storage already holds these bytes
+    method: str = "PUT"
+    headers: Dict[str, str] = {}
+    expires_at: Optional[datetime] = None
+    complete_url: str
+
+class DirectUploadComplete(BaseModel):
+    content_type: str
+    sha256: str = Field(pattern="^[0-9a-f]{64}$")
 
 class AIGenerateRequest(BaseModel):
     user_id: str = Field(..., description="User ID")
     photo_urls: list[str] = Field(..., description="List of user photo URLs")
     style: Optional[str] = Field(default="casual", description="Avatar style")
+    model: Optional[str] = Field(default=None, description="AI model id (defaults to the primary model)")
+    priority: Literal["interactive", "background"] = Field(default="interactive", description="background for regeneration nobody is waiting on")
+
+class AIBatchGenerateRequest(BaseModel):
+    user_id: str = Field(..., description="User ID")
+    photo_urls: list[str] = Field(..., description="List of user photo URLs")
+    styles: list[str] = Field(..., min_length=1, description="Avatar styles to generate from the same photos")
+    model: Optional[str] = Field(default=None, description="AI model id (defaults to the primary model)")
+    priority: Literal["interactive", "background"] = Field(default="interactive", description="background for regeneration nobody is waiting on")
 
 class AIGenerateResponse(BaseModel):
     success: bool
     message: str
     avatar_url: Optional[str] = None
     processing_time: float
-    request_id: str
\ No newline at end of file
+    request_id: str
+    cached: bool = False
+
+class AIJobAccepted(BaseModel):
+    success: bool
+    message: str
+    job_id: str
+    status: str
+    status_url: str
+    events_url: Optional[str] = None
+
+class AIJobStatus(BaseModel):
+    job_id: str
+    status: str
+    priority: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[AIGenerateResponse] = None
+    avatars: Optional[Dict[str, AIGenerateResponse]] = None
+    percent: Optional[float] = None
+    error: Optional[str] = None
\ No newline at end of file
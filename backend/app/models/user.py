@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional
 
 class User(BaseModel):
     user_id: str = Field(..., description="Unique user identifier")
@@ -8,7 +8,7 @@ class User(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = Field(default=True)
-    profile_photos: List[str] = Field(default_factory=list, description="List of uploaded photo URLs")
+    photo_count: int = Field(default=0, description="Number of photos in the photos collection")
 
 class UserCreate(BaseModel):
     phone_number: str = Field(..., description="User's phone number")
@@ -18,4 +18,4 @@ class UserResponse(BaseModel):
     phone_number: str
     created_at: datetime
     is_active: bool
-    profile_photos: List[str]
\ No newline at end of file
+    photo_count: int = 0
\ No newline at end of file
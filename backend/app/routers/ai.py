@@ -1,93 +1,173 @@
-from fastapi import APIRouter, HTTPException, Depends
-import time
-import uuid
-import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import Optional
 import logging
 
-from app.models.api import AIGenerateRequest, AIGenerateResponse
-from app.core.database import get_database
+from app.models.api import AIBatchGenerateRequest, AIGenerateRequest, AIJobAccepted, AIJobStatus
+from app.core.config import settings
+from app.core.http_cache import CachedJSON
+from app.core.job_events import event_json, job_events, server_sent_events
+from app.core.jobs import ai_jobs
+from app.core.ratelimit import RateLimit, Rule, rate_limit, client_ip, body_count, body_field
+from app.services.avatar import AVATAR_BATCH_JOB, AVATAR_JOB, AVAILABLE_MODELS, AVATAR_STYLES, DEFAULT_MODEL
+from app.services.avatar_cache import avatar_cache_key
+from app.services.users import users
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.post("/generate-avatar", response_model=AIGenerateResponse)
-async def generate_avatar(request: AIGenerateRequest, db=Depends(get_database)):
-    """Generate avatar using AI (stub implementation)"""
+STYLE_IDS = {style["id"] for style in AVATAR_STYLES}
+MODEL_IDS = {model["id"] for model in AVAILABLE_MODELS if model["status"] == "available"}
+
+def resolve_model(model: Optional[str]) -> str:
+    if model is None:
+        return DEFAULT_MODEL
+    if model not in MODEL_IDS:
+        raise HTTPException(status_code=400, detail=f"Unknown or unavailable model: {model}")
+    return model
+
+GENERATE_AVATAR_RULES = (
+    Rule("user", body_field("user_id"), RateLimit.parse(settings.rate_limit_ai_per_user)),
+    Rule("ip", client_ip, RateLimit.parse(settings.rate_limit_ai_per_ip)),
+)
+
+generate_avatar_limit = rate_limit("generate_avatar", *GENERATE_AVATAR_RULES)
+
+# Same buckets, one token per style, so batching is no way around the limit
+generate_avatars_limit = rate_limit("generate_avatar", *GENERATE_AVATAR_RULES, cost=body_count("styles", STYLE_IDS))
+
+@router.post("/generate-avatar", response_model=AIJobAccepted, status_code=202, dependencies=[Depends(generate_avatar_limit)])
+async def generate_avatar(request: AIGenerateRequest):
+    """Queue avatar generation and return the job id immediately"""
     try:
-        start_time = time.time()
-        request_id = str(uuid.uuid4())
-        
-        logger.info(f"Avatar generation request {request_id} for user {request.user_id}")
+        model = resolve_model(request.model)
         
         # Validate user exists
-        user_doc = await db.users.find_one({"user_id": request.user_id})
-        if not user_doc:
+        if not await users.exists(request.user_id):
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Simulate AI processing time
-        await asyncio.sleep(2)  # Simulate 2-second processing
+        # A double-tap or retry joins the job already running for the same photos and style
+        job = await ai_jobs.enqueue(
+            AVATAR_JOB,
+            {**request.model_dump(exclude={"priority"}), "model": model},
+            user_id=request.user_id,
+            dedupe_key=avatar_cache_key(request.photo_urls, request.style, model),
+            priority=request.priority
+        )
         
-        # Mock avatar generation
-        mock_avatar_url = f"/avatars/{request_id}.jpg"
-        processing_time = time.time() - start_time
+        if job.get("deduplicated"):
+            logger.info(f"Avatar generation for user {request.user_id} joined running job {job['job_id']}")
+        else:
+            logger.info(f"Avatar generation job {job['job_id']} queued for user {request.user_id}")
         
-        # In real implementation, you would:
-        # 1. Process the user photos with AI model (Google Gemini, OpenAI, etc.)
-        # 2. Generate avatar based on the style
-        # 3. Save the generated avatar
-        # 4. Return the actual avatar URL
+        return AIJobAccepted(
+            success=True,
+            message="Avatar generation already in progress" if job.get("deduplicated") else "Avatar generation queued",
+            job_id=job["job_id"],
+            status=job["status"],
+            status_url=f"/ai/jobs/{job['job_id']}",
+            events_url=f"/ai/jobs/{job['job_id']}/events"
+        )
         
-        logger.info(f"Avatar generated successfully: {mock_avatar_url} (Processing time: {processing_time:.2f}s)")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to queue avatar generation: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate avatar")
+
+@router.post("/generate-avatars", response_model=AIJobAccepted, status_code=202, dependencies=[Depends(generate_avatars_limit)])
+async def generate_avatars(request: AIBatchGenerateRequest):
+    """Queue one job generating several styles from the same photos"""
+    try:
+        # Keep the requested order, drop repeats
+        styles = list(dict.fromkeys(request.styles))
+        unknown = [style for style in styles if style not in STYLE_IDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown styles: {', '.join(unknown)}")
+        model = resolve_model(request.model)
+        
+        # Validate user exists
+        if not await users.exists(request.user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        payload = {"user_id": request.user_id, "photo_urls": request.photo_urls, "styles": styles, "model": model}
+        # Costs one share per style, so a big batch doesn't crowd out other users' single avatars
+        job = await ai_jobs.enqueue(
+            AVATAR_BATCH_JOB,
+            payload,
+            user_id=request.user_id,
+            dedupe_key=avatar_cache_key(request.photo_urls, ",".join(sorted(styles)), model),
+            priority=request.priority,
+            cost=len(styles)
+        )
+        
+        logger.info(f"Avatar batch job {job['job_id']} queued for user {request.user_id} ({len(styles)} styles)")
         
-        return AIGenerateResponse(
+        return AIJobAccepted(
             success=True,
-            message="Avatar generated successfully! (This is a mock response)",
-            avatar_url=mock_avatar_url,
-            processing_time=processing_time,
-            request_id=request_id
+            message=f"Generation of {len(styles)} avatars queued",
+            job_id=job["job_id"],
+            status=job["status"],
+            status_url=f"/ai/jobs/{job['job_id']}",
+            events_url=f"/ai/jobs/{job['job_id']}/events"
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to generate avatar: {e}")
-        raise HTTPException(status_code=500, detail="Failed to generate avatar")
+        logger.error(f"Failed to queue avatar batch generation: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate avatars")
+
+@router.get("/jobs/{job_id}", response_model=AIJobStatus)
+async def get_job_status(job_id: str):
+    """Get status and result of an avatar generation job"""
+    job = await ai_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    # Batch jobs publish each style under progress.avatars as it completes
+    progress = job.get("progress", {})
+    return AIJobStatus(**job, avatars=progress.get("avatars"), percent=progress.get("percent"))
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events with a job's progress (queued, started, progress, preview, done) until it finishes"""
+    if not await ai_jobs.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return StreamingResponse(
+        server_sent_events(ai_jobs, job_id),
+        media_type="text/event-stream",
+        # Events must reach the client as they happen, not when a proxy buffer fills
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/jobs/{job_id}/ws")
+async def job_events_socket(websocket: WebSocket, job_id: str):
+    """The events of /ai/jobs/{job_id}/events as JSON messages ({"event": ..., ...data})"""
+    await websocket.accept()
+    if not await ai_jobs.get(job_id):
+        await websocket.close(code=4404, reason="Job not found")
+        return
+    
+    try:
+        async for item in job_events(ai_jobs, job_id):
+            event, data = item or ("heartbeat", {})
+            await websocket.send_text(event_json({"event": event, **data}))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+# Catalogs never change at runtime, so they are serialized once
+models_catalog = CachedJSON({"models": AVAILABLE_MODELS})
+styles_catalog = CachedJSON({"styles": AVATAR_STYLES})
 
 @router.get("/models")
-async def get_available_models():
+async def get_available_models(request: Request):
     """Get list of available AI models (stub)"""
-    return {
-        "models": [
-            {
-                "id": "gemini-pro-vision",
-                "name": "Google Gemini Pro Vision",
-                "description": "Advanced multimodal AI for image understanding and generation",
-                "status": "available"
-            },
-            {
-                "id": "dall-e-3",
-                "name": "OpenAI DALL-E 3",
-                "description": "State-of-the-art image generation model",
-                "status": "available"
-            },
-            {
-                "id": "custom-model",
-                "name": "Custom Try-On Model",
-                "description": "Specialized model for virtual clothing try-on",
-                "status": "coming_soon"
-            }
-        ]
-    }
+    return models_catalog.response(request)
 
 @router.get("/styles")
-async def get_avatar_styles():
+async def get_avatar_styles(request: Request):
     """Get available avatar styles"""
-    return {
-        "styles": [
-            {"id": "casual", "name": "Casual", "description": "Everyday casual wear"},
-            {"id": "formal", "name": "Formal", "description": "Business and formal attire"},
-            {"id": "trendy", "name": "Trendy", "description": "Latest fashion trends"},
-            {"id": "vintage", "name": "Vintage", "description": "Classic vintage styles"},
-            {"id": "seasonal", "name": "Seasonal", "description": "Season-appropriate clothing"}
-        ]
-    }
\ No newline at end of file
+    return styles_catalog.response(request)
\ No newline at end of file
@@ -1,16 +1,58 @@
 from fastapi import APIRouter, HTTPException, Depends
 from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import logging
 
 from app.models.auth import OTPRequest, OTPVerify, OTPResponse, LoginResponse
-from app.models.user import User, UserCreate, UserResponse
+from app.core.auth_cache import auth_cache
+from app.core.config import settings
 from app.core.database import get_database
+from app.core.ratelimit import RateLimit, Rule, rate_limit, client_ip, body_field
 from app.core.security import generate_otp, create_access_token, generate_user_id
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.post("/send-otp", response_model=OTPResponse)
+async def upsert_user(db, phone_number: str):
+    """Fetch the user for a phone number, creating it if needed, in one round trip"""
+    now = datetime.utcnow()
+    query = {"phone_number": phone_number}
+    update = {
+        "$setOnInsert": {
+            "user_id": generate_user_id(),
+            "phone_number": phone_number,
+            "created_at": now,
+            "updated_at": now,
+            "is_active": True,
+            "photo_count": 0
+        }
+    }
+    try:
+        user_doc = await db.users.find_one_and_update(
+            query, update, projection={"_id": 0, "user_id": 1}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent first login inserted the user; it now matches the query
+        user_doc = await db.users.find_one(query, {"_id": 0, "user_id": 1})
+    
+    # Older tokens of the user are looked up afresh after a login
+    auth_cache.invalidate_user(user_doc["user_id"])
+    return user_doc
+
+send_otp_limit = rate_limit(
+    "send_otp",
+    Rule("phone", body_field("phone_number"), RateLimit.parse(settings.rate_limit_otp_per_phone)),
+    Rule("ip", client_ip, RateLimit.parse(settings.rate_limit_otp_per_ip)),
+)
+
+verify_otp_limit = rate_limit(
+    "verify_otp",
+    Rule("phone", body_field("phone_number"), RateLimit.parse(settings.rate_limit_verify_per_phone)),
+    Rule("ip", client_ip, RateLimit.parse(settings.rate_limit_verify_per_ip)),
+)
+
+@router.post("/send-otp", response_model=OTPResponse, dependencies=[Depends(send_otp_limit)])
 async def send_otp(request: OTPRequest, db=Depends(get_database)):
     """Send OTP to phone number (mocked for now)"""
     try:
@@ -27,11 +69,12 @@ async def send_otp(request: OTPRequest, db=Depends(get_database)):
             "verified": False
         }
         
-        # Remove any existing OTP for this phone number
-        await db.otps.delete_many({"phone_number": request.phone_number})
-        
-        # Insert new OTP
-        await db.otps.insert_one(otp_doc)
+        # Replace any existing OTP for this phone number in a single upsert
+        await db.otps.update_one(
+            {"phone_number": request.phone_number},
+            {"$set": otp_doc},
+            upsert=True
+        )
         
         logger.info(f"OTP sent to {request.phone_number}: {otp_code}")  # In production, don't log OTP
         
@@ -45,47 +88,28 @@ async def send_otp(request: OTPRequest, db=Depends(get_database)):
         logger.error(f"Failed to send OTP: {e}")
         raise HTTPException(status_code=500, detail="Failed to send OTP")
 
-@router.post("/verify-otp", response_model=LoginResponse)
+@router.post("/verify-otp", response_model=LoginResponse, dependencies=[Depends(verify_otp_limit)])
 async def verify_otp(request: OTPVerify, db=Depends(get_database)):
     """Verify OTP and login user"""
     try:
-        # Find OTP in database
-        otp_doc = await db.otps.find_one({
-            "phone_number": request.phone_number,
-            "otp_code": request.otp_code,
-            "verified": False
-        })
+        # Consume a matching, unexpired OTP atomically so concurrent retries cannot both succeed
+        otp_doc = await db.otps.find_one_and_update(
+            {
+                "phone_number": request.phone_number,
+                "otp_code": request.otp_code,
+                "verified": False,
+                "expires_at": {"$gt": datetime.utcnow()}
+            },
+            {"$set": {"verified": True}},
+            projection={"_id": 1}
+        )
         
         if not otp_doc:
             raise HTTPException(status_code=400, detail="Invalid or expired OTP")
         
-        # Check if OTP is expired
-        if otp_doc["expires_at"] < datetime.utcnow():
-            raise HTTPException(status_code=400, detail="OTP has expired")
-        
-        # Mark OTP as verified
-        await db.otps.update_one(
-            {"_id": otp_doc["_id"]},
-            {"$set": {"verified": True}}
-        )
-        
         # Find or create user
-        user_doc = await db.users.find_one({"phone_number": request.phone_number})
-        
-        if not user_doc:
-            # Create new user
-            user_id = generate_user_id()
-            user_doc = {
-                "user_id": user_id,
-                "phone_number": request.phone_number,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
-                "is_active": True,
-                "profile_photos": []
-            }
-            await db.users.insert_one(user_doc)
-        else:
-            user_id = user_doc["user_id"]
+        user_doc = await upsert_user(db, request.phone_number)
+        user_id = user_doc["user_id"]
         
         # Create access token
         access_token = create_access_token(data={"user_id": user_id, "phone_number": request.phone_number})
@@ -1,7 +1,74 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
 from datetime import datetime
+import logging
+import os
+
+from app.core.auth_cache import auth_cache
+from app.core.config import settings
+from app.core.database import db, ping_database, pool_monitor
+from app.core.inference import inference
+from app.core.jobs import ai_jobs, JobStatus
+from app.core.metrics import registry, Counter, Gauge
+from app.services.avatar_cache import avatar_cache
+from app.services.users import users
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+mongo_pool = registry.register(Gauge("mongodb_pool_connections", "MongoDB pool connections by state", ("state",)))
+mongo_checkout_failures = registry.register(Counter("mongodb_pool_checkout_failures_total", "MongoDB connection checkouts that failed"))
+ai_queue_depth = registry.register(Gauge("ai_jobs_queued", "AI jobs waiting for a worker"))
+ai_jobs_running = registry.register(Gauge("ai_jobs_running", "AI jobs being processed by this process"))
+auth_cache_events = registry.register(Counter("auth_cache_events_total", "Auth cache lookups and evictions", ("event",)))
+avatar_cache_events = registry.register(Counter("avatar_cache_events_total", "Avatar result cache hits, misses and coalesced waits", ("event",)))
+user_lookups = registry.register(Counter("user_lookups_total", "User lookups requested and the batched MongoDB queries serving them", ("event",)))
+registry.register(ai_jobs.queue_wait)
+inference_events = registry.register(Counter("inference_total", "Inference requests and the micro-batches running them, per model", ("model", "event")))
+inference_queue_wait = registry.register(Counter("inference_queue_wait_seconds_total", "Time inference requests spent waiting for their batch", ("model",)))
+inference_pending = registry.register(Gauge("inference_pending", "Inference requests waiting for a batch", ("model",)))
+worker_info = registry.register(Gauge("process_worker_info", "Server worker that produced these metrics; every other metric is for this process only", ("worker", "pid")))
+
+def worker_identity():
+    """Which server worker (app.server) this process is; metrics and stats cover it alone"""
+    return {"worker": os.getenv("WORKER_ID"), "pid": os.getpid()}
+
+async def collect_runtime_metrics():
+    identity = worker_identity()
+    worker_info.set((identity["worker"] or "", str(identity["pid"])), 1)
+    
+    pool = pool_monitor.stats()
+    for state in ("open", "checked_out", "waiting"):
+        mongo_pool.set((state,), pool[state])
+    mongo_pool.set(("max",), pool["max_size"])
+    mongo_checkout_failures.set((), pool["checkout_failures"])
+    
+    ai_jobs_running.set((), ai_jobs.running)
+    if db.database is not None:
+        try:
+            ai_queue_depth.set((), await ai_jobs.collection.count_documents({"status": JobStatus.QUEUED}))
+        except Exception as e:
+            logger.warning(f"Failed to count queued AI jobs: {e}")
+    
+    stats = auth_cache.stats()
+    for event in ("hits", "misses", "evictions"):
+        auth_cache_events.set((event,), stats[event])
+    
+    stats = avatar_cache.stats()
+    for event in ("hits", "misses", "coalesced"):
+        avatar_cache_events.set((event,), stats[event])
+    
+    stats = users.stats()
+    for event in ("lookups", "queries"):
+        user_lookups.set((event,), stats[event])
+    
+    for model, stats in inference.stats().items():
+        for event in ("requests", "batches"):
+            inference_events.set((model, event), stats[event])
+        inference_queue_wait.set((model,), stats["queue_wait_seconds"])
+        inference_pending.set((model,), stats["pending"])
+
+registry.add_collector(collect_runtime_metrics)
 
 @router.get("/health")
 async def health_check():
@@ -11,4 +78,48 @@ async def health_check():
         "timestamp": datetime.utcnow().isoformat(),
         "service": "Virtual Try-On API",
         "version": "1.0.0"
-    }
\ No newline at end of file
+    }
+
+@router.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: 503 when the database is unreachable, slow or its pool is exhausted"""
+    pool = pool_monitor.stats()
+    problems = []
+    ping_ms = None
+    
+    if db.client is None:
+        problems.append("database not initialized")
+    else:
+        try:
+            ping_ms = await ping_database()
+            if ping_ms > settings.readiness_max_ping_ms:
+                problems.append(f"database ping {ping_ms:.1f}ms exceeds {settings.readiness_max_ping_ms:.0f}ms")
+        except Exception as e:
+            logger.warning(f"Readiness ping failed: {e}")
+            problems.append("database ping failed")
+    
+    if pool["waiting"] > 0 and pool["checked_out"] >= pool["max_size"]:
+        problems.append("database connection pool exhausted")
+    
+    body = {
+        "status": "not_ready" if problems else "ready",
+        "timestamp": datetime.utcnow().isoformat(),
+        "problems": problems,
+        "process": worker_identity(),
+        "database": {
+            "ping_ms": round(ping_ms, 2) if ping_ms is not None else None,
+            "pool": {**pool, "utilization": round(pool["checked_out"] / pool["max_size"], 3)},
+        },
+        "ai_jobs": ai_jobs.stats(),
+        "auth_cache": auth_cache.stats(),
+        "avatar_cache": avatar_cache.stats(),
+        "user_lookups": users.stats(),
+        "inference": inference.stats(),
+    }
+    return JSONResponse(body, status_code=503 if problems else 200)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(await registry.render(), media_type="text/plain; version=0.0.4")
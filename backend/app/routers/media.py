@@ -0,0 +1,164 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import RedirectResponse, Response
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import logging
+import mimetypes
+import os
+import stat
+
+import anyio
+
+from app.core.config import settings
+from app.core.http_cache import etag_matches
+from app.core.image_header import ImageSniffer, InvalidImageHeader, TooManyPixels
+from app.core.media import ByteRange, FileRangeResponse, RangeNotSatisfiable, http_date, not_modified_since, parse_range
+from app.core.object_store import InvalidKey, check_key, object_store
+from app.core.storage import CONTENT_TYPE_EXTENSIONS, UploadTooLarge, blob_sha256_from_url, save_stream
+from app.services.images import VARIANTS
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {ext: content_type for content_type, ext in CONTENT_TYPE_EXTENSIONS.items() if content_type != "image/jpg"}
+
+def resolve_media_key(key: str, variant: Optional[str]) -> str:
+    """Map a request path (and optional variant name) to an object key"""
+    if variant is not None:
+        if variant not in VARIANTS:
+            raise HTTPException(status_code=400, detail=f"Unknown variant: {variant}")
+        sha256 = blob_sha256_from_url(f"/uploads/{key}")
+        if sha256 is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        key = f"{sha256[:2]}/{sha256}.{variant}{VARIANTS[variant][2]}"
+
+    # Never expose in-progress .part files, scratch space or anything outside the store
+    try:
+        return check_key(key)
+    except InvalidKey:
+        raise HTTPException(status_code=404, detail="File not found")
+
+def resolve_media_path(key: str) -> Path:
+    root = object_store.root.resolve()
+    path = object_store.path(key).resolve()
+    if root not in path.parents:
+        raise HTTPException(status_code=404, detail="File not found")
+    return path
+
+def media_etag(path: Path, stat_result: os.stat_result) -> str:
+    """Content-hash ETag for content-addressed blobs and variants, stat-based otherwise"""
+    sha256 = blob_sha256_from_url(f"/uploads/{path.parent.name}/{path.name}")
+    if sha256 is not None:
+        # "<sha256>" or "<sha256>.<variant>" names exactly one byte sequence
+        return f'"{path.stem}"'
+    return f'W/"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+@router.api_route("/{key:path}", methods=["GET", "HEAD"])
+async def get_media(key: str, request: Request, variant: Optional[str] = None):
+    """Serve an uploaded file or one of its variants with immutable caching and byte ranges"""
+    key = resolve_media_key(key, variant)
+    if not object_store.local:
+        return await redirect_to_store(key)
+    
+    path = resolve_media_path(key)
+    try:
+        stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    size = stat_result.st_size
+    etag = media_etag(path, stat_result)
+    headers = {
+        # Upload names never change meaning, so clients and CDNs never need to revalidate
+        "Cache-Control": f"public, max-age={settings.media_max_age}, immutable",
+        "ETag": etag,
+        "Last-Modified": http_date(stat_result.st_mtime),
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if (if_none_match and etag_matches(if_none_match, etag)) or (
+        not if_none_match and if_modified_since and not_modified_since(if_modified_since, stat_result.st_mtime)
+    ):
+        return Response(status_code=304, headers=headers)
+
+    media_type = MEDIA_TYPES.get(path.suffix.lower()) or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+    if settings.media_accel_redirect:
+        # The front proxy sends the file itself (sendfile, ranges) from an internal location
+        headers["X-Accel-Redirect"] = f"{settings.media_accel_redirect.rstrip('/')}/{key}"
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    byte_range = ByteRange(0, size - 1)
+    status_code = 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A stale If-Range (weak or mismatched validator) means the client wants the whole file
+    if range_header and (not if_range or (if_range == etag and not etag.startswith("W/")) or if_range == headers["Last-Modified"]):
+        try:
+            requested = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if requested is not None:
+            byte_range = requested
+            status_code = 206
+            headers["Content-Range"] = f"bytes {requested.start}-{requested.end}/{size}"
+
+    return FileRangeResponse(
+        path,
+        byte_range,
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type,
+        send_body=request.method != "HEAD",
+    )
+
+async def redirect_to_store(key: str) -> Response:
+    """Send the client to the object in remote storage; replicas don't hold the files"""
+    presigned = await object_store.presign("GET", key)
+    if presigned.expires_at is None:
+        # A public (CDN) URL: as stable as the upload URL itself
+        cache_control = f"public, max-age={settings.media_max_age}, immutable"
+    else:
+        # Reuse the redirect only while the signed URL stays valid
+        remaining = int((presigned.expires_at - datetime.utcnow()).total_seconds())
+        cache_control = f"private, max-age={max(0, remaining - 60)}"
+    return RedirectResponse(presigned.url, status_code=307, headers={"Cache-Control": cache_control})
+
+@router.put("/{key:path}", status_code=201)
+async def put_media(key: str, request: Request, expires: int, sha256: str, signature: str):
+    """Target of presigned uploads when objects are stored locally"""
+    if not object_store.local:
+        raise HTTPException(status_code=404, detail="File not found")
+    key = resolve_media_key(key, None)
+    content_type = request.headers.get("content-type", "")
+    try:
+        length = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=411, detail="Content-Length required")
+    
+    if not object_store.verify("PUT", key, expires, signature, content_type, length, sha256):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    
+    # Photos are the only presigned uploads; a body that isn't one is refused at its first bytes
+    try:
+        stored = await save_stream(request.stream(), Path(settings.upload_dir), length, ImageSniffer(settings.max_image_pixels))
+    except UploadTooLarge:
+        raise HTTPException(status_code=400, detail="Body is longer than the signed length")
+    except (InvalidImageHeader, TooManyPixels) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image file: {e}")
+    if stored.size != length or stored.sha256 != sha256:
+        stored.path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Body does not match the signed length and checksum")
+    if CONTENT_TYPE_EXTENSIONS[stored.image.content_type] != Path(key).suffix:
+        stored.path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, and WebP are allowed")
+    
+    await object_store.put_file(key, stored.path, content_type)
+    logger.info(f"Stored presigned upload {key} ({length} bytes)")
+    return Response(status_code=201)
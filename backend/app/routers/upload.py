@@ -1,36 +1,85 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Header
-from typing import Optional
-import aiofiles
-import os
-import uuid
-from pathlib import Path
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Header, Query, Request, Response
+from starlette.requests import ClientDisconnect
+from typing import Dict, List, Optional, Tuple
+import asyncio
 import logging
-from datetime import datetime
 
-from app.models.api import UploadResponse
+from app.models.api import (
+    BulkUploadResponse, DirectUploadComplete, DirectUploadRequest, DirectUploadTicket,
+    PhotoItem, PhotoListResponse, UploadResponse, UploadSessionCreate, UploadSessionResponse
+)
+from app.core.auth_cache import auth_cache
 from app.core.config import settings
 from app.core.database import get_database
 from app.core.security import verify_token
+from app.core.image_header import ImageInfo, InvalidImageHeader, TooManyPixels, UnknownImageFormat
+from app.core.object_store import object_store
+from app.core.storage import (
+    Blob, blob_key, commit_blob, find_blob, reference_blob, sniff_object, store_blob, release_blob, CONTENT_TYPE_EXTENSIONS, UploadTooLarge
+)
+from app.services.images import ensure_variants, InvalidImage
+from app.services.photos import add_photos, list_photos, InvalidCursor
+from app.services.uploads import upload_sessions, SessionNotFound, TooManySessions, UploadConflict, UploadIncomplete
+from app.services.users import users
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-async def get_current_user(authorization: Optional[str] = Header(None), db=Depends(get_database)):
+async def get_current_user(authorization: Optional[str] = Header(None)):
     """Get current user from JWT token"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid authorization header")
     
     token = authorization.split(" ")[1]
+    
+    # Tokens seen recently skip both JWT verification and the user lookup
+    user = auth_cache.get(token)
+    if user:
+        return user
+    
     payload = verify_token(token)
     
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    user_doc = await db.users.find_one({"user_id": payload.get("user_id")})
-    if not user_doc:
+    # Concurrent requests of different users share one batched query
+    user = await users.get(payload.get("user_id"))
+    if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return user_doc
+    auth_cache.put(token, payload, user)
+    return user
+
+ALLOWED_TYPES = {"image/jpeg", "image/png", "image/jpg", "image/webp"}
+
+def rejected_image(error: Exception) -> HTTPException:
+    """Response for an upload whose header is not an acceptable image"""
+    if isinstance(error, UnknownImageFormat):
+        return HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, and WebP are allowed")
+    if isinstance(error, TooManyPixels):
+        return HTTPException(status_code=400, detail=f"Image too large. Maximum is {settings.max_image_pixels} pixels")
+    return HTTPException(status_code=400, detail="Invalid image file")
+
+async def process_photo(file: UploadFile) -> Tuple[Blob, Dict[str, str]]:
+    """Validate and store one uploaded photo and render its variants"""
+    # Stream the file into the content-addressed store; the size limit and the
+    # image header (real format, pixel count) are checked as the bytes are copied
+    try:
+        blob = await store_blob(file)
+    except UploadTooLarge:
+        raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {settings.max_upload_size} bytes")
+    except (InvalidImageHeader, TooManyPixels) as e:
+        raise rejected_image(e)
+    
+    return blob, await render_photo(blob)
+
+async def render_photo(blob: Blob) -> Dict[str, str]:
+    """Decode a stored photo once in the image process pool and write the resized variants"""
+    try:
+        return await ensure_variants(blob)
+    except InvalidImage:
+        await release_blob(blob.sha256)
+        raise HTTPException(status_code=400, detail="Invalid image file")
 
 @router.post("/photo", response_model=UploadResponse)
 async def upload_photo(
@@ -40,52 +89,355 @@ async def upload_photo(
 ):
     """Upload user photo"""
     try:
-        # Validate file type
-        allowed_types = {"image/jpeg", "image/png", "image/jpg", "image/webp"}
-        if file.content_type not in allowed_types:
-            raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, and WebP are allowed")
-        
-        # Validate file size
-        contents = await file.read()
-        if len(contents) > settings.max_upload_size:
-            raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {settings.max_upload_size} bytes")
-        
-        # Create uploads directory if it doesn't exist
-        upload_dir = Path(settings.upload_dir)
-        upload_dir.mkdir(exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-        
-        # Save file
-        async with aiofiles.open(file_path, "wb") as f:
-            await f.write(contents)
-        
-        # Generate file URL
-        file_url = f"/uploads/{unique_filename}"
-        
-        # Update user's profile photos
-        await db.users.update_one(
-            {"user_id": user["user_id"]},
-            {
-                "$push": {"profile_photos": file_url},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
+        blob, variants = await process_photo(file)
+        
+        # Record the photo (a re-upload of the same photo is not added twice)
+        if await add_photos(db, user.user_id, [(blob, variants)]):
+            await release_blob(blob.sha256)
         
-        logger.info(f"Photo uploaded successfully for user {user['user_id']}: {file_url}")
+        logger.info(f"Photo uploaded successfully for user {user.user_id}: {blob.url} ({blob.size} bytes)")
         
         return UploadResponse(
             success=True,
             message="Photo uploaded successfully",
-            file_url=file_url,
-            file_id=unique_filename.split('.')[0]
+            file_url=blob.url,
+            file_id=blob.sha256,
+            variants=variants,
+            width=blob.width,
+            height=blob.height
         )
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Failed to upload photo: {e}")
-        raise HTTPException(status_code=500, detail="Failed to upload photo")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to upload photo")
+
+@router.post("/photos", response_model=BulkUploadResponse)
+async def upload_photos(
+    files: List[UploadFile] = File(...),
+    user=Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """Upload several user photos in one request, with a result per file"""
+    if len(files) > settings.max_bulk_upload_files:
+        raise HTTPException(status_code=400, detail=f"Too many files. Maximum is {settings.max_bulk_upload_files} per request")
+    
+    async def process(file: UploadFile):
+        try:
+            return await process_photo(file)
+        except HTTPException as e:
+            return e
+        except Exception as e:
+            logger.error(f"Failed to upload photo {file.filename}: {e}")
+            return HTTPException(status_code=500, detail="Failed to upload photo")
+    
+    try:
+        # Files are stored and decoded concurrently; the image pool bounds the CPU work
+        outcomes = await asyncio.gather(*(process(file) for file in files))
+        stored = [outcome for outcome in outcomes if not isinstance(outcome, HTTPException)]
+        
+        # One insert and one counter update for the whole batch
+        already_present = await add_photos(db, user.user_id, stored) if stored else set()
+        
+        results = []
+        for file, outcome in zip(files, outcomes):
+            if isinstance(outcome, HTTPException):
+                results.append(UploadResponse(success=False, message=outcome.detail, filename=file.filename))
+                continue
+            blob, variants = outcome
+            # Each store_blob took a reference; keep one per photo the user has
+            if blob.url in already_present:
+                await release_blob(blob.sha256)
+            already_present.add(blob.url)
+            results.append(UploadResponse(
+                success=True,
+                message="Photo uploaded successfully",
+                file_url=blob.url,
+                file_id=blob.sha256,
+                variants=variants,
+                width=blob.width,
+                height=blob.height,
+                filename=file.filename
+            ))
+        
+        uploaded = len(stored)
+        logger.info(f"Bulk upload for user {user.user_id}: {uploaded}/{len(files)} photos stored")
+        
+        return BulkUploadResponse(
+            success=uploaded > 0,
+            message=f"Uploaded {uploaded} of {len(files)} photos",
+            uploaded=uploaded,
+            results=results
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to upload photos: {e}")
+        raise HTTPException(status_code=500, detail="Failed to upload photos")
+
+@router.get("/photos", response_model=PhotoListResponse)
+async def get_photos(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user=Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """List the user's photos, newest first; pass next_cursor back to get the following page"""
+    try:
+        (photos, next_cursor), total = await asyncio.gather(
+            list_photos(db, user.user_id, limit, cursor),
+            users.photo_count(user.user_id)
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"Failed to list photos: {e}")
+        raise HTTPException(status_code=500, detail="Failed to list photos")
+    
+    return PhotoListResponse(
+        photos=[
+            PhotoItem(
+                file_id=photo.get("sha256"),
+                file_url=photo["url"],
+                variants=photo.get("variants"),
+                width=photo.get("width"),
+                height=photo.get("height"),
+                created_at=photo["created_at"]
+            )
+            for photo in photos
+        ],
+        next_cursor=next_cursor,
+        total=total
+    )
+
+# Resumable uploads: create a session, PATCH chunks at Upload-Offset, HEAD to find the
+# offset after a dropped connection, then complete
+
+CHUNK_CONTENT_TYPES = {"application/offset+octet-stream", "application/octet-stream"}
+
+def session_response(session: Dict) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        upload_id=session["upload_id"],
+        offset=session["offset"],
+        length=session["length"],
+        content_type=session["content_type"],
+        expires_at=session["expires_at"],
+        upload_url=f"/upload/sessions/{session['upload_id']}"
+    )
+
+def offset_headers(offset: int) -> Dict[str, str]:
+    return {"Upload-Offset": str(offset), "Cache-Control": "no-store"}
+
+@router.post("/sessions", response_model=UploadSessionResponse, status_code=201)
+async def create_upload_session(request: UploadSessionCreate, user=Depends(get_current_user)):
+    """Start a resumable photo upload of a known length"""
+    if request.content_type not in ALLOWED_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, and WebP are allowed")
+    if request.length > settings.max_upload_size:
+        raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {settings.max_upload_size} bytes")
+    
+    try:
+        session = await upload_sessions.create(user.user_id, request.length, request.content_type, request.filename)
+    except TooManySessions:
+        raise HTTPException(status_code=429, detail=f"Too many unfinished uploads. Maximum is {settings.upload_session_max_per_user}")
+    except Exception as e:
+        logger.error(f"Failed to create upload session: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create upload session")
+    
+    return session_response(session)
+
+@router.api_route("/sessions/{upload_id}", methods=["GET", "HEAD"], response_model=UploadSessionResponse)
+async def get_upload_session(upload_id: str, response: Response, user=Depends(get_current_user)):
+    """Current offset of an upload, also sent as the Upload-Offset header"""
+    session = await upload_sessions.get(upload_id, user.user_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    
+    response.headers.update(offset_headers(session["offset"]))
+    return session_response(session)
+
+@router.patch("/sessions/{upload_id}", status_code=204)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: Optional[int] = Header(None),
+    content_type: Optional[str] = Header(None),
+    user=Depends(get_current_user)
+):
+    """Append the request body to an upload at Upload-Offset, which must be the current offset"""
+    if upload_offset is None or upload_offset < 0:
+        raise HTTPException(status_code=400, detail="Missing or invalid Upload-Offset header")
+    if (content_type or "").split(";")[0].strip().lower() not in CHUNK_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Chunks must be sent as application/offset+octet-stream")
+    
+    try:
+        offset = await upload_sessions.append(upload_id, user.user_id, upload_offset, request.stream())
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except UploadConflict as e:
+        raise HTTPException(status_code=409, detail=str(e), headers=offset_headers(e.offset))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (InvalidImageHeader, TooManyPixels) as e:
+        # The session and its bytes are gone; there is nothing to resume
+        raise rejected_image(e)
+    except ClientDisconnect:
+        # The bytes that arrived are kept; the client resumes from the offset it reads back
+        logger.info(f"Client disconnected during chunk upload to session {upload_id}")
+        return Response(status_code=400)
+    except Exception as e:
+        logger.error(f"Failed to write upload chunk: {e}")
+        raise HTTPException(status_code=500, detail="Failed to write upload chunk")
+    
+    return Response(status_code=204, headers=offset_headers(offset))
+
+@router.post("/sessions/{upload_id}/complete", response_model=UploadResponse)
+async def complete_upload_session(upload_id: str, user=Depends(get_current_user), db=Depends(get_database)):
+    """Store a fully received upload as a photo, like POST /upload/photo"""
+    session = await upload_sessions.get(upload_id, user.user_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    
+    try:
+        blob = await commit_blob(await upload_sessions.complete(upload_id, user.user_id))
+        variants = await render_photo(blob)
+        
+        if await add_photos(db, user.user_id, [(blob, variants)]):
+            await release_blob(blob.sha256)
+        
+        logger.info(f"Resumable upload {upload_id} completed for user {user.user_id}: {blob.url} ({blob.size} bytes)")
+        
+        return UploadResponse(
+            success=True,
+            message="Photo uploaded successfully",
+            file_url=blob.url,
+            file_id=blob.sha256,
+            variants=variants,
+            width=blob.width,
+            height=blob.height,
+            filename=session.get("filename")
+        )
+        
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except UploadIncomplete as e:
+        raise HTTPException(status_code=409, detail=f"Upload incomplete: {e.offset} of {session['length']} bytes received", headers=offset_headers(e.offset))
+    except UploadConflict as e:
+        raise HTTPException(status_code=409, detail=str(e), headers=offset_headers(e.offset))
+    except InvalidImageHeader as e:
+        raise rejected_image(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to complete upload session: {e}")
+        raise HTTPException(status_code=500, detail="Failed to upload photo")
+
+@router.delete("/sessions/{upload_id}", status_code=204)
+async def abort_upload_session(upload_id: str, user=Depends(get_current_user)):
+    """Abandon an upload and delete the bytes received so far"""
+    try:
+        await upload_sessions.abort(upload_id, user.user_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    
+    return Response(status_code=204)
+
+# Direct uploads: the client PUTs the bytes straight to storage with a presigned request,
+# then completes; the API only sees metadata
+
+@router.post("/direct", response_model=DirectUploadTicket)
+async def create_direct_upload(request: DirectUploadRequest, user=Depends(get_current_user), db=Depends(get_database)):
+    """Presign an upload of a photo, identified by its SHA-256, straight to storage"""
+    if request.content_type not in ALLOWED_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, and WebP are allowed")
+    if request.length > settings.max_upload_size:
+        raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {settings.max_upload_size} bytes")
+    
+    ticket = DirectUploadTicket(file_id=request.sha256, complete_url="/upload/direct/complete")
+    
+    # Bytes anyone uploaded before need not be sent again
+    existing = await find_blob(request.sha256)
+    if existing and await object_store.exists(existing["key"]):
+        return ticket
+    key, content_type = direct_upload_target(request.sha256, request.content_type, existing)
+    
+    # Storage checks the body against the signed length and checksum, so the key can be trusted
+    presigned = await object_store.presign(
+        "PUT",
+        key,
+        content_type=content_type,
+        content_length=request.length,
+        sha256=request.sha256
+    )
+    ticket.upload_url = presigned.url
+    ticket.method = presigned.method
+    ticket.headers = presigned.headers
+    ticket.expires_at = presigned.expires_at
+    return ticket
+
+def direct_upload_target(sha256: str, content_type: str, existing: Optional[dict]) -> Tuple[str, str]:
+    """Key and content type for the bytes: a recorded blob's own (older ones were named after the client's type), else the request's"""
+    if existing:
+        return existing["key"], existing.get("content_type") or content_type
+    return blob_key(sha256, content_type), content_type
+
+async def sniff_direct_upload(key: str, content_type: Optional[str], db) -> ImageInfo:
+    """Check the header of an object uploaded straight to storage, deleting it when rejected
+
+    Without a content type (the key of a blob recorded before) only the header is checked.
+    """
+    try:
+        image = await sniff_object(key)
+        # The key's extension came from the client; the bytes have to agree with it
+        if content_type and CONTENT_TYPE_EXTENSIONS[image.content_type] != CONTENT_TYPE_EXTENSIONS[content_type]:
+            raise UnknownImageFormat(f"Uploaded {image.content_type} as {content_type}")
+    except (InvalidImageHeader, TooManyPixels) as e:
+        # Nobody can refer to it yet unless a blob was recorded for these bytes before
+        if not await db.blobs.find_one({"key": key}, {"_id": 1}):
+            await object_store.delete(key)
+        raise rejected_image(e)
+    return image
+
+@router.post("/direct/complete", response_model=UploadResponse)
+async def complete_direct_upload(request: DirectUploadComplete, user=Depends(get_current_user), db=Depends(get_database)):
+    """Record a photo uploaded straight to storage, like POST /upload/photo"""
+    if request.content_type not in ALLOWED_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, and WebP are allowed")
+    
+    try:
+        existing = await find_blob(request.sha256)
+        key, content_type = direct_upload_target(request.sha256, request.content_type, existing)
+        info = await object_store.stat(key)
+        if info is None:
+            raise HTTPException(status_code=409, detail="Photo has not been uploaded to storage")
+        
+        image = await sniff_direct_upload(key, None if existing else content_type, db)
+        blob = await reference_blob(request.sha256, key, info.size, image)
+        # The reference keeps the object from now on; a deletion may have removed it just before
+        if not await object_store.exists(blob.key):
+            await release_blob(blob.sha256)
+            raise HTTPException(status_code=409, detail="Photo has not been uploaded to storage")
+        variants = await render_photo(blob)
+        
+        if await add_photos(db, user.user_id, [(blob, variants)]):
+            await release_blob(blob.sha256)
+        
+        logger.info(f"Direct upload completed for user {user.user_id}: {blob.url} ({blob.size} bytes)")
+        
+        return UploadResponse(
+            success=True,
+            message="Photo uploaded successfully",
+            file_url=blob.url,
+            file_id=blob.sha256,
+            variants=variants,
+            width=blob.width,
+            height=blob.height
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to complete direct upload: {e}")
+        raise HTTPException(status_code=500, detail="Failed to upload photo")
@@ -0,0 +1,263 @@
+"""
+Production server: a pre-forking supervisor running uvicorn workers
+
+    python -m app.server
+
+The app is imported once in the supervisor and workers are forked from it,
+sharing the listening socket and the already-imported code. Each worker runs
+its own event loop, database pool and AI job workers, and is replaced after
+WORKER_MAX_REQUESTS requests (plus jitter) or when its memory grows beyond
+WORKER_MAX_MEMORY_MB. SIGTERM/SIGINT drain in-flight requests and AI jobs
+before exiting.
+
+State kept in memory is per worker, not per server:
+- the memory rate limiter: with N workers a client may get up to N times each
+  limit, depending on which workers its connections land on;
+- /metrics and /health/ready: they describe the worker that answered, which
+  they name (WORKER_ID, pid);
+- the auth cache, avatar single-flight and inference batching: identical
+  requests on different workers are not coalesced (avatar jobs are still
+  deduplicated in MongoDB).
+
+Use `uvicorn app.main:app --reload` for development instead.
+"""
+from typing import Dict, Optional
+import asyncio
+import gc
+import logging
+import os
+import random
+import resource
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from app.core.config import settings
+
+logger = logging.getLogger("app.server")
+
+# Workers exiting faster than this after start are treated as a crash loop
+MIN_WORKER_LIFETIME = 5.0
+MEMORY_CHECK_INTERVAL = 5.0
+STARTUP_FAILURE = 3
+
+def available_cpus() -> int:
+    """CPUs this process may use: the affinity mask, capped by a cgroup CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()
+        if limit != "max":
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota + 0.5)))
+    return max(1, cpus)
+
+def rss_mb() -> float:
+    """Current resident memory of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        # Peak rather than current RSS, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class Worker:
+    """One forked uvicorn server process"""
+
+    def __init__(self, app, sock: socket.socket, worker_id: int):
+        self.app = app
+        self.sock = sock
+        self.worker_id = worker_id
+        self.pid: Optional[int] = None
+        self.started_at = 0.0
+
+    def spawn(self):
+        # Pick the recycle point before forking so every worker gets a different one
+        max_requests = None
+        if settings.worker_max_requests > 0:
+            max_requests = settings.worker_max_requests + random.randint(0, max(0, settings.worker_max_requests_jitter))
+
+        pid = os.fork()
+        if pid:
+            self.pid = pid
+            self.started_at = time.monotonic()
+            return
+
+        # Child: never return into the supervisor loop
+        code = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            random.seed()
+            # Lets metrics and health checks say which worker answered
+            os.environ["WORKER_ID"] = str(self.worker_id)
+            code = self.run(max_requests)
+        except BaseException:
+            logger.exception(f"Worker {self.worker_id} crashed")
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def run(self, max_requests: Optional[int]) -> int:
+        config = uvicorn.Config(
+            self.app,
+            lifespan="on",
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=settings.graceful_timeout,
+            log_config=None,
+        )
+        server = uvicorn.Server(config)
+
+        async def serve():
+            watchdog = asyncio.create_task(self.watch_memory(server))
+            try:
+                await server.serve(sockets=[self.sock])
+            finally:
+                watchdog.cancel()
+
+        asyncio.run(serve())
+        return 0 if server.started else STARTUP_FAILURE
+
+    async def watch_memory(self, server: uvicorn.Server):
+        if settings.worker_max_memory_mb <= 0:
+            return
+        while not server.should_exit:
+            await asyncio.sleep(MEMORY_CHECK_INTERVAL)
+            used = rss_mb()
+            if used > settings.worker_max_memory_mb:
+                logger.warning(
+                    f"Worker {self.worker_id} (pid {os.getpid()}) uses {used:.0f} MB, "
+                    f"over the {settings.worker_max_memory_mb} MB budget; recycling"
+                )
+                # Same path as max requests: stop accepting, drain, then exit
+                server.should_exit = True
+
+class Supervisor:
+    """Keep a fixed number of workers running on one shared socket"""
+
+    def __init__(self, app, sock: socket.socket, workers: int):
+        self.app = app
+        self.sock = sock
+        self.workers: Dict[int, Worker] = {}
+        self.size = workers
+        self.stopping = False
+
+    def handle_stop(self, signum, frame):
+        if not self.stopping:
+            logger.info(f"Received {signal.Signals(signum).name}, draining workers")
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+
+        for worker_id in range(self.size):
+            self.spawn(Worker(self.app, self.sock, worker_id))
+
+        while not self.stopping:
+            self.reap()
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def spawn(self, worker: Worker):
+        worker.spawn()
+        self.workers[worker.pid] = worker
+        logger.info(f"Started worker {worker.worker_id} (pid {worker.pid})")
+
+    def reap(self):
+        """Replace workers that exited (recycled, crashed or failed to start)"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            lifetime = time.monotonic() - worker.started_at
+            if code == 0:
+                logger.info(f"Worker {worker.worker_id} (pid {pid}) {'stopped' if self.stopping else 'recycled'} after {lifetime:.0f}s")
+            else:
+                logger.error(f"Worker {worker.worker_id} (pid {pid}) exited with code {code} after {lifetime:.1f}s")
+                if lifetime < MIN_WORKER_LIFETIME:
+                    # Failing at startup (e.g. database unreachable): don't fork in a tight loop
+                    time.sleep(1.0)
+
+            if not self.stopping:
+                self.spawn(Worker(self.app, self.sock, worker.worker_id))
+
+    def shutdown(self):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        # Requests drain first, then the lifespan shutdown drains AI jobs; each gets the graceful timeout
+        deadline = time.monotonic() + 2 * settings.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        for pid, worker in list(self.workers.items()):
+            logger.warning(f"Worker {worker.worker_id} (pid {pid}) did not stop in time; killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.workers.clear()
+        logger.info("All workers stopped")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s")
+    workers = settings.web_concurrency or available_cpus()
+
+    # Configure logging and bind the socket once; every worker accepts on it
+    config = uvicorn.Config("app.main:app", host=settings.host, port=settings.port)
+    sock = config.bind_socket()
+
+    # Preload: import the app before forking so workers share its memory copy-on-write
+    from app.main import app
+    gc.collect()
+    gc.freeze()
+
+    logger.info(f"Serving on {settings.host}:{settings.port} with {workers} workers (supervisor pid {os.getpid()})")
+    if workers > 1 and settings.rate_limit_enabled and settings.rate_limit_backend == "memory":
+        logger.warning(
+            f"RATE_LIMIT_BACKEND=memory keeps buckets per worker: each limit is enforced {workers} times over, "
+            f"once per worker; set the limits accordingly or use a shared backend"
+        )
+    Supervisor(app, sock, workers).run()
+    sock.close()
+
+if __name__ == "__main__":
+    main()
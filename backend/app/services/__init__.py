@@ -0,0 +1 @@
+# Domain services
\ No newline at end of file
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import logging
+
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.core.database import db
+from app.core.storage import blob_sha256_from_url
+
+logger = logging.getLogger(__name__)
+
+def avatar_cache_key(photo_urls: List[str], style: Optional[str], model: str) -> str:
+    """Digest identifying a generation by photo content, style and model
+
+    Uploaded photos are identified by their content hash, so the same photos
+    reached through different URLs (or re-uploaded) share cache entries. The
+    result depends on nothing else, so users share entries too; as a job
+    dedupe_key it is scoped to the user by the job queue.
+    """
+    photos = sorted({blob_sha256_from_url(url) or url for url in photo_urls})
+    material = json.dumps({"photos": photos, "style": style, "model": model}, sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+class AvatarCache:
+    """Generated avatars keyed by avatar_cache_key, with single-flight computation
+
+    Results persist in MongoDB so they survive restarts and are shared between
+    API processes. The collection is bounded to AVATAR_CACHE_MAX_ENTRIES by
+    evicting the least recently used entries, and entries expire after
+    AVATAR_CACHE_TTL_HOURS. Concurrent requests for the same key in one process
+    wait for the first one instead of generating again.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def collection(self):
+        return db.database[self.collection_name]
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached result for the key, refreshing its position for eviction"""
+        now = datetime.utcnow()
+        entry = await self.collection.find_one_and_update(
+            {"key": key},
+            {"$set": {"last_used_at": now}, "$inc": {"hits": 1}},
+            projection={"_id": 0, "result": 1},
+        )
+        return entry["result"] if entry else None
+
+    async def put(self, key: str, result: Dict[str, Any]):
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "key": key,
+                "result": result,
+                "hits": 0,
+                "created_at": now,
+                "last_used_at": now,
+                "expires_at": now + timedelta(hours=settings.avatar_cache_ttl_hours),
+            })
+        except DuplicateKeyError:
+            # Another process cached the same generation first
+            return
+        await self._evict()
+
+    async def _evict(self):
+        excess = await self.collection.estimated_document_count() - settings.avatar_cache_max_entries
+        if excess <= 0:
+            return
+        cursor = self.collection.find({}, {"_id": 1}).sort("last_used_at", 1).limit(excess)
+        stale_ids = [entry["_id"] async for entry in cursor]
+        if stale_ids:
+            await self.collection.delete_many({"_id": {"$in": stale_ids}})
+            logger.info(f"Evicted {len(stale_ids)} avatar cache entries")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Return the cached result, or compute it once however many callers ask concurrently
+
+        The returned dict carries ``cached: True`` unless this call ran the computation.
+        """
+        result = await self.get(key)
+        if result is not None:
+            self.hits += 1
+            return {**result, "cached": True}
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return {**await asyncio.shield(future), "cached": True}
+
+        self.misses += 1
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await compute()
+            future.set_result(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise it; mark it retrieved so an unawaited future doesn't log a warning
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        try:
+            await self.put(key, result)
+        except Exception as e:
+            logger.error(f"Failed to cache avatar result {key}: {e}")
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "inflight": len(self._inflight)}
+
+# Cache shared by single and batch avatar generation
+avatar_cache = AvatarCache("avatar_cache")
@@ -0,0 +1,109 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Optional
+import asyncio
+import logging
+import multiprocessing
+import shutil
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.core.database import db
+from app.core.object_store import object_store, scratch_path
+from app.core.storage import Blob
+
+logger = logging.getLogger(__name__)
+
+# name -> (longest side in pixels, Pillow format, file extension, encoder options)
+VARIANTS = {
+    "thumbnail": (256, "WEBP", ".webp", {"quality": 75, "method": 4}),
+    "preview": (1024, "WEBP", ".webp", {"quality": 80, "method": 4}),
+    "model": (768, "JPEG", ".jpg", {"quality": 90, "optimize": True}),
+}
+
+FORMAT_CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+class InvalidImage(Exception):
+    """Raised when an upload cannot be decoded as an image"""
+
+def render_variants(source_path: str, out_dir: str) -> Dict[str, str]:
+    """Decode an image once and write every variant to out_dir (runs in a worker process)
+
+    EXIF orientation is applied to the pixels and no metadata is copied to the
+    outputs. Returns the path of each variant file.
+    """
+    largest = max(size for size, _, _, _ in VARIANTS.values())
+
+    with Image.open(source_path) as image:
+        # Uploads are sniffed on arrival; this catches headers the sniffer could not size
+        if image.width * image.height > settings.max_image_pixels:
+            raise Image.DecompressionBombError(f"{image.width}x{image.height} image exceeds {settings.max_image_pixels} pixels")
+        # Let the JPEG decoder downscale while decoding instead of materialising full resolution
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+
+        paths = {}
+        # Resize largest first so each smaller variant starts from an already reduced image
+        for name, (size, fmt, ext, options) in sorted(VARIANTS.items(), key=lambda item: -item[1][0]):
+            image.thumbnail((size, size), Image.LANCZOS)
+            path = Path(out_dir) / f"{name}{ext}"
+            image.save(path, fmt, **options)
+            paths[name] = str(path)
+
+    return paths
+
+def get_pool() -> ProcessPoolExecutor:
+    """Process pool used for image decoding and encoding"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.image_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+def shutdown_pool(wait: bool = True):
+    """Shut down the image process pool"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+
+def variant_urls(keys: Dict[str, str]) -> Dict[str, str]:
+    return {name: f"/uploads/{key}" for name, key in keys.items()}
+
+async def ensure_variants(blob: Blob) -> Dict[str, str]:
+    """Generate the resized variants of a blob unless it already has them"""
+    if blob.variants:
+        return variant_urls(blob.variants)
+
+    loop = asyncio.get_running_loop()
+    out_dir = scratch_path()
+    out_dir.mkdir()
+    try:
+        async with object_store.local_copy(blob.key) as source:
+            try:
+                paths = await loop.run_in_executor(get_pool(), render_variants, str(source.resolve()), str(out_dir.resolve()))
+            except BrokenProcessPool:
+                # A crashed worker poisons the whole pool; start a fresh one for the next upload
+                shutdown_pool(wait=False)
+                raise
+            except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+                raise InvalidImage(str(e)) from e
+        
+        keys = {name: f"{blob.sha256[:2]}/{blob.sha256}.{name}{VARIANTS[name][2]}" for name in paths}
+        await asyncio.gather(*(
+            object_store.put_file(keys[name], Path(path), FORMAT_CONTENT_TYPES[VARIANTS[name][1]])
+            for name, path in paths.items()
+        ))
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    await db.database.blobs.update_one({"sha256": blob.sha256}, {"$set": {"variants": keys}})
+    logger.info(f"Generated {len(keys)} variants for blob {blob.sha256}")
+    return variant_urls(keys)
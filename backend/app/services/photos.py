@@ -0,0 +1,148 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.core.storage import Blob, blob_sha256_from_url
+
+DUPLICATE_KEY = 11000
+
+# An add_photos still announced after this long died before counting its photos
+PHOTO_ADD_TIMEOUT_SECONDS = 60
+RECONCILE_RETRY_SECONDS = 0.05
+
+PHOTO_PROJECTION = {"_id": 1, "sha256": 1, "url": 1, "variants": 1, "width": 1, "height": 1, "created_at": 1}
+
+class InvalidCursor(Exception):
+    """Raised when a pagination cursor cannot be decoded"""
+
+async def add_photos(db, user_id: str, photos: List[Tuple[Blob, Dict[str, str]]]) -> Set[str]:
+    """Record stored photos for a user and bump their photo_count
+
+    Returns the URLs the user already had, whose extra blob reference the caller
+    should release. Three round trips however many photos are added: the add is
+    announced in the user's photo_adds first, so reconcile_photo_count does not
+    count the new photos in between their insert and the $inc.
+    """
+    now = datetime.utcnow()
+    docs = []
+    seen = set()
+    for blob, variants in photos:
+        if blob.url in seen:
+            continue
+        seen.add(blob.url)
+        docs.append({
+            "user_id": user_id,
+            "sha256": blob.sha256,
+            "url": blob.url,
+            "variants": variants,
+            "size": blob.size,
+            "width": blob.width,
+            "height": blob.height,
+            "created_at": now,
+        })
+
+    add_id = ObjectId()
+    await db.users.update_one({"user_id": user_id}, {"$push": {"photo_adds": {"id": add_id, "at": now}}})
+
+    already_present = set()
+    try:
+        await db.photos.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        duplicates = [error for error in e.details["writeErrors"] if error["code"] == DUPLICATE_KEY]
+        if len(duplicates) != len(e.details["writeErrors"]):
+            await db.users.update_one({"user_id": user_id}, {"$pull": {"photo_adds": {"id": add_id}}})
+            raise
+        already_present = {docs[error["index"]]["url"] for error in duplicates}
+    except BaseException:
+        await db.users.update_one({"user_id": user_id}, {"$pull": {"photo_adds": {"id": add_id}}})
+        raise
+
+    inserted = len(docs) - len(already_present)
+    update: Dict[str, Any] = {"$pull": {"photo_adds": {"id": add_id}}}
+    if inserted:
+        update.update({"$inc": {"photo_count": inserted}, "$set": {"updated_at": now}})
+    await db.users.update_one({"user_id": user_id}, update)
+    return already_present
+
+async def list_photos(db, user_id: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of a user's photos, newest first, and the cursor of the next page"""
+    query: Dict[str, Any] = {"user_id": user_id}
+    if cursor:
+        try:
+            query["_id"] = {"$lt": ObjectId(cursor)}
+        except (InvalidId, TypeError):
+            raise InvalidCursor(cursor)
+
+    # Fetch one extra document to know whether another page exists
+    docs = await db.photos.find(query, PHOTO_PROJECTION).sort("_id", -1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+async def backfill_user(db, user_doc: Dict[str, Any]) -> int:
+    """Move one user's embedded profile_photos / photo_variants into the photos collection
+
+    Idempotent and safe while the API serves traffic: photos are upserted, the
+    embedded arrays are only removed if unchanged since they were read, and
+    photo_count is recomputed from the collection. Returns the number of
+    photos copied, or -1 when the user changed concurrently and should be retried.
+    """
+    user_id = user_doc["user_id"]
+    urls = user_doc.get("profile_photos") or []
+    variants = user_doc.get("photo_variants") or {}
+    migrated_at = user_doc.get("updated_at") or datetime.utcnow()
+
+    if urls:
+        # ObjectIds follow insertion order, so keep the array order for pagination
+        operations = []
+        for url in dict.fromkeys(urls):
+            sha256 = blob_sha256_from_url(url)
+            operations.append(UpdateOne(
+                {"user_id": user_id, "url": url},
+                {"$setOnInsert": {
+                    "user_id": user_id,
+                    "sha256": sha256,
+                    "url": url,
+                    "variants": variants.get(sha256) if sha256 else None,
+                    "created_at": migrated_at,
+                }},
+                upsert=True
+            ))
+        await db.photos.bulk_write(operations, ordered=True)
+
+    result = await db.users.update_one(
+        {"user_id": user_id, "profile_photos": user_doc.get("profile_photos"), "photo_variants": user_doc.get("photo_variants")},
+        {"$unset": {"profile_photos": "", "photo_variants": ""}}
+    )
+    if result.modified_count == 0:
+        return -1
+
+    await reconcile_photo_count(db, user_id)
+    return len(urls)
+
+async def reconcile_photo_count(db, user_id: str) -> int:
+    """Set photo_count from the photos collection
+
+    The count is only written while no add_photos is in flight for the user,
+    since that add's $inc would count its photos a second time; an add that
+    finished meanwhile shows up in the recount and the count is taken again.
+    Adds announced longer than PHOTO_ADD_TIMEOUT_SECONDS ago died and are dropped.
+    """
+    while True:
+        stalled = datetime.utcnow() - timedelta(seconds=PHOTO_ADD_TIMEOUT_SECONDS)
+        count = await db.photos.count_documents({"user_id": user_id})
+        result = await db.users.update_one(
+            {"user_id": user_id, "photo_adds": {"$not": {"$elemMatch": {"at": {"$gt": stalled}}}}},
+            {"$set": {"photo_count": count}, "$pull": {"photo_adds": {"at": {"$lte": stalled}}}}
+        )
+        if result.matched_count == 0:
+            if not await db.users.find_one({"user_id": user_id}, {"_id": 1}):
+                return count
+            await asyncio.sleep(RECONCILE_RETRY_SECONDS)
+            continue
+        if await db.photos.count_documents({"user_id": user_id}) == count:
+            return count
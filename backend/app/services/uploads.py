@@ -0,0 +1,290 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+import asyncio
+import logging
+import time
+import uuid
+
+from pymongo import ReturnDocument
+import aiofiles
+
+from app.core.config import settings
+from app.core.database import db
+from app.core.image_header import HEADER_SCAN_LIMIT, ImageInfo, ImageSniffer, InvalidImageHeader, TooManyPixels
+from app.core.storage import StoredFile, UploadTooLarge, hash_file
+
+logger = logging.getLogger(__name__)
+
+# Dot-prefixed so the media route never serves partial uploads
+SESSIONS_DIR = ".sessions"
+
+# A writer holds the session for this long and renews it while bytes keep arriving
+WRITE_LEASE_SECONDS = 30
+LEASE_RENEW_SECONDS = 10
+
+SESSION_PROJECTION = {"_id": 0, "upload_id": 1, "length": 1, "offset": 1, "content_type": 1, "filename": 1, "expires_at": 1, "image": 1}
+
+class SessionNotFound(Exception):
+    """Raised for an unknown, expired or finished upload session"""
+
+class TooManySessions(Exception):
+    """Raised when a user already has UPLOAD_SESSION_MAX_PER_USER open sessions"""
+
+class UploadConflict(Exception):
+    """Raised when a chunk doesn't start at the current offset or another request holds the session"""
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+class UploadIncomplete(Exception):
+    """Raised when completing a session that has not received all its bytes"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload has {offset} bytes")
+        self.offset = offset
+
+class UploadSessions:
+    """Resumable uploads: chunks are appended to a file on disk at the session's offset
+
+    A client creates a session with the total length, PATCHes byte ranges in
+    order and asks for the current offset after a dropped connection, so a
+    retry only resends what the server does not have. Bytes received before a
+    disconnect are kept. One request at a time may write to a session (a lease
+    in MongoDB, so this holds across API processes). Sessions idle for
+    UPLOAD_SESSION_TTL_HOURS are deleted together with their data by a sweeper.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self):
+        return db.database[self.collection_name]
+
+    def part_path(self, upload_id: str) -> Path:
+        return Path(settings.upload_dir) / SESSIONS_DIR / f"{upload_id}.part"
+
+    async def create(self, user_id: str, length: int, content_type: str, filename: Optional[str] = None) -> Dict[str, Any]:
+        """Open a session for an upload of the given total length"""
+        now = datetime.utcnow()
+        active = await self.collection.count_documents({"user_id": user_id, "expires_at": {"$gt": now}})
+        if active >= settings.upload_session_max_per_user:
+            raise TooManySessions()
+
+        session = {
+            "upload_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "length": length,
+            "offset": 0,
+            "content_type": content_type,
+            "filename": filename,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": now + timedelta(hours=settings.upload_session_ttl_hours),
+        }
+        path = self.part_path(session["upload_id"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(path, "wb"):
+            pass
+        try:
+            await self.collection.insert_one(session)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        session.pop("_id", None)
+        return session
+
+    async def get(self, upload_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one(
+            {"upload_id": upload_id, "user_id": user_id, "expires_at": {"$gt": datetime.utcnow()}},
+            SESSION_PROJECTION
+        )
+
+    async def _acquire(self, upload_id: str, user_id: str, lease: str) -> Dict[str, Any]:
+        """Take the session's write lease, so no other request writes to or completes it"""
+        now = datetime.utcnow()
+        session = await self.collection.find_one_and_update(
+            {
+                "upload_id": upload_id,
+                "user_id": user_id,
+                "expires_at": {"$gt": now},
+                "$or": [{"lease": None}, {"lease_expires_at": {"$lt": now}}],
+            },
+            {"$set": {"lease": lease, "lease_expires_at": now + timedelta(seconds=WRITE_LEASE_SECONDS)}},
+            projection=SESSION_PROJECTION,
+            # Only the lease changes, so the document before the update is current
+            return_document=ReturnDocument.BEFORE,
+        )
+        if session is not None:
+            return session
+
+        existing = await self.get(upload_id, user_id)
+        if existing is None:
+            raise SessionNotFound(upload_id)
+        raise UploadConflict("Another request is writing to this upload", existing["offset"])
+
+    async def _release(self, upload_id: str, lease: str):
+        await self.collection.update_one(
+            {"upload_id": upload_id, "lease": lease},
+            {"$unset": {"lease": "", "lease_expires_at": ""}}
+        )
+
+    async def append(self, upload_id: str, user_id: str, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """Write a byte range starting at ``offset`` and return the new offset
+
+        Whatever arrived is recorded even if the stream fails midway (e.g. the
+        client disconnects), so the next attempt resumes from there. Until the
+        image header is complete, chunks are sniffed before they are written;
+        an upload that is not an acceptable image is deleted at once
+        (InvalidImageHeader or TooManyPixels).
+        """
+        lease = uuid.uuid4().hex
+        session = await self._acquire(upload_id, user_id, lease)
+        if offset != session["offset"]:
+            await self._release(upload_id, lease)
+            raise UploadConflict(f"Upload is at offset {session['offset']}", session["offset"])
+
+        sniffer = None if session.get("image") else ImageSniffer(settings.max_image_pixels)
+        written = 0
+        rejected = False
+        try:
+            async with aiofiles.open(self.part_path(upload_id), "r+b") as out:
+                # Drop anything past the recorded offset left by a writer that crashed
+                await out.truncate(offset)
+                if sniffer is not None and offset:
+                    # The header started in an earlier chunk
+                    sniffer.feed(await out.read(min(offset, HEADER_SCAN_LIMIT)))
+                await out.seek(offset)
+                renew_at = time.monotonic() + LEASE_RENEW_SECONDS
+                async for chunk in chunks:
+                    if offset + written + len(chunk) > session["length"]:
+                        raise UploadTooLarge(f"Upload exceeds its declared length of {session['length']} bytes")
+                    if sniffer is not None:
+                        sniffer.feed(chunk)
+                    await out.write(chunk)
+                    written += len(chunk)
+                    if time.monotonic() >= renew_at:
+                        await self._renew(upload_id, lease, offset + written)
+                        renew_at = time.monotonic() + LEASE_RENEW_SECONDS
+        except (InvalidImageHeader, TooManyPixels):
+            rejected = True
+            raise
+        finally:
+            if rejected:
+                await asyncio.shield(self._discard(upload_id, lease))
+            else:
+                image = sniffer.result() if sniffer is not None and sniffer.done else None
+                await asyncio.shield(self._record(upload_id, lease, offset + written, image))
+        return offset + written
+
+    async def _renew(self, upload_id: str, lease: str, offset: int):
+        result = await self.collection.update_one(
+            {"upload_id": upload_id, "lease": lease},
+            {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=WRITE_LEASE_SECONDS)}}
+        )
+        if result.modified_count == 0:
+            # The lease lapsed and another request took over the session
+            raise UploadConflict("Upload was taken over by another request", offset)
+
+    async def _record(self, upload_id: str, lease: str, offset: int, image: Optional[ImageInfo] = None):
+        """Store the new offset (and the image header once read) and release the lease, unless another request took it over"""
+        now = datetime.utcnow()
+        update = {
+            "offset": offset,
+            "updated_at": now,
+            "expires_at": now + timedelta(hours=settings.upload_session_ttl_hours),
+        }
+        if image is not None:
+            update["image"] = image._asdict()
+        await self.collection.update_one(
+            {"upload_id": upload_id, "lease": lease},
+            {"$set": update, "$unset": {"lease": "", "lease_expires_at": ""}}
+        )
+
+    async def _discard(self, upload_id: str, lease: str):
+        result = await self.collection.delete_one({"upload_id": upload_id, "lease": lease})
+        if result.deleted_count:
+            self.part_path(upload_id).unlink(missing_ok=True)
+
+    async def complete(self, upload_id: str, user_id: str) -> StoredFile:
+        """Close a fully received session and return its file, ready for the blob store"""
+        lease = uuid.uuid4().hex
+        session = await self._acquire(upload_id, user_id, lease)
+        if session["offset"] < session["length"]:
+            await self._release(upload_id, lease)
+            raise UploadIncomplete(session["offset"])
+        if not session.get("image"):
+            # Every byte arrived without completing a header
+            await self._discard(upload_id, lease)
+            raise InvalidImageHeader("Upload ended inside the image header")
+
+        path = self.part_path(upload_id)
+        try:
+            sha256 = await asyncio.get_running_loop().run_in_executor(None, hash_file, path)
+        except BaseException:
+            await self._release(upload_id, lease)
+            raise
+        await self.collection.delete_one({"upload_id": upload_id, "lease": lease})
+        return StoredFile(path=path, size=session["length"], sha256=sha256, image=ImageInfo(**session["image"]))
+
+    async def abort(self, upload_id: str, user_id: str):
+        """Delete a session and the bytes received so far"""
+        result = await self.collection.delete_one({"upload_id": upload_id, "user_id": user_id})
+        if result.deleted_count == 0:
+            raise SessionNotFound(upload_id)
+        self.part_path(upload_id).unlink(missing_ok=True)
+
+    async def sweep(self) -> int:
+        """Delete expired sessions and session files no session refers to"""
+        now = datetime.utcnow()
+        removed = 0
+        expired = await self.collection.find({"expires_at": {"$lte": now}}, {"_id": 0, "upload_id": 1}).to_list(1000)
+        for session in expired:
+            # Skip sessions written to since they were listed
+            result = await self.collection.delete_one({"upload_id": session["upload_id"], "expires_at": {"$lte": now}})
+            if result.deleted_count:
+                self.part_path(session["upload_id"]).unlink(missing_ok=True)
+                removed += 1
+
+        # Files of sessions lost to a crash between deleting the document and the file
+        sessions_dir = Path(settings.upload_dir) / SESSIONS_DIR
+        cutoff = time.time() - settings.upload_session_ttl_hours * 3600
+        try:
+            stale = {path.stem: path for path in sessions_dir.glob("*.part") if path.stat().st_mtime < cutoff}
+        except FileNotFoundError:
+            stale = {}
+        if stale:
+            known = await self.collection.find({"upload_id": {"$in": list(stale)}}, {"_id": 0, "upload_id": 1}).to_list(len(stale))
+            for upload_id in set(stale) - {session["upload_id"] for session in known}:
+                stale[upload_id].unlink(missing_ok=True)
+                removed += 1
+
+        if removed:
+            logger.info(f"Removed {removed} abandoned upload sessions")
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Failed to sweep upload sessions: {e}")
+            await asyncio.sleep(settings.upload_session_sweep_seconds)
+
+    def start(self):
+        """Start the background sweeper"""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name=f"{self.collection_name}-sweeper")
+
+    async def stop(self):
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        await asyncio.gather(self._sweeper, return_exceptions=True)
+        self._sweeper = None
+
+# Sessions of resumable photo uploads
+upload_sessions = UploadSessions("upload_sessions")
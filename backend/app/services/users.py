@@ -0,0 +1,134 @@
+from typing import Any, Dict, Iterable, Optional, Set
+import asyncio
+import logging
+from datetime import datetime
+
+from app.core.auth_cache import auth_cache
+from app.core.config import settings
+from app.core.database import db
+
+logger = logging.getLogger(__name__)
+
+USER_FIELDS = ("user_id", "phone_number", "is_active", "photo_count", "created_at", "updated_at")
+
+# Fields of the user kept for authenticated requests
+AUTH_FIELDS = ("user_id", "phone_number", "is_active")
+
+class UserRecord:
+    """Compact read-only view of a user; fields that were not fetched are None"""
+
+    __slots__ = USER_FIELDS
+
+    def __init__(self, doc: Dict[str, Any]):
+        for name in USER_FIELDS:
+            object.__setattr__(self, name, doc.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserRecord is read-only")
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in USER_FIELDS if getattr(self, name) is not None)
+        return f"UserRecord({fields})"
+
+class UserRepository:
+    """Batched, projected lookups of users by user_id
+
+    Lookups made within USER_BATCH_WINDOW_MS of each other are answered by one
+    ``{"user_id": {"$in": [...]}}`` query projecting only the union of the fields
+    the callers asked for, and concurrent lookups of the same user share a
+    result. A batch is sent early once it holds USER_BATCH_MAX_SIZE users.
+    Nothing is cached across batches, so every lookup sees current data.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._fields: Set[str] = set()
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.lookups = 0
+        self.queries = 0
+        self.largest_batch = 0
+
+    @property
+    def collection(self):
+        return db.database[self.collection_name]
+
+    async def get(self, user_id: str, fields: Iterable[str] = AUTH_FIELDS) -> Optional[UserRecord]:
+        """The user with the requested fields (user_id is always included), or None"""
+        self.lookups += 1
+        loop = asyncio.get_running_loop()
+        future = self._pending.get(user_id)
+        if future is None:
+            future = self._pending[user_id] = loop.create_future()
+        self._fields.update(fields)
+
+        if len(self._pending) >= settings.user_batch_max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(settings.user_batch_window_ms / 1000, self._flush)
+
+        # Other callers may be waiting on the same future; don't cancel it for them
+        return await asyncio.shield(future)
+
+    async def exists(self, user_id: str) -> bool:
+        return await self.get(user_id, ("user_id",)) is not None
+
+    async def photo_count(self, user_id: str) -> int:
+        user = await self.get(user_id, ("photo_count",))
+        return (user.photo_count or 0) if user else 0
+
+    async def set_active(self, user_id: str, is_active: bool) -> bool:
+        """Enable or disable a user; False if there is no such user
+
+        is_active is kept in the auth cache, so the user's cached tokens are
+        dropped here rather than served with the old value.
+        """
+        result = await self.collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"is_active": is_active, "updated_at": datetime.utcnow()}}
+        )
+        auth_cache.invalidate_user(user_id)
+        return result.matched_count > 0
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, fields = self._pending, self._fields
+        self._pending, self._fields = {}, set()
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._load(batch, fields))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _load(self, batch: Dict[str, asyncio.Future], fields: Set[str]):
+        self.queries += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        projection = {"_id": 0, "user_id": 1, **{name: 1 for name in fields}}
+        try:
+            docs = await self.collection.find({"user_id": {"$in": list(batch)}}, projection).to_list(len(batch))
+        except Exception as e:
+            logger.error(f"User lookup of {len(batch)} users failed: {e}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # Waiters re-raise it; mark it retrieved in case every waiter was cancelled
+                    future.exception()
+            return
+
+        found = {doc["user_id"]: UserRecord(doc) for doc in docs}
+        for user_id, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(user_id))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "lookups": self.lookups,
+            "queries": self.queries,
+            "largest_batch": self.largest_batch,
+            "pending": len(self._pending),
+        }
+
+# Repository shared by every router reading users
+users = UserRepository("users")
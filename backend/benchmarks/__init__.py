@@ -0,0 +1 @@
+# Benchmarks and load tests
\ No newline at end of file
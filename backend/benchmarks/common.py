@@ -0,0 +1,29 @@
+import sys
+import uuid
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+async def open_database(mongodb_url, prefix):
+    """Open a throwaway database: a temporary one on a real MongoDB, or the in-memory stand-in
+
+    Returns (database, client); client is None for the stand-in.
+    """
+    if mongodb_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongodb_url)
+        return client[f"{prefix}_{uuid.uuid4().hex[:8]}"], client
+
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("Install benchmark requirements (pip install -r benchmarks/requirements.txt) or pass --mongodb-url")
+    return AsyncMongoMockClient()[prefix], None
+
+async def close_database(database, client):
+    if client is not None:
+        await client.drop_database(database.name)
+        client.close()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+In-process load test for every router
+
+Drives create_app() through ASGI (no network, no server process) against a
+throwaway database and reports throughput and latency percentiles per scenario.
+Results are written as JSON so two runs can be compared:
+
+    python -m benchmarks.load --output before.json
+    python -m benchmarks.load --output after.json --compare before.json
+
+Run from the backend directory. Uses the in-memory database stand-in unless
+--mongodb-url is given, in which case a temporary database is created and dropped.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+from PIL import Image
+
+from app.core.config import settings
+from app.core.database import db, create_indexes
+from app.core.jobs import ai_jobs
+from app.core.object_store import object_store
+from app.core.security import create_access_token, generate_user_id
+from app.main import create_app
+from app.services.avatar import AVATAR_BATCH_JOB, AVATAR_JOB, generate_avatar_batch_job, generate_avatar_job
+from app.services.images import get_pool, shutdown_pool
+from benchmarks.common import percentile, open_database, close_database
+
+UPLOAD_SIZES = {"upload_100kb": 100 * 1024, "upload_1mb": 1024 * 1024, "upload_4mb": 4 * 1024 * 1024}
+
+def make_jpeg(target_size):
+    """Noise JPEG of roughly the requested size (noise defeats compression like a real photo's detail)"""
+    side = max(16, int((target_size / 1.6) ** 0.5))
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+class Scenario:
+    """A named request factory; make_request(client, i) performs request number i"""
+
+    def __init__(self, name, make_request, setup=None):
+        self.name = name
+        self.make_request = make_request
+        self.setup = setup
+
+async def run_scenario(client, scenario, requests, concurrency):
+    if scenario.setup:
+        await scenario.setup(client, requests)
+
+    latencies = []
+    statuses = {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start_time = time.perf_counter()
+            try:
+                response = await scenario.make_request(client, i)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "req_per_s": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "errors": errors,
+        "statuses": statuses,
+    }
+
+def build_scenarios(user_id, token):
+    auth_headers = {"Authorization": f"Bearer {token}"}
+    otp_codes = {}
+
+    async def health(client, i):
+        return await client.get("/health")
+
+    async def catalog(client, i):
+        return await client.get("/ai/styles" if i % 2 else "/ai/models")
+
+    async def send_otp(client, i):
+        return await client.post("/auth/send-otp", json={"phone_number": f"+1555{i:07d}"})
+
+    async def setup_verify(client, requests):
+        for i in range(requests):
+            phone_number = f"+1666{i:07d}"
+            await client.post("/auth/send-otp", json={"phone_number": phone_number})
+            otp_doc = await db.database.otps.find_one({"phone_number": phone_number})
+            otp_codes[phone_number] = otp_doc["otp_code"]
+
+    async def verify_otp(client, i):
+        phone_number = f"+1666{i:07d}"
+        return await client.post("/auth/verify-otp", json={"phone_number": phone_number, "otp_code": otp_codes[phone_number]})
+
+    def upload(size):
+        base = make_jpeg(size)
+
+        async def request(client, i):
+            # Trailing bytes after the JPEG end marker make every upload unique without breaking decoding
+            data = base + os.urandom(16)
+            return await client.post("/upload/photo", headers=auth_headers, files={"file": ("photo.jpg", data, "image/jpeg")})
+
+        return request
+
+    media_urls = []
+
+    async def setup_media(client, requests):
+        response = await client.post("/upload/photo", headers=auth_headers, files={"file": ("photo.jpg", make_jpeg(1024 * 1024), "image/jpeg")})
+        media_urls.extend([response.json()["file_url"], response.json()["variants"]["thumbnail"]])
+
+    async def media(client, i):
+        # Gallery pattern: mostly thumbnails, some full-size range requests
+        if i % 4:
+            return await client.get(media_urls[1])
+        return await client.get(media_urls[0], headers={"Range": "bytes=0-262143"})
+
+    async def generate_avatar(client, i):
+        return await client.post("/ai/generate-avatar", json={
+            "user_id": user_id,
+            "photo_urls": ["/uploads/benchmark.jpg"],
+            "style": random.choice(["casual", "formal", "trendy"]),
+        })
+
+    async def generate_avatars(client, i):
+        return await client.post("/ai/generate-avatars", json={
+            "user_id": user_id,
+            "photo_urls": ["/uploads/benchmark.jpg"],
+            "styles": ["casual", "formal", "trendy", "vintage", "seasonal"],
+        })
+
+    scenarios = [
+        Scenario("health", health),
+        Scenario("catalog", catalog),
+        Scenario("send_otp", send_otp),
+        Scenario("verify_otp", verify_otp, setup=setup_verify),
+    ]
+    scenarios += [Scenario(name, upload(size)) for name, size in UPLOAD_SIZES.items()]
+    scenarios.append(Scenario("media", media, setup=setup_media))
+    scenarios.append(Scenario("generate_avatar", generate_avatar))
+    scenarios.append(Scenario("generate_avatars", generate_avatars))
+    return scenarios
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path, threshold):
+    """Print the change against a previous run; return True when any p99 or throughput regressed"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["scenarios"]
+
+    regressed = False
+    print(f"\nComparison with {baseline_path} (regression threshold {threshold:.0%})")
+    print(f"{'scenario':<18}{'req/s':>22}{'p99 ms':>24}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        rps_change = current["req_per_s"] / previous["req_per_s"] - 1
+        p99_change = current["p99_ms"] / previous["p99_ms"] - 1 if previous["p99_ms"] else 0.0
+        flag = ""
+        if rps_change < -threshold or p99_change > threshold:
+            regressed = True
+            flag = "  REGRESSION"
+        print(
+            f"{name:<18}{previous['req_per_s']:>9.1f} -> {current['req_per_s']:>7.1f} ({rps_change:+.0%})"
+            f"{previous['p99_ms']:>9.1f} -> {current['p99_ms']:>7.1f} ({p99_change:+.0%}){flag}"
+        )
+    return regressed
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", help="Run against a real MongoDB (a temporary database is used)")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--upload-requests", type=int, default=50, help="Requests per upload scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent in-flight requests")
+    parser.add_argument("--scenarios", help="Comma-separated subset of scenarios to run")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON report")
+    parser.add_argument("--compare", help="Previous JSON report to diff against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    # Measure server cost, not admission control
+    settings.rate_limit_enabled = False
+    # The object store fixed its root at import, so it is pointed at the throwaway directory too
+    upload_dir = tempfile.mkdtemp(prefix="bench_uploads_")
+    settings.upload_dir = upload_dir
+    if object_store.local:
+        object_store.root = Path(upload_dir)
+
+    database, client = await open_database(args.mongodb_url, "load_bench")
+    db.client = client
+    db.database = database
+    await create_indexes()
+
+    user_id = generate_user_id()
+    await database.users.insert_one({"user_id": user_id, "phone_number": "+15550000000", "is_active": True, "photo_count": 0})
+    token = create_access_token({"user_id": user_id, "phone_number": "+15550000000"})
+
+    ai_jobs.register(AVATAR_JOB, generate_avatar_job)
+    ai_jobs.register(AVATAR_BATCH_JOB, generate_avatar_batch_job)
+    await ai_jobs.start(settings.ai_worker_concurrency)
+
+    # Spawn the image worker processes now so process start-up is not billed to the first uploads
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(get_pool(), os.getpid) for _ in range(settings.image_workers)))
+
+    app = create_app()
+    scenarios = build_scenarios(user_id, token)
+    if args.scenarios:
+        selected = set(args.scenarios.split(","))
+        scenarios = [scenario for scenario in scenarios if scenario.name in selected]
+
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+            print(f"{'scenario':<18}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+            for scenario in scenarios:
+                requests = args.upload_requests if scenario.name in UPLOAD_SIZES else args.requests
+                stats = await run_scenario(http, scenario, requests, args.concurrency)
+                results[scenario.name] = stats
+                print(
+                    f"{scenario.name:<18}{stats['req_per_s']:>10.1f}{stats['p50_ms']:>10.2f}"
+                    f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['errors']:>8}"
+                )
+    finally:
+        await ai_jobs.stop(timeout=5)
+        shutdown_pool()
+        await close_database(database, client)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "database": "mongodb" if args.mongodb_url else "in-memory",
+        "scenarios": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
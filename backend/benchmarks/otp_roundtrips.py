@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: MongoDB round trips and latency per OTP login
+
+Compares the original send/verify flow (delete + insert, then find + update +
+find + insert) with the current handlers in app.routers.auth. Every awaited
+collection call is counted as one round trip, and an optional artificial delay
+per call models network latency to the database.
+
+Usage:
+    python -m benchmarks.otp_roundtrips                      # in-memory stand-in
+    python -m benchmarks.otp_roundtrips --mongodb-url mongodb://localhost:27017
+    python -m benchmarks.otp_roundtrips --latency-ms 2 --logins 200
+
+Run from the backend directory.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app.core.security import generate_otp, generate_user_id
+from app.models.auth import OTPRequest, OTPVerify
+from app.routers import auth
+from benchmarks.common import percentile, open_database, close_database
+
+class CountingCollection:
+    """Proxy that counts (and optionally delays) every awaited collection call"""
+
+    def __init__(self, collection, counter, latency):
+        self._collection = collection
+        self._counter = counter
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            self._counter[name] = self._counter.get(name, 0) + 1
+            if self._latency:
+                await asyncio.sleep(self._latency)
+            return await attr(*args, **kwargs)
+
+        return call
+
+class CountingDatabase:
+    def __init__(self, database, latency=0.0):
+        self._database = database
+        self._latency = latency
+        self.counter = {}
+
+    def __getattr__(self, name):
+        return CountingCollection(self._database[name], self.counter, self._latency)
+
+    def reset(self):
+        self.counter = {}
+
+    @property
+    def round_trips(self):
+        return sum(self.counter.values())
+
+async def legacy_send_otp(phone_number, db):
+    """Original send-otp implementation"""
+    otp_code = generate_otp()
+    await db.otps.delete_many({"phone_number": phone_number})
+    await db.otps.insert_one({
+        "phone_number": phone_number,
+        "otp_code": otp_code,
+        "created_at": datetime.utcnow(),
+        "expires_at": datetime.utcnow() + timedelta(minutes=10),
+        "verified": False
+    })
+
+async def legacy_verify_otp(phone_number, otp_code, db):
+    """Original verify-otp implementation"""
+    otp_doc = await db.otps.find_one({"phone_number": phone_number, "otp_code": otp_code, "verified": False})
+    if not otp_doc or otp_doc["expires_at"] < datetime.utcnow():
+        raise RuntimeError("OTP rejected")
+    await db.otps.update_one({"_id": otp_doc["_id"]}, {"$set": {"verified": True}})
+    user_doc = await db.users.find_one({"phone_number": phone_number})
+    if not user_doc:
+        await db.users.insert_one({
+            "user_id": generate_user_id(),
+            "phone_number": phone_number,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+            "is_active": True,
+            "profile_photos": []
+        })
+
+async def current_send_otp(phone_number, db):
+    await auth.send_otp(OTPRequest(phone_number=phone_number), db=db)
+
+async def current_verify_otp(phone_number, otp_code, db):
+    await auth.verify_otp(OTPVerify(phone_number=phone_number, otp_code=otp_code), db=db)
+
+FLOWS = {
+    "legacy": (legacy_send_otp, legacy_verify_otp),
+    "current": (current_send_otp, current_verify_otp),
+}
+
+async def run_flow(name, raw_db, logins, latency):
+    send, verify = FLOWS[name]
+    counted = CountingDatabase(raw_db, latency)
+    results = {}
+
+    for scenario in ("new_user", "returning_user"):
+        trips = []
+        durations = []
+        for i in range(logins):
+            phone_number = f"+1555{name}{scenario}{i:05d}"
+            if scenario == "returning_user":
+                await raw_db.users.insert_one({"user_id": generate_user_id(), "phone_number": phone_number})
+
+            counted.reset()
+            await send(phone_number, counted)
+            otp_code = (await raw_db.otps.find_one({"phone_number": phone_number}))["otp_code"]
+
+            start_time = time.perf_counter()
+            await verify(phone_number, otp_code, counted)
+            durations.append((time.perf_counter() - start_time) * 1000)
+            trips.append(counted.round_trips)
+
+        results[scenario] = {
+            "round_trips_per_login": statistics.mean(trips),
+            "verify_p50_ms": round(percentile(durations, 50), 3),
+            "verify_p99_ms": round(percentile(durations, 99), 3),
+        }
+
+    return results
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", help="Benchmark against a real MongoDB (a temporary database is used)")
+    parser.add_argument("--logins", type=int, default=100, help="Logins per scenario")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated database latency per round trip")
+    args = parser.parse_args()
+
+    database, client = await open_database(args.mongodb_url, "otp_bench")
+    await database.otps.create_index("phone_number", unique=True)
+    await database.users.create_index("phone_number", unique=True)
+    await database.users.create_index("user_id", unique=True)
+
+    try:
+        print(f"OTP login round trips ({args.logins} logins per scenario, {args.latency_ms}ms simulated latency)")
+        print(f"{'flow':<10}{'scenario':<17}{'send+verify trips':>18}{'verify p50 ms':>15}{'verify p99 ms':>15}")
+        for name in FLOWS:
+            results = await run_flow(name, database, args.logins, args.latency_ms / 1000)
+            for scenario, stats in results.items():
+                print(
+                    f"{name:<10}{scenario:<17}{stats['round_trips_per_login']:>18.1f}"
+                    f"{stats['verify_p50_ms']:>15.2f}{stats['verify_p99_ms']:>15.2f}"
+                )
+    finally:
+        await close_database(database, client)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1 @@
+# One-off data migrations
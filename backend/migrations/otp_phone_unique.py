@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Make otps.phone_number unique: keep each phone's newest OTP, replace the old index
+
+send-otp keeps one OTP per phone number with an upsert backed by a unique
+index. Deployments from before that have a plain phone_number_1 index, and may
+hold several OTPs for a phone, either of which keeps the unique index from
+being created. This deletes all but the newest OTP of each phone number
+(older ones could no longer be verified by a fresh send anyway), drops the
+non-unique index and creates the unique one. OTPs that send-otp duplicates
+while the index is missing are removed on the next pass.
+
+Usage:
+    python -m migrations.otp_phone_unique --dry-run
+    python -m migrations.otp_phone_unique
+
+Run from the backend directory; MONGODB_URL and DATABASE_NAME come from the
+environment / .env like the API. It is idempotent and safe to run while the
+API serves traffic.
+"""
+import argparse
+import asyncio
+import logging
+
+from pymongo.errors import DuplicateKeyError
+
+from app.core.database import db, init_database, close_database
+
+INDEX_NAME = "phone_number_1"
+MAX_RETRIES = 5
+
+async def duplicate_phones():
+    """Per phone number with several OTPs, the _ids of all but the newest"""
+    groups = await db.database.otps.aggregate([
+        {"$sort": {"created_at": -1, "_id": -1}},
+        {"$group": {"_id": "$phone_number", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]).to_list(None)
+    return {group["_id"]: group["ids"][1:] for group in groups}
+
+async def deduplicate() -> int:
+    deleted = 0
+    for ids in (await duplicate_phones()).values():
+        result = await db.database.otps.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+    return deleted
+
+async def make_unique(drop_index: bool) -> int:
+    """Deduplicate, replace the plain index and create the unique one; returns the OTPs deleted"""
+    deleted = await deduplicate()
+    logging.info(f"Deleted {deleted} duplicate OTPs")
+    if drop_index:
+        await db.database.otps.drop_index(INDEX_NAME)
+        logging.info(f"Dropped non-unique index {INDEX_NAME}")
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            await db.database.otps.create_index("phone_number", unique=True)
+            return deleted
+        except DuplicateKeyError:
+            # send-otp inserted a duplicate while no index backed its upsert
+            deleted += await deduplicate()
+    raise SystemExit(f"Could not create the unique index after {MAX_RETRIES} attempts; run it again")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Only report duplicates and the current index")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # init_database creates indexes too; the unique one failing there is expected here
+    await init_database()
+
+    try:
+        index = (await db.database.otps.index_information()).get(INDEX_NAME)
+        if args.dry_run:
+            duplicates = await duplicate_phones()
+            print(
+                f"{sum(len(ids) for ids in duplicates.values())} duplicate OTPs for {len(duplicates)} phone numbers; "
+                f"index {INDEX_NAME}: {'unique' if index and index.get('unique') else 'not unique' if index else 'missing'}"
+            )
+            return
+
+        if index and index.get("unique"):
+            print(f"{INDEX_NAME} is already unique")
+            return
+
+        deleted = await make_unique(index is not None)
+        print(f"Deleted {deleted} duplicate OTPs and created the unique {INDEX_NAME} index")
+    finally:
+        await close_database()
+
+if __name__ == "__main__":
+    asyncio.run(main())
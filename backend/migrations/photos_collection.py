@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Backfill: move users' embedded profile_photos into the photos collection
+
+Copies each user's profile_photos / photo_variants into one photos document per
+photo, removes the arrays from the user document and sets photo_count. It runs
+online: the API can keep serving while it works, every step is idempotent, and
+a user whose arrays change mid-way is simply retried.
+
+Usage:
+    python -m migrations.photos_collection --dry-run
+    python -m migrations.photos_collection --batch-size 500 --pause-ms 50
+
+Run from the backend directory; MONGODB_URL and DATABASE_NAME come from the
+environment / .env like the API. Re-run it after the last instance of the old
+code is gone to pick up photos those instances wrote in the meantime.
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from app.core.database import db, init_database, close_database
+from app.services.photos import backfill_user
+
+MAX_RETRIES = 5
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=200, help="Users read per batch")
+    parser.add_argument("--pause-ms", type=int, default=0, help="Pause between batches to limit load on the primary")
+    parser.add_argument("--dry-run", action="store_true", help="Only count users and photos still to migrate")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    await init_database()
+
+    pending = {"profile_photos": {"$exists": True}}
+    projection = {"_id": 1, "user_id": 1, "profile_photos": 1, "photo_variants": 1, "updated_at": 1}
+    try:
+        if args.dry_run:
+            users = await db.database.users.count_documents(pending)
+            photos = await db.database.users.aggregate([
+                {"$match": pending},
+                {"$group": {"_id": None, "photos": {"$sum": {"$size": {"$ifNull": ["$profile_photos", []]}}}}},
+            ]).to_list(1)
+            print(f"{users} users with {photos[0]['photos'] if photos else 0} embedded photos to migrate")
+            return
+
+        start_time = time.perf_counter()
+        migrated_users = migrated_photos = failed = 0
+        last_id = None
+        while True:
+            # Walk by _id so users migrated (and no longer matching) don't shift the batches
+            query = dict(pending, **({"_id": {"$gt": last_id}} if last_id else {}))
+            batch = await db.database.users.find(query, projection).sort("_id", 1).limit(args.batch_size).to_list(args.batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            for user_doc in batch:
+                for attempt in range(MAX_RETRIES):
+                    copied = await backfill_user(db.database, user_doc)
+                    if copied >= 0:
+                        migrated_users += 1
+                        migrated_photos += copied
+                        break
+                    # The user uploaded during the copy; read the new arrays and try again
+                    user_doc = await db.database.users.find_one({"_id": user_doc["_id"]}, projection)
+                    if user_doc is None or "profile_photos" not in user_doc:
+                        break
+                else:
+                    failed += 1
+                    logging.warning(f"Gave up on user {user_doc['user_id']} after {MAX_RETRIES} attempts")
+
+            logging.info(f"Migrated {migrated_users} users / {migrated_photos} photos so far")
+            if args.pause_ms:
+                await asyncio.sleep(args.pause_ms / 1000)
+
+        print(
+            f"Migrated {migrated_users} users and {migrated_photos} photos in {time.perf_counter() - start_time:.1f}s"
+            + (f"; {failed} users failed, re-run to retry them" if failed else "")
+        )
+    finally:
+        await close_database()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -14,19 +14,24 @@ def test_imports():
         print("Testing imports...")
         
         # Test core modules
-        from app.core import config, database, security
+        from app.core import config, database, security, auth_cache, http_cache, image_header, inference, job_events, jobs, media, metrics, middleware, object_store, profiling, ratelimit, s3, storage
         print("✓ Core modules imported successfully")
         
         # Test models
         from app.models import user, auth, api
         print("✓ Model modules imported successfully")
         
+        # Test services
+        from app.services import avatar, avatar_cache, images, photos, uploads, users
+        print("✓ Service modules imported successfully")
+        
         # Test routers
-        from app.routers import health, auth, upload, ai
+        from app.routers import health, auth, upload, ai, media
         print("✓ Router modules imported successfully")
         
         # Test main app
         from app.main import create_app
+        from app import server
         print("✓ Main app module imported successfully")
         
         return True
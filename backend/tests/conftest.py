@@ -0,0 +1,40 @@
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from app.core.config import settings
+from app.core.database import create_indexes, db
+from app.core.object_store import object_store
+from app.core.ratelimit import ShardedMemoryBackend, limiter
+from app.core.security import create_access_token
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def database(tmp_path, monkeypatch):
+    """An empty in-memory database with the app's indexes, and uploads kept under tmp_path"""
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+    monkeypatch.setattr(object_store, "root", tmp_path)
+    db.client = AsyncMongoMockClient()
+    db.database = db.client["test"]
+    await create_indexes()
+    yield db.database
+    db.client = None
+    db.database = None
+
+@pytest.fixture
+async def client(database, monkeypatch):
+    """HTTP client for the app, with empty rate limit buckets"""
+    from app.main import create_app
+    monkeypatch.setattr(limiter, "backend", ShardedMemoryBackend(settings.rate_limit_shards, settings.rate_limit_max_keys))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app()), base_url="http://test") as client:
+        yield client
+
+@pytest.fixture
+async def user_headers(database):
+    """Authorization header of a stored user, u1"""
+    await database.users.insert_one({"user_id": "u1", "phone_number": "+15550100", "is_active": True, "photo_count": 0})
+    token = create_access_token({"user_id": "u1", "phone_number": "+15550100"})
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,29 @@
+import pytest
+
+from app.core.auth_cache import auth_cache
+from app.routers.auth import upsert_user
+from app.services.users import UserRecord, users
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def cached_user():
+    auth_cache.clear()
+    user = UserRecord({"user_id": "u1", "phone_number": "+15550100", "is_active": True})
+    auth_cache.put("token", {}, user)
+    yield user
+    auth_cache.clear()
+
+async def test_login_drops_cached_tokens(database, cached_user):
+    await database.users.insert_one({"user_id": "u1", "phone_number": "+15550100", "is_active": True})
+
+    assert (await upsert_user(database, "+15550100"))["user_id"] == "u1"
+    assert auth_cache.get("token") is None
+
+async def test_deactivating_drops_cached_tokens(database, cached_user):
+    await database.users.insert_one({"user_id": "u1", "phone_number": "+15550100", "is_active": True})
+
+    assert await users.set_active("u1", False)
+    assert auth_cache.get("token") is None
+    assert (await users.get("u1")).is_active is False
+    assert not await users.set_active("missing", False)
@@ -0,0 +1,35 @@
+import pytest
+
+from app.core.inference import InferenceScheduler, StubBackend
+from app.services import avatar
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def scheduler(database, monkeypatch):
+    """A stub inference scheduler without the stub's simulated delays"""
+    monkeypatch.setattr(avatar, "PREPROCESS_SECONDS", 0)
+    monkeypatch.setattr(StubBackend, "batch_seconds", 0)
+    monkeypatch.setattr(StubBackend, "item_seconds", 0)
+    scheduler = InferenceScheduler()
+    monkeypatch.setattr(avatar, "inference", scheduler)
+    yield scheduler
+    await scheduler.stop()
+
+def avatar_job(job_id: str, **payload):
+    return {"job_id": job_id, "user_id": "u1", "attempts": 1, "payload": {"photo_urls": ["/uploads/a.jpg"], **payload}}
+
+async def test_each_style_gets_its_own_avatar(scheduler):
+    casual = await avatar.generate_avatar_job(avatar_job("j1", style="casual"))
+    formal = await avatar.generate_avatar_job(avatar_job("j2", style="formal"))
+    assert not casual.get("cached") and not formal.get("cached")
+    assert casual["avatar_url"] != formal["avatar_url"]
+
+async def test_single_and_batch_jobs_agree_per_style(scheduler, database):
+    await avatar.generate_avatar_batch_job(avatar_job("j1", styles=["casual", "formal"]))
+    avatars = {entry["result"]["avatar_url"] async for entry in database.avatar_cache.find()}
+
+    # Served from the entries the batch cached, one per style
+    formal = await avatar.generate_avatar_job(avatar_job("j2", style="formal"))
+    assert formal["cached"]
+    assert len(avatars) == 2 and formal["avatar_url"] in avatars
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.database import create_indexes
+from migrations.otp_phone_unique import INDEX_NAME, make_unique
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def old_otps(database):
+    """otps as deployed before send-otp relied on a unique index: a plain index and duplicates"""
+    await database.drop_collection("otps")
+    await database.drop_collection("blobs")
+    await database.drop_collection("ai_jobs")
+    await database.otps.create_index("phone_number")
+    now = datetime.utcnow()
+    await database.otps.insert_many([
+        {"phone_number": "+15550100", "otp_code": "111111", "created_at": now - timedelta(minutes=2)},
+        {"phone_number": "+15550100", "otp_code": "222222", "created_at": now},
+        {"phone_number": "+15550101", "otp_code": "333333", "created_at": now},
+    ])
+    return database
+
+async def test_conflicting_index_does_not_block_the_others(old_otps):
+    await create_indexes()
+
+    assert not (await old_otps.otps.index_information())[INDEX_NAME].get("unique")
+    assert (await old_otps.blobs.index_information())["sha256_1"]["unique"]
+    ai_jobs_indexes = await old_otps.ai_jobs.index_information()
+    assert ai_jobs_indexes["job_id_1"]["unique"]
+    assert ai_jobs_indexes["expires_at_1"]["expireAfterSeconds"] == 0
+
+async def test_migration_keeps_newest_otp_and_makes_index_unique(old_otps):
+    assert await make_unique(drop_index=True) == 1
+
+    assert (await old_otps.otps.index_information())[INDEX_NAME]["unique"]
+    otps = await old_otps.otps.find({}, {"_id": 0, "phone_number": 1, "otp_code": 1}).sort("phone_number", 1).to_list(None)
+    assert otps == [
+        {"phone_number": "+15550100", "otp_code": "222222"},
+        {"phone_number": "+15550101", "otp_code": "333333"},
+    ]
@@ -0,0 +1,38 @@
+import pytest
+
+from app.core.http_cache import etag_matches
+from app.services.avatar import AVAILABLE_MODELS, AVATAR_STYLES
+
+pytestmark = pytest.mark.anyio
+
+@pytest.mark.parametrize("path, body", [("/ai/models", {"models": AVAILABLE_MODELS}), ("/ai/styles", {"styles": AVATAR_STYLES})])
+async def test_catalog_revalidates_with_its_etag(client, path, body):
+    response = await client.get(path)
+    assert response.status_code == 200
+    assert response.json() == body
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "public, max-age=3600"
+
+    not_modified = await client.get(path, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+
+    changed = await client.get(path, headers={"If-None-Match": '"stale"'})
+    assert changed.status_code == 200
+    assert changed.json() == body
+
+async def test_catalogs_have_different_etags(client):
+    models, styles = await client.get("/ai/models"), await client.get("/ai/styles")
+    assert models.headers["etag"] != styles.headers["etag"]
+    assert (await client.get("/ai/styles", headers={"If-None-Match": models.headers["etag"]})).status_code == 200
+
+def test_if_none_match_forms():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"x", "abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"abcd"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
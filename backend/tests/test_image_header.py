@@ -0,0 +1,77 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app.core.image_header import HEADER_SCAN_LIMIT, ImageInfo, ImageSniffer, InvalidImageHeader, TooManyPixels, UnknownImageFormat
+
+def encode(format: str, size=(40, 30), mode="RGB", color="red", **options) -> bytes:
+    out = io.BytesIO()
+    Image.new(mode, size, color).save(out, format, **options)
+    return out.getvalue()
+
+def sniff(data: bytes, max_pixels: int = 10_000, chunk_size: int = 1) -> ImageInfo:
+    """Feed the bytes the way an upload arrives, a few at a time"""
+    sniffer = ImageSniffer(max_pixels)
+    for start in range(0, len(data), chunk_size):
+        sniffer.feed(data[start:start + chunk_size])
+    return sniffer.result()
+
+def exif_orientation(orientation: int) -> bytes:
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    return exif.tobytes()
+
+@pytest.mark.parametrize("format, options, content_type", [
+    ("JPEG", {}, "image/jpeg"),
+    ("JPEG", {"progressive": True}, "image/jpeg"),
+    ("PNG", {}, "image/png"),
+    ("WEBP", {}, "image/webp"),
+    ("WEBP", {"lossless": True}, "image/webp"),
+])
+def test_format_and_size_from_header(format, options, content_type):
+    assert sniff(encode(format, **options)) == ImageInfo(content_type, 40, 30)
+
+def test_webp_with_alpha_uses_extended_header():
+    data = encode("WEBP", mode="RGBA", color=(255, 0, 0, 128))
+    assert data[12:16] == b"VP8X"
+    assert sniff(data) == ImageInfo("image/webp", 40, 30)
+
+@pytest.mark.parametrize("orientation, size", [(1, (40, 30)), (3, (40, 30)), (6, (30, 40)), (8, (30, 40))])
+def test_jpeg_size_as_displayed(orientation, size):
+    data = encode("JPEG", exif=exif_orientation(orientation))
+    assert sniff(data)[1:] == size
+
+def test_result_matches_pillow_for_large_chunks():
+    data = encode("JPEG", size=(640, 480), quality=95)
+    with Image.open(io.BytesIO(data)) as image:
+        assert sniff(data, max_pixels=10**6, chunk_size=64 * 1024)[1:] == image.size
+
+def test_too_many_pixels_is_rejected_from_the_header():
+    data = encode("PNG", size=(200, 100))
+    sniffer = ImageSniffer(max_pixels=10_000)
+    with pytest.raises(TooManyPixels) as rejected:
+        sniffer.feed(data[:64])
+    assert (rejected.value.width, rejected.value.height) == (200, 100)
+
+def test_other_formats_are_rejected():
+    with pytest.raises(UnknownImageFormat):
+        sniff(encode("GIF"))
+    with pytest.raises(UnknownImageFormat):
+        sniff(b"<svg xmlns='http://www.w3.org/2000/svg'/>")
+
+def test_truncated_header_is_rejected():
+    with pytest.raises(InvalidImageHeader):
+        sniff(encode("JPEG")[:40])
+    with pytest.raises(InvalidImageHeader):
+        sniff(b"\x89PNG\r\n\x1a\n")
+
+def test_dimensions_past_scan_limit_are_left_to_the_decoder():
+    # An APP segment padded with 64 KB blocks pushes the frame header past the scan limit
+    padding = b"".join(b"\xff\xe2\xff\xff" + b"\0" * 0xfffd for _ in range(HEADER_SCAN_LIMIT // 0xffff + 1))
+    data = b"\xff\xd8" + padding + encode("JPEG")[2:]
+
+    sniffer = ImageSniffer(max_pixels=10_000)
+    sniffer.feed(data)
+    assert sniffer.done
+    assert sniffer.result() == ImageInfo("image/jpeg", None, None)
@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core.jobs import ai_jobs
+
+pytestmark = pytest.mark.anyio
+
+STEP_SECONDS = 0.05
+
+@pytest.fixture
+def steps_job(database, monkeypatch):
+    """A job kind publishing a preview and progress before it completes"""
+    async def handler(job):
+        await asyncio.sleep(STEP_SECONDS)
+        await ai_jobs.set_progress(job, "avatars.casual", {"avatar_url": "/avatars/casual.jpg"})
+        await asyncio.sleep(STEP_SECONDS)
+        await ai_jobs.set_progress(job, "percent", 50)
+        await asyncio.sleep(STEP_SECONDS)
+        return {"avatar_url": "/avatars/casual.jpg"}
+    monkeypatch.setitem(ai_jobs._handlers, "steps", handler)
+
+async def read_events(client, job_id: str):
+    """The (event, data) pairs of the job's SSE stream, which ends after "done" """
+    response = await client.get(f"/ai/jobs/{job_id}/events")
+    assert response.headers["content-type"].startswith("text/event-stream")
+    frames = response.text.split("\n\n")
+    assert frames[0] == "retry: 3000"
+    events = []
+    for frame in filter(None, frames[1:]):
+        event, data = frame.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+async def run_next_job():
+    # Let the stream report the queued job first
+    await asyncio.sleep(STEP_SECONDS)
+    await ai_jobs._run(await ai_jobs._claim())
+
+async def test_events_follow_the_job_to_completion(client, steps_job):
+    job = await ai_jobs.enqueue("steps", {}, user_id="u1")
+    events, _ = await asyncio.gather(read_events(client, job["job_id"]), run_next_job())
+
+    assert [event for event, _ in events] == ["queued", "started", "preview", "progress", "progress", "done"]
+    data = dict(events[:3])
+    assert data["started"]["attempt"] == 1
+    assert data["preview"]["avatars"] == {"casual": {"avatar_url": "/avatars/casual.jpg"}}
+    assert [data["percent"] for event, data in events if event == "progress"] == [50, 100]
+    done = events[-1][1]
+    assert (done["status"], done["result"], done["error"]) == ("completed", {"avatar_url": "/avatars/casual.jpg"}, None)
+
+async def test_late_client_gets_the_current_state(client, steps_job):
+    job = await ai_jobs.enqueue("steps", {}, user_id="u1")
+    await run_next_job()
+
+    events = await read_events(client, job["job_id"])
+    assert [event for event, _ in events] == ["preview", "progress", "done"]
+    assert events[1][1]["percent"] == 100
+
+async def test_unknown_job_has_no_stream(client):
+    assert (await client.get("/ai/jobs/missing/events")).status_code == 404
@@ -0,0 +1,237 @@
+from datetime import datetime, timedelta
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.core.jobs import DeficitRoundRobin, JobPriority, JobQueue, JobStatus
+
+pytestmark = pytest.mark.anyio
+
+class Interleaved:
+    """Collection whose operations let other tasks run first, like a real round trip"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            return await method(*args, **kwargs)
+        return call
+
+@pytest.fixture
+def queue(database):
+    queue = JobQueue("ai_jobs")
+    async def handler(job):
+        if job["payload"].get("fail"):
+            raise RuntimeError("model crashed")
+        return {"echo": job["payload"]}
+    # No worker pool: tests claim and run jobs themselves
+    queue._handlers["echo"] = handler
+    return queue
+
+async def expire_lease(database, job_id: str):
+    await database.ai_jobs.update_one({"job_id": job_id}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+async def test_concurrent_duplicates_share_one_job(queue, database, monkeypatch):
+    monkeypatch.setattr(JobQueue, "collection", property(lambda self: Interleaved(database[self.collection_name])))
+    jobs = await asyncio.gather(*(queue.enqueue("echo", {"n": 1}, user_id="u1", dedupe_key="k") for _ in range(10)))
+
+    assert len({job["job_id"] for job in jobs}) == 1
+    assert sum(not job.get("deduplicated") for job in jobs) == 1
+    assert await database.ai_jobs.count_documents({}) == 1
+
+async def test_dedupe_is_per_user_and_ends_with_the_job(queue, database):
+    first = await queue.enqueue("echo", {"n": 1}, user_id="u1", dedupe_key="k")
+    other_user = await queue.enqueue("echo", {"n": 1}, user_id="u2", dedupe_key="k")
+    assert other_user["job_id"] != first["job_id"]
+
+    await queue._finish(first, JobStatus.COMPLETED, result={})
+    again = await queue.enqueue("echo", {"n": 1}, user_id="u1", dedupe_key="k")
+    assert again["job_id"] != first["job_id"]
+    assert not again.get("deduplicated")
+
+async def test_claim_leases_the_oldest_job(queue, database):
+    first = await queue.enqueue("echo", {"n": 1}, user_id="u1")
+    await queue.enqueue("echo", {"n": 2}, user_id="u2")
+
+    job = await queue._claim()
+    assert job["job_id"] == first["job_id"]
+    assert job["status"] == JobStatus.RUNNING
+    assert job["attempts"] == 1
+    assert job["lease_expires_at"] > datetime.utcnow() + timedelta(seconds=settings.ai_job_lease_seconds - 5)
+
+async def test_expired_lease_is_retried_first(queue, database):
+    abandoned = await queue.enqueue("echo", {"n": 1}, user_id="u1")
+    await queue._claim()
+    await queue.enqueue("echo", {"n": 2}, user_id="u2")
+
+    # Leased and still running: the other job is next
+    assert (await queue._claim())["payload"] == {"n": 2}
+    await expire_lease(database, abandoned["job_id"])
+
+    job = await queue._claim()
+    assert job["job_id"] == abandoned["job_id"]
+    assert job["attempts"] == 2
+
+async def test_job_fails_after_max_attempts(queue, database):
+    job = await queue.enqueue("echo", {"n": 1}, user_id="u1")
+    for _ in range(settings.ai_job_max_attempts):
+        assert await queue._claim() is not None
+        await expire_lease(database, job["job_id"])
+
+    assert await queue._claim() is None
+    failed = await queue.get(job["job_id"])
+    assert failed["status"] == JobStatus.FAILED
+    assert failed["error"] == "Job exceeded maximum attempts"
+
+async def test_run_records_result_or_error(queue, database):
+    ok = await queue.enqueue("echo", {"n": 1}, user_id="u1")
+    broken = await queue.enqueue("echo", {"fail": True}, user_id="u2")
+    for _ in range(2):
+        await queue._run(await queue._claim())
+
+    ok = await queue.get(ok["job_id"])
+    assert ok["status"] == JobStatus.COMPLETED
+    assert ok["result"] == {"echo": {"n": 1}}
+    assert ok["progress"]["percent"] == 100
+    assert "lease_expires_at" not in ok
+    broken = await queue.get(broken["job_id"])
+    assert (broken["status"], broken["error"]) == (JobStatus.FAILED, "model crashed")
+    assert broken["expires_at"] > datetime.utcnow()
+
+@pytest.fixture
+def slow_job(queue, monkeypatch):
+    """A short lease, and a handler that runs for several of them"""
+    monkeypatch.setattr(settings, "ai_job_lease_seconds", 0.2)
+    monkeypatch.setattr(settings, "ai_job_poll_interval", 0.05)
+    runs = []
+    async def handler(job):
+        runs.append(job["attempts"])
+        await asyncio.sleep(0.8)
+        await queue.set_progress(job, "attempt", job["attempts"])
+        return {"attempt": job["attempts"]}
+    queue._handlers["slow"] = handler
+    return runs
+
+async def run_with_rival(queue, job_id: str):
+    """Run the queue's worker while another process's queue keeps trying to claim; returns its claims"""
+    rival = JobQueue("ai_jobs")
+    rival._handlers = queue._handlers
+    claimed = []
+    await queue.start(1)
+    try:
+        while (await queue.get(job_id))["status"] == JobStatus.QUEUED:
+            await asyncio.sleep(0.01)
+        while (await queue.get(job_id))["status"] not in (JobStatus.COMPLETED, JobStatus.FAILED):
+            if (job := await rival._claim()) is not None:
+                claimed.append(job["attempts"])
+                await rival._run(job)
+            await asyncio.sleep(0.05)
+    finally:
+        await queue.stop(timeout=5)
+    return claimed
+
+async def test_running_job_keeps_renewing_its_lease(queue, database, slow_job):
+    job = await queue.enqueue("slow", {}, user_id="u1")
+    assert await run_with_rival(queue, job["job_id"]) == []
+
+    assert slow_job == [1]
+    done = await queue.get(job["job_id"])
+    assert done["attempts"] == 1
+    assert done["result"] == {"attempt": 1}
+
+async def test_job_that_lost_its_lease_cannot_overwrite_the_retry(queue, database, slow_job, monkeypatch):
+    async def stalled(job):
+        pass
+    # The worker is alive but its renewals stop, so the lease runs out mid-run
+    monkeypatch.setattr(queue, "_renew_lease", stalled)
+    job = await queue.enqueue("slow", {}, user_id="u1")
+    assert await run_with_rival(queue, job["job_id"]) == [2]
+
+    # The first run finished last and was discarded
+    assert slow_job == [1, 2]
+    done = await queue.get(job["job_id"])
+    assert done["status"] == JobStatus.COMPLETED
+    assert done["result"] == {"attempt": 2}
+    assert done["progress"]["attempt"] == 2
+
+async def test_superseded_attempt_is_ignored(queue, database):
+    job = await queue.enqueue("echo", {"n": 1}, user_id="u1")
+    first = await queue._claim()
+    await expire_lease(database, job["job_id"])
+    second = await queue._claim()
+
+    await queue._finish(second, JobStatus.COMPLETED, result={"attempt": 2})
+    await queue.set_progress(first, "percent", 50)
+    await queue._finish(first, JobStatus.FAILED, error="stale")
+
+    done = await queue.get(job["job_id"])
+    assert (done["status"], done["result"], done["error"]) == (JobStatus.COMPLETED, {"attempt": 2}, None)
+    assert done["progress"]["percent"] == 100
+
+def serve(fair_share, costs):
+    """Pick a user and charge them, as when their job is claimed"""
+    user_id = fair_share.pick(costs)
+    fair_share.charge(user_id, costs[user_id])
+    return user_id
+
+def test_round_robin_shares_by_cost():
+    fair_share = DeficitRoundRobin(quantum=1)
+    assert [serve(fair_share, {"a": 1, "b": 1, "c": 1}) for _ in range(6)] == ["a", "b", "c", "a", "b", "c"]
+
+    # A five-pass job waits for five single-pass jobs of another user
+    fair_share = DeficitRoundRobin(quantum=1)
+    assert [serve(fair_share, {"a": 1, "b": 5}) for _ in range(12)] == ["a"] * 5 + ["b"] + ["a"] * 5 + ["b"]
+
+def test_round_robin_forgets_users_without_work():
+    fair_share = DeficitRoundRobin(quantum=1)
+    assert [serve(fair_share, {"a": 1, "b": 3}) for _ in range(2)] == ["a", "a"]
+    # b's credit is dropped while it has nothing queued, so it starts over
+    assert serve(fair_share, {"a": 1}) == "a"
+    assert [serve(fair_share, {"a": 1, "b": 3}) for _ in range(4)] == ["a", "a", "b", "a"]
+
+def test_round_robin_charges_only_claimed_jobs():
+    fair_share = DeficitRoundRobin(quantum=1)
+    assert [serve(fair_share, {"a": 1, "b": 3}) for _ in range(3)] == ["a", "a", "a"]
+    # Another process took b's job: b keeps the credit and its next job goes straight away
+    assert fair_share.pick({"a": 1, "b": 3}) == "b"
+    assert [serve(fair_share, {"a": 1, "b": 3}) for _ in range(2)] == ["b", "a"]
+
+def test_round_robin_needs_a_positive_quantum():
+    with pytest.raises(ValueError):
+        DeficitRoundRobin(quantum=0)
+
+async def claim_all(queue):
+    claimed = []
+    while (job := await queue._claim()) is not None:
+        claimed.append((job["user_id"], job["payload"]["n"]))
+    return claimed
+
+async def test_users_take_turns_within_the_running_cap(queue, database):
+    for n in range(4):
+        await queue.enqueue("echo", {"n": n}, user_id="heavy")
+    await queue.enqueue("echo", {"n": 0}, user_id="light")
+
+    # heavy queued first, but light is served in between, and heavy stops at its cap
+    assert settings.ai_job_max_running_per_user == 2
+    assert await claim_all(queue) == [("heavy", 0), ("light", 0), ("heavy", 1)]
+
+async def test_interactive_jobs_before_background(queue, database):
+    await queue.enqueue("echo", {"n": 0}, user_id="u1", priority=JobPriority.BACKGROUND)
+    await queue.enqueue("echo", {"n": 1}, user_id="u2", priority=JobPriority.BACKGROUND)
+    await queue.enqueue("echo", {"n": 2}, user_id="u3")
+
+    assert await claim_all(queue) == [("u3", 2), ("u1", 0), ("u2", 1)]
+
+async def test_batch_cost_counts_against_its_user(queue, database):
+    await queue.enqueue("echo", {"n": 0}, user_id="batch", cost=3)
+    for n in range(3):
+        await queue.enqueue("echo", {"n": n}, user_id=f"single-{n}")
+
+    # It needs three turns of credit, whatever the order users come in
+    claimed = await claim_all(queue)
+    assert claimed.index(("batch", 0)) >= 2
+    assert sorted(claimed) == sorted([("batch", 0), ("single-0", 0), ("single-1", 1), ("single-2", 2)])
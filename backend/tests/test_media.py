@@ -0,0 +1,96 @@
+import hashlib
+
+import pytest
+
+from app.core.object_store import object_store
+from app.core.storage import blob_key
+
+pytestmark = pytest.mark.anyio
+
+DATA = bytes(range(256)) * 4
+SHA256 = hashlib.sha256(DATA).hexdigest()
+KEY = blob_key(SHA256, "image/jpeg")
+URL = f"/uploads/{KEY}"
+
+@pytest.fixture
+async def media(client):
+    await object_store.put(KEY, DATA, "image/jpeg")
+    return client
+
+async def test_whole_file_is_served_immutable(media):
+    response = await media.get(URL)
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["content-length"] == str(len(DATA))
+    assert response.headers["etag"] == f'"{SHA256}"'
+    assert response.headers["accept-ranges"] == "bytes"
+    assert "immutable" in response.headers["cache-control"]
+
+async def test_head_sends_headers_only(media):
+    response = await media.head(URL)
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["content-length"] == str(len(DATA))
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=10-19", 10, 19),
+    ("bytes=1000-", 1000, 1023),
+    ("bytes=-5", 1019, 1023),
+    ("bytes=1000-5000", 1000, 1023),
+])
+async def test_range_is_partial_content(media, header, start, end):
+    response = await media.get(URL, headers={"Range": header})
+    assert response.status_code == 206
+    assert response.content == DATA[start:end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(DATA)}"
+    assert response.headers["content-length"] == str(end - start + 1)
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=-0"])
+async def test_range_past_the_end_is_not_satisfiable(media, header):
+    response = await media.get(URL, headers={"Range": header})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+@pytest.mark.parametrize("header", ["bytes=0-1,5-6", "items=0-1", "bytes=abc"])
+async def test_unsupported_ranges_get_the_whole_file(media, header):
+    response = await media.get(URL, headers={"Range": header})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+async def test_if_range_only_honours_a_current_validator(media):
+    etag = (await media.get(URL)).headers["etag"]
+    response = await media.get(URL, headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    response = await media.get(URL, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert (response.status_code, response.content) == (200, DATA)
+
+async def test_conditional_get_is_not_modified(media):
+    first = await media.get(URL)
+
+    response = await media.get(URL, headers={"If-None-Match": first.headers["etag"]})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == first.headers["etag"]
+
+    response = await media.get(URL, headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert response.status_code == 304
+    response = await media.get(URL, headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"})
+    assert response.status_code == 200
+    # If-None-Match takes precedence over the date
+    response = await media.get(URL, headers={"If-None-Match": '"other"', "If-Modified-Since": first.headers["last-modified"]})
+    assert response.status_code == 200
+
+async def test_variant_is_served_from_its_own_key(media):
+    variant_key = f"{SHA256[:2]}/{SHA256}.thumbnail.webp"
+    await object_store.put(variant_key, b"thumb", "image/webp")
+
+    response = await media.get(URL, params={"variant": "thumbnail"})
+    assert response.content == b"thumb"
+    assert response.headers["content-type"] == "image/webp"
+    assert (await media.get(URL, params={"variant": "huge"})).status_code == 400
+
+@pytest.mark.parametrize("path", [f"{SHA256[:2]}/missing.jpg", f"{SHA256[:2]}/.upload.part", "../secret.jpg"])
+async def test_missing_and_hidden_files_are_not_found(media, tmp_path, path):
+    (tmp_path / SHA256[:2] / ".upload.part").write_bytes(b"partial")
+    assert (await media.get(f"/uploads/{path}")).status_code == 404
@@ -0,0 +1,49 @@
+import pytest
+
+from app.core.metrics import Counter, Histogram
+
+pytestmark = pytest.mark.anyio
+
+async def request_counts(client) -> dict:
+    """http_requests_total samples from /metrics, by their label string"""
+    text = (await client.get("/metrics")).text
+    return {
+        line[len("http_requests_total"):].rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+        for line in text.splitlines()
+        if line.startswith("http_requests_total{")
+    }
+
+async def test_requests_are_labelled_by_route_template(client):
+    before = await request_counts(client)
+    for job_id in ("job-1", "job-2"):
+        assert (await client.get(f"/ai/jobs/{job_id}")).status_code == 404
+    assert (await client.get("/uploads/ab/missing.jpg")).status_code == 404
+    assert (await client.get("/no/such/route")).status_code == 404
+    after = await request_counts(client)
+
+    def added(labels: str) -> float:
+        return after.get(labels, 0) - before.get(labels, 0)
+
+    assert added('{route="/ai/jobs/{job_id}",method="GET",status="404"}') == 2
+    assert added('{route="/uploads/{key:path}",method="GET",status="404"}') == 1
+    assert added('{route="unmatched",method="GET",status="404"}') == 1
+    # Raw paths never become labels, so the number of series stays bounded
+    assert not any("job-1" in labels or "missing.jpg" in labels or "/no/such" in labels for labels in after)
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(("/a",), value)
+
+    assert list(histogram.samples()) == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.55',
+        'latency_seconds_count{route="/a"} 3',
+    ]
+
+def test_label_values_are_escaped():
+    counter = Counter("events_total", "Events", ("name",))
+    counter.inc(('say "hi"\n',))
+    assert list(counter.samples()) == ['events_total{name="say \\"hi\\"\\n"} 1']
@@ -0,0 +1,43 @@
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+
+from app.core.middleware import RequestBodyLimitMiddleware
+
+pytestmark = pytest.mark.anyio
+
+received = []
+endpoints = FastAPI()
+
+@endpoints.post("/upload")
+@endpoints.post("/upload/photos")
+async def echo_length(request: Request):
+    received.append(len(await request.body()))
+    return PlainTextResponse(str(received[-1]))
+
+app = RequestBodyLimitMiddleware(endpoints, limits={"/upload": 100, "/upload/photos": 1000})
+
+async def post(path: str, content):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post(path, content=content)
+
+async def chunked(size: int, chunk: int = 30):
+    for start in range(0, size, chunk):
+        yield b"x" * min(chunk, size - start)
+
+async def test_declared_length_over_the_limit_is_rejected_unread():
+    received.clear()
+    response = await post("/upload", b"x" * 101)
+    assert response.status_code == 413
+    assert received == []
+
+async def test_chunked_body_is_cut_off_mid_stream():
+    response = await post("/upload", chunked(300))
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Request body too large. Maximum size is 100 bytes"
+
+async def test_longest_prefix_sets_the_limit():
+    assert (await post("/upload", chunked(100))).text == "100"
+    assert (await post("/upload/photos", chunked(900))).text == "900"
+    assert (await post("/upload/photos", b"x" * 1001)).status_code == 413
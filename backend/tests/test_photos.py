@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+import asyncio
+
+import pytest
+
+from app.core.storage import Blob
+from app.services import photos
+from app.services.photos import add_photos, reconcile_photo_count
+
+pytestmark = pytest.mark.anyio
+
+def blob(n: int) -> Blob:
+    sha256 = f"{n:064x}"
+    return Blob(sha256=sha256, size=1, url=f"/uploads/{sha256[:2]}/{sha256}.jpg", key=f"{sha256[:2]}/{sha256}.jpg")
+
+class PausedAfterInsert:
+    """Database whose photos.insert_many waits, once the photos are in, until released"""
+
+    def __init__(self, database):
+        self.users = database.users
+        self.photos = self
+        self._photos = database.photos
+        self.inserted = asyncio.Event()
+        self.release = asyncio.Event()
+
+    def __getattr__(self, name):
+        return getattr(self._photos, name)
+
+    async def insert_many(self, docs, **kwargs):
+        result = await self._photos.insert_many(docs, **kwargs)
+        self.inserted.set()
+        await self.release.wait()
+        return result
+
+async def photo_count(database):
+    return (await database.users.find_one({"user_id": "u1"}))["photo_count"]
+
+@pytest.fixture
+async def user(database):
+    await database.users.insert_one({"user_id": "u1", "phone_number": "+15550100", "photo_count": 0})
+
+async def test_add_photos_counts_new_photos_once(database, user):
+    await add_photos(database, "u1", [(blob(1), {}), (blob(2), {})])
+    assert await add_photos(database, "u1", [(blob(2), {}), (blob(3), {})]) == {blob(2).url}
+
+    assert await photo_count(database) == 3
+    assert (await database.users.find_one({"user_id": "u1"}))["photo_adds"] == []
+
+async def test_reconcile_waits_for_an_add_in_flight(database, user):
+    paused = PausedAfterInsert(database)
+    add = asyncio.create_task(add_photos(paused, "u1", [(blob(1), {}), (blob(2), {})]))
+    await paused.inserted.wait()
+
+    reconcile = asyncio.create_task(reconcile_photo_count(database, "u1"))
+    await asyncio.sleep(0.2)
+    # Counting now and letting the add's $inc follow would count the new photos twice
+    assert not reconcile.done()
+
+    paused.release.set()
+    await add
+    assert await reconcile == 2
+    assert await photo_count(database) == 2
+
+async def test_reconcile_ignores_adds_that_died(database, user):
+    died_at = datetime.utcnow() - timedelta(seconds=photos.PHOTO_ADD_TIMEOUT_SECONDS + 1)
+    await database.users.update_one({"user_id": "u1"}, {"$push": {"photo_adds": {"at": died_at}}})
+    await database.photos.insert_one({"user_id": "u1", "url": blob(1).url})
+
+    assert await asyncio.wait_for(reconcile_photo_count(database, "u1"), 5) == 1
+    assert (await database.users.find_one({"user_id": "u1"}))["photo_adds"] == []
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from app.core.config import settings
+from app.core.profiling import ProfilerMiddleware, StackSampler
+
+pytestmark = pytest.mark.anyio
+
+async def slow_endpoint(request):
+    time.sleep(0.03)
+    await asyncio.sleep(0.03)
+    return PlainTextResponse("done")
+
+@pytest.fixture
+def profiled_app(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiler_token", "secret")
+    monkeypatch.setattr(settings, "profiler_interval_ms", 1)
+    monkeypatch.setattr(settings, "profiler_output_dir", str(tmp_path))
+    return ProfilerMiddleware(Starlette(routes=[Route("/slow", slow_endpoint)]))
+
+async def request(app, headers):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.get("/slow", headers=headers)
+
+async def test_profiles_a_slow_request(profiled_app, tmp_path):
+    response = await request(profiled_app, {"X-Profile": "secret"})
+    assert response.text == "done"
+
+    profile = (tmp_path / response.headers["x-profile-id"]).read_text()
+    stacks = dict(line.rsplit(" ", 1) for line in profile.splitlines())
+    # Both the blocking and the awaiting half of the endpoint show up
+    assert any("slow_endpoint" in stack and "[await" not in stack for stack in stacks)
+    assert any("slow_endpoint" in stack and "[await" in stack for stack in stacks)
+
+async def test_other_requests_are_not_profiled(profiled_app, tmp_path):
+    for headers in ({}, {"X-Profile": "wrong"}):
+        response = await request(profiled_app, headers)
+        assert response.text == "done"
+        assert "x-profile-id" not in response.headers
+    assert not list(tmp_path.iterdir())
+
+async def test_sampler_is_joined_off_the_event_loop(profiled_app, monkeypatch):
+    joined_from = []
+    join = StackSampler.join
+    def recording_join(self, *args):
+        joined_from.append(threading.get_ident())
+        join(self, *args)
+    monkeypatch.setattr(StackSampler, "join", recording_join)
+
+    await request(profiled_app, {"X-Profile": "secret"})
+    assert joined_from and threading.get_ident() not in joined_from
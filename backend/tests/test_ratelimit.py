@@ -0,0 +1,98 @@
+from unittest import mock
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.ratelimit import RateLimit, RateLimiter, Rule, ShardedMemoryBackend
+
+pytestmark = pytest.mark.anyio
+
+OTP = RateLimit.parse("5/600")
+GENEROUS = RateLimit.parse("100/1")
+
+@pytest.fixture
+def clock():
+    with mock.patch("app.core.ratelimit.time.monotonic", return_value=1000.0) as monotonic:
+        yield monotonic
+
+async def test_bucket_refills_at_its_rate(clock):
+    backend = ShardedMemoryBackend(shards=1, max_keys=100)
+    for _ in range(5):
+        assert await backend.acquire([("otp:phone:1", OTP)]) == 0
+    assert await backend.acquire([("otp:phone:1", OTP)]) == pytest.approx(120)
+
+    clock.return_value += 120
+    assert await backend.acquire([("otp:phone:1", OTP)]) == 0
+    assert await backend.acquire([("otp:phone:1", OTP)]) > 0
+
+async def test_cost_takes_several_tokens(clock):
+    backend = ShardedMemoryBackend(shards=1, max_keys=100)
+    assert await backend.acquire([("ai:user:1", OTP)], cost=4) == 0
+    assert await backend.acquire([("ai:user:1", OTP)], cost=2) == pytest.approx(120)
+    assert await backend.acquire([("ai:user:1", OTP)], cost=1) == 0
+
+async def test_pruning_keeps_drained_buckets_of_strict_limits(clock):
+    backend = ShardedMemoryBackend(shards=1, max_keys=3)
+    for _ in range(5):
+        await backend.acquire([("otp:phone:1", OTP)])
+    await backend.acquire([("feed:user:1", GENEROUS)])
+    await backend.acquire([("feed:user:2", GENEROUS)])
+
+    # A generous bucket refills within a second; the OTP bucket takes ten minutes
+    clock.return_value += 2
+    await backend.acquire([("feed:user:3", GENEROUS)])
+
+    assert await backend.acquire([("otp:phone:1", OTP)]) > 0
+
+async def test_rejected_request_spends_nothing(clock):
+    backend = ShardedMemoryBackend(shards=4, max_keys=100)
+    limiter = RateLimiter(backend)
+    async def phone(request):
+        return "1"
+    async def ip(request):
+        return "10.0.0.1"
+    strict_ip = RateLimit.parse("1/600")
+
+    await limiter.check("otp", [Rule("ip", ip, strict_ip)], None)
+    for _ in range(3):
+        with pytest.raises(HTTPException) as rejected:
+            await limiter.check("otp", [Rule("phone", phone, OTP), Rule("ip", ip, strict_ip)], None)
+        assert rejected.value.status_code == 429
+        assert rejected.value.headers["Retry-After"] == "600"
+
+    # The phone's bucket is still full
+    for _ in range(5):
+        assert await backend.acquire([("otp:phone:1", OTP)]) == 0
+
+async def test_batch_takes_a_token_per_style(database, client, monkeypatch):
+    await database.users.insert_one({"user_id": "u1", "phone_number": "+15550100", "is_active": True})
+    monkeypatch.setattr("app.routers.ai.ai_jobs.enqueue", mock.AsyncMock(return_value={"job_id": "j", "status": "queued"}))
+    styles = ["casual", "formal", "trendy", "vintage", "seasonal"]
+
+    # RATE_LIMIT_AI_PER_USER is 10 per minute: two batches of five, or ten singles
+    for _ in range(2):
+        response = await client.post("/ai/generate-avatars", json={"user_id": "u1", "photo_urls": ["/a.jpg"], "styles": styles})
+        assert response.status_code == 202
+    response = await client.post("/ai/generate-avatar", json={"user_id": "u1", "photo_urls": ["/a.jpg"], "style": "casual"})
+    assert response.status_code == 429
+
+async def test_padded_styles_are_not_charged(database, client, monkeypatch):
+    await database.users.insert_one({"user_id": "u1", "phone_number": "+15550100", "is_active": True})
+    monkeypatch.setattr("app.routers.ai.ai_jobs.enqueue", mock.AsyncMock(return_value={"job_id": "j", "status": "queued"}))
+    padded = ["casual", "casual", *(f"bogus-{i}" for i in range(50))]
+
+    response = await client.post("/ai/generate-avatars", json={"user_id": "u1", "photo_urls": ["/a.jpg"], "styles": padded})
+    assert response.status_code == 400
+
+    # It took one token; nine are left
+    for styles in (["casual", "formal", "trendy", "vintage", "seasonal"], ["casual", "formal", "trendy", "vintage"]):
+        response = await client.post("/ai/generate-avatars", json={"user_id": "u1", "photo_urls": ["/a.jpg"], "styles": styles})
+        assert response.status_code == 202
+
+async def test_verify_has_its_own_ip_limit(database, client):
+    # RATE_LIMIT_VERIFY_PER_IP is 30 attempts per 10 minutes, ten per phone; sends allow only 20
+    for n in range(30):
+        response = await client.post("/auth/verify-otp", json={"phone_number": f"+1555010{n // 10}", "otp_code": "000000"})
+        assert response.status_code != 429
+    response = await client.post("/auth/verify-otp", json={"phone_number": "+15550109", "otp_code": "000000"})
+    assert response.status_code == 429
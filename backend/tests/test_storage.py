@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+import asyncio
+import hashlib
+
+import pytest
+
+from app.core import storage
+from app.core.image_header import ImageInfo
+from app.core.object_store import object_store
+from app.core.storage import StoredFile, UploadTooLarge, blob_key, commit_blob, release_blob, save_stream
+
+pytestmark = pytest.mark.anyio
+
+DATA = b"\x89PNG\r\n\x1a\n" + b"not really the rest of a png"
+SHA256 = hashlib.sha256(DATA).hexdigest()
+KEY = blob_key(SHA256, "image/png")
+
+def staged(tmp_path, name="upload.part") -> StoredFile:
+    path = tmp_path / name
+    path.write_bytes(DATA)
+    return StoredFile(path=path, size=len(DATA), sha256=SHA256, image=ImageInfo("image/png", 4, 3))
+
+async def refcount(database):
+    blob_doc = await database.blobs.find_one({"sha256": SHA256})
+    return blob_doc and blob_doc["refcount"]
+
+async def test_identical_uploads_share_one_object(database, tmp_path):
+    first = await commit_blob(staged(tmp_path, "a.part"))
+    second = await commit_blob(staged(tmp_path, "b.part"))
+
+    assert first.key == second.key == KEY
+    assert (first.width, first.height) == (4, 3)
+    assert await refcount(database) == 2
+    assert await object_store.get(KEY) == DATA
+    assert not (tmp_path / "a.part").exists() and not (tmp_path / "b.part").exists()
+
+async def test_last_release_deletes_blob_and_variants(database, tmp_path):
+    await commit_blob(staged(tmp_path, "a.part"))
+    await commit_blob(staged(tmp_path, "b.part"))
+    variant = f"{SHA256[:2]}/{SHA256}.thumbnail.webp"
+    await object_store.put(variant, b"thumb", "image/webp")
+    await database.blobs.update_one({"sha256": SHA256}, {"$set": {"variants": {"thumbnail": variant}}})
+
+    await release_blob(SHA256)
+    assert await refcount(database) == 1
+    assert await object_store.exists(KEY)
+
+    await release_blob(SHA256)
+    assert await database.blobs.find_one({"sha256": SHA256}) is None
+    assert not await object_store.exists(KEY)
+    assert not await object_store.exists(variant)
+
+async def test_existing_blob_keeps_its_key(database, tmp_path):
+    # Recorded before sniffing, under the extension the client claimed
+    old_key = f"{SHA256[:2]}/{SHA256}.jpg"
+    await object_store.put(old_key, DATA, "image/jpeg")
+    await database.blobs.insert_one({"sha256": SHA256, "key": old_key, "size": len(DATA), "content_type": "image/jpeg", "refcount": 1})
+
+    blob = await commit_blob(staged(tmp_path))
+    assert blob.key == old_key
+    assert blob.url == f"/uploads/{old_key}"
+    assert not await object_store.exists(KEY)
+
+async def test_commit_during_release_keeps_the_object(database, tmp_path, monkeypatch):
+    await commit_blob(staged(tmp_path, "a.part"))
+
+    # Hold the release after it decided to delete, before the object is gone
+    deleting, resume = asyncio.Event(), asyncio.Event()
+    delete = object_store.delete
+    async def slow_delete(key):
+        deleting.set()
+        await resume.wait()
+        await delete(key)
+    monkeypatch.setattr(object_store, "delete", slow_delete)
+
+    release = asyncio.create_task(release_blob(SHA256))
+    await deleting.wait()
+    commit = asyncio.create_task(commit_blob(staged(tmp_path, "b.part")))
+    await asyncio.sleep(0.1)
+    # The new reference waits for the deletion instead of reviving the blob
+    assert not commit.done()
+
+    resume.set()
+    await release
+    blob = await commit
+    assert blob.key == KEY
+    assert await refcount(database) == 1
+    assert await object_store.get(KEY) == DATA
+
+async def test_stalled_deletion_is_taken_over(database, tmp_path):
+    await object_store.put(KEY, DATA, "image/png")
+    await database.blobs.insert_one({
+        "sha256": SHA256,
+        "key": KEY,
+        "size": len(DATA),
+        "content_type": "image/png",
+        "refcount": 0,
+        "deleting_at": datetime.utcnow() - timedelta(seconds=storage.BLOB_DELETE_TIMEOUT_SECONDS + 1),
+    })
+
+    blob = await asyncio.wait_for(commit_blob(staged(tmp_path)), 5)
+    assert blob.key == KEY
+    assert await refcount(database) == 1
+    assert await object_store.get(KEY) == DATA
+
+async def test_stream_past_the_limit_is_cut_off(tmp_path):
+    sent = 0
+    async def chunks():
+        nonlocal sent
+        while True:
+            sent += 1
+            yield b"x" * 4
+
+    with pytest.raises(UploadTooLarge):
+        await save_stream(chunks(), tmp_path, max_size=10)
+    # Stopped at the first chunk over the limit, and the partial file is gone
+    assert sent == 3
+    assert list(tmp_path.iterdir()) == []
+
+async def test_stream_within_the_limit_is_hashed(tmp_path):
+    async def chunks():
+        yield DATA[:5]
+        yield DATA[5:]
+
+    stored = await save_stream(chunks(), tmp_path, max_size=len(DATA))
+    assert (stored.size, stored.sha256) == (len(DATA), SHA256)
+    assert stored.path.read_bytes() == DATA
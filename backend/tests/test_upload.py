@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+import hashlib
+import io
+
+import pytest
+from PIL import Image
+
+from app.core.config import settings
+from app.core.object_store import object_store
+from app.core.storage import blob_key
+from app.services.images import shutdown_pool
+from app.services.uploads import upload_sessions
+
+pytestmark = pytest.mark.anyio
+
+def jpeg(color: str = "red") -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(out, "JPEG")
+    return out.getvalue()
+
+DATA = jpeg()
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+async def test_new_bytes_are_presigned_and_completed(client, user_headers):
+    request = {"sha256": SHA256, "length": len(DATA), "content_type": "image/jpeg"}
+    ticket = (await client.post("/upload/direct", json=request, headers=user_headers)).json()
+    assert ticket["upload_url"].startswith(f"/uploads/{blob_key(SHA256, 'image/jpeg')}?")
+
+    response = await client.put(ticket["upload_url"], content=DATA, headers=ticket["headers"])
+    assert response.status_code in (200, 201, 204)
+
+    response = await client.post("/upload/direct/complete", json=request, headers=user_headers)
+    assert response.status_code == 200
+    assert response.json()["file_url"] == f"/uploads/{blob_key(SHA256, 'image/jpeg')}"
+    assert (response.json()["width"], response.json()["height"]) == (40, 30)
+
+async def test_blob_under_another_extension_is_reused(client, user_headers, database):
+    # Stored before sniffing, named after the type the first client claimed
+    old_key = f"{SHA256[:2]}/{SHA256}.png"
+    await object_store.put(old_key, DATA, "image/png")
+    await database.blobs.insert_one({"sha256": SHA256, "key": old_key, "size": len(DATA), "content_type": "image/png", "refcount": 1})
+    request = {"sha256": SHA256, "length": len(DATA), "content_type": "image/jpeg"}
+
+    ticket = (await client.post("/upload/direct", json=request, headers=user_headers)).json()
+    assert ticket["upload_url"] is None
+
+    response = await client.post("/upload/direct/complete", json=request, headers=user_headers)
+    assert response.status_code == 200
+    assert response.json()["file_url"] == f"/uploads/{old_key}"
+    assert (await database.blobs.find_one({"sha256": SHA256}))["refcount"] == 2
+
+async def test_complete_before_upload_conflicts(client, user_headers, database):
+    request = {"sha256": SHA256, "length": len(DATA), "content_type": "image/jpeg"}
+
+    response = await client.post("/upload/direct/complete", json=request, headers=user_headers)
+    assert response.status_code == 409
+    assert await database.blobs.count_documents({}) == 0
+
+async def test_photo_over_the_size_limit_is_rejected(client, user_headers, database, tmp_path, monkeypatch):
+    # Under the body limit of the middleware, so the stream itself has to stop it
+    monkeypatch.setattr(settings, "max_upload_size", len(DATA) - 1)
+    monkeypatch.setattr(settings, "upload_chunk_size", 64)
+
+    response = await client.post("/upload/photo", files={"file": ("a.jpg", DATA, "image/jpeg")}, headers=user_headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"File too large. Maximum size is {len(DATA) - 1} bytes"
+    assert not list(tmp_path.rglob("*.part"))
+    assert await database.blobs.count_documents({}) == 0
+
+@pytest.fixture
+def image_pool():
+    """The image process pool, shut down after the test"""
+    yield
+    shutdown_pool()
+
+async def test_bulk_upload_reports_each_file(client, user_headers, database, image_pool):
+    blue = jpeg("blue")
+    files = [
+        ("files", ("red.jpg", DATA, "image/jpeg")),
+        ("files", ("notes.jpg", b"just some text", "image/jpeg")),
+        ("files", ("blue.jpg", blue, "image/jpeg")),
+        ("files", ("red-again.jpg", DATA, "image/jpeg")),
+    ]
+    response = await client.post("/upload/photos", files=files, headers=user_headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["success"], body["uploaded"]) == (True, 3)
+
+    results = {result["filename"]: result for result in body["results"]}
+    assert [result["filename"] for result in body["results"]] == ["red.jpg", "notes.jpg", "blue.jpg", "red-again.jpg"]
+    assert results["notes.jpg"]["success"] is False
+    assert results["notes.jpg"]["message"] == "Invalid file type. Only JPEG, PNG, and WebP are allowed"
+    assert results["red.jpg"]["success"] and results["blue.jpg"]["success"]
+    assert results["red-again.jpg"]["file_url"] == results["red.jpg"]["file_url"]
+    assert set(results["red.jpg"]["variants"]) == {"thumbnail", "preview", "model"}
+
+    # The same photo twice is one photo with one reference
+    assert await database.photos.count_documents({"user_id": "u1"}) == 2
+    assert (await database.users.find_one({"user_id": "u1"}))["photo_count"] == 2
+    assert (await database.blobs.find_one({"sha256": SHA256}))["refcount"] == 1
+
+async def test_bulk_upload_with_no_valid_file_stores_nothing(client, user_headers, database):
+    files = [("files", (f"{n}.jpg", b"not an image", "image/jpeg")) for n in range(2)]
+    response = await client.post("/upload/photos", files=files, headers=user_headers)
+    assert response.status_code == 200
+    assert (response.json()["success"], response.json()["uploaded"]) == (False, 0)
+    assert await database.photos.count_documents({}) == 0
+
+async def test_bulk_upload_limits_the_file_count(client, user_headers, monkeypatch):
+    monkeypatch.setattr(settings, "max_bulk_upload_files", 2)
+    files = [("files", (f"{n}.jpg", DATA, "image/jpeg")) for n in range(3)]
+    response = await client.post("/upload/photos", files=files, headers=user_headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Too many files. Maximum is 2 per request"
+
+async def start_session(client, headers) -> str:
+    response = await client.post("/upload/sessions", json={"length": len(DATA), "content_type": "image/jpeg", "filename": "a.jpg"}, headers=headers)
+    assert response.status_code == 201
+    return response.json()["upload_id"]
+
+async def patch(client, headers, upload_id: str, offset: int, body: bytes):
+    chunk_headers = {**headers, "Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"}
+    return await client.patch(f"/upload/sessions/{upload_id}", content=body, headers=chunk_headers)
+
+async def test_chunk_at_the_wrong_offset_conflicts(client, user_headers):
+    upload_id = await start_session(client, user_headers)
+    half = len(DATA) // 2
+    response = await patch(client, user_headers, upload_id, 0, DATA[:half])
+    assert (response.status_code, response.headers["upload-offset"]) == (204, str(half))
+
+    # A retry of the same chunk, and one skipping ahead, both learn the real offset
+    for offset in (0, half + 10):
+        response = await patch(client, user_headers, upload_id, offset, DATA[offset:])
+        assert response.status_code == 409
+        assert response.headers["upload-offset"] == str(half)
+
+    response = await client.head(f"/upload/sessions/{upload_id}", headers=user_headers)
+    assert response.headers["upload-offset"] == str(half)
+    response = await client.post(f"/upload/sessions/{upload_id}/complete", headers=user_headers)
+    assert response.status_code == 409
+    assert response.headers["upload-offset"] == str(half)
+
+async def test_upload_resumes_once_a_dead_writer_lease_expires(client, user_headers, database, image_pool):
+    upload_id = await start_session(client, user_headers)
+    half = len(DATA) // 2
+    await patch(client, user_headers, upload_id, 0, DATA[:half])
+
+    # A writer took the session, wrote past the recorded offset and died
+    with open(upload_sessions.part_path(upload_id), "ab") as part:
+        part.write(b"garbage from the dead writer")
+    lease = {"lease": "dead-writer", "lease_expires_at": datetime.utcnow() + timedelta(seconds=30)}
+    await database.upload_sessions.update_one({"upload_id": upload_id}, {"$set": lease})
+
+    response = await patch(client, user_headers, upload_id, half, DATA[half:])
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Another request is writing to this upload"
+
+    await database.upload_sessions.update_one({"upload_id": upload_id}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    response = await patch(client, user_headers, upload_id, half, DATA[half:])
+    assert (response.status_code, response.headers["upload-offset"]) == (204, str(len(DATA)))
+
+    response = await client.post(f"/upload/sessions/{upload_id}/complete", headers=user_headers)
+    assert response.status_code == 200
+    assert response.json()["file_id"] == SHA256
+    assert await object_store.get(blob_key(SHA256, "image/jpeg")) == DATA
+    assert await database.upload_sessions.count_documents({}) == 0
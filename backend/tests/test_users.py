@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.services.users import UserRepository
+
+pytestmark = pytest.mark.anyio
+
+class CountedCollection:
+    """Collection that records the filter and projection of every find"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.finds = []
+
+    def find(self, query, projection):
+        self.finds.append((query, projection))
+        return self._collection.find(query, projection)
+
+@pytest.fixture
+async def repository(database, monkeypatch):
+    for n in range(5):
+        await database.users.insert_one({"user_id": f"u{n}", "phone_number": f"+1555010{n}", "is_active": True, "photo_count": n})
+    collection = CountedCollection(database.users)
+    monkeypatch.setattr(UserRepository, "collection", property(lambda self: collection))
+    repository = UserRepository("users")
+    repository.round_trips = collection.finds
+    return repository
+
+async def test_concurrent_lookups_share_one_query(repository):
+    users = await asyncio.gather(*(repository.get(f"u{n}") for n in (0, 1, 2, 2, 9)))
+
+    assert [user and user.user_id for user in users] == ["u0", "u1", "u2", "u2", None]
+    assert len(repository.round_trips) == 1
+    query, _ = repository.round_trips[0]
+    assert sorted(query["user_id"]["$in"]) == ["u0", "u1", "u2", "u9"]
+    assert (repository.lookups, repository.queries) == (5, 1)
+
+async def test_projection_is_the_union_of_requested_fields(repository):
+    auth, count = await asyncio.gather(repository.get("u1"), repository.photo_count("u3"))
+
+    _, projection = repository.round_trips[0]
+    assert projection == {"_id": 0, "user_id": 1, "phone_number": 1, "is_active": 1, "photo_count": 1}
+    assert (auth.phone_number, count) == ("+15550101", 3)
+
+async def test_sequential_lookups_are_separate_queries(repository):
+    assert await repository.exists("u1")
+    assert not await repository.exists("u9")
+    assert len(repository.round_trips) == 2
+    # Only user_id was asked for
+    assert repository.round_trips[1][1] == {"_id": 0, "user_id": 1}
+
+async def test_full_batch_is_sent_without_waiting(repository, monkeypatch):
+    monkeypatch.setattr(settings, "user_batch_max_size", 2)
+    monkeypatch.setattr(settings, "user_batch_window_ms", 10_000)
+
+    users = await asyncio.wait_for(asyncio.gather(*(repository.get(f"u{n}") for n in range(4))), 1)
+    assert [user.user_id for user in users] == ["u0", "u1", "u2", "u3"]
+    assert len(repository.round_trips) == 2
+    assert repository.largest_batch == 2
+
+async def test_failed_query_fails_every_waiter(repository, monkeypatch):
+    def broken_find(query, projection):
+        raise ConnectionError("mongo went away")
+    monkeypatch.setattr(repository.collection, "find", broken_find)
+
+    results = await asyncio.gather(repository.get("u1"), repository.get("u2"), return_exceptions=True)
+    assert all(isinstance(result, ConnectionError) for result in results)
@@ -1,21 +1,136 @@
 import api from './api';
-import { AIGenerateResponse } from '@/types/api';
+import { AIGenerateResponse, AIJobAccepted, AIJobStatus } from '@/types/api';
+
+const JOB_POLL_INTERVAL_MS = 1500;
 
 export class AIService {
   static async generateAvatar(
     userId: string,
     photoUrls: string[],
-    style: string = 'casual'
+    style: string = 'casual',
+    model?: string
   ): Promise<AIGenerateResponse> {
-    const response = await api.post('/ai/generate-avatar', {
+    const response = await api.post<AIJobAccepted>('/ai/generate-avatar', {
       user_id: userId,
       photo_urls: photoUrls,
       style,
+      model,
+    });
+
+    const job = await AIService.waitForJob(response.data.job_id);
+    if (job.status === 'failed' || !job.result) {
+      throw new Error(job.error || 'Avatar generation failed');
+    }
+    return job.result;
+  }
+
+  static async generateAvatars(
+    userId: string,
+    photoUrls: string[],
+    styles: string[],
+    onAvatar?: (style: string, avatar: AIGenerateResponse) => void
+  ): Promise<Record<string, AIGenerateResponse>> {
+    const response = await api.post<AIJobAccepted>('/ai/generate-avatars', {
+      user_id: userId,
+      photo_urls: photoUrls,
+      styles,
+    });
+
+    const reported = new Set<string>();
+    const job = await AIService.waitForJob(response.data.job_id, (update) => {
+      for (const [style, avatar] of Object.entries(update.avatars || {})) {
+        if (!reported.has(style)) {
+          reported.add(style);
+          onAvatar?.(style, avatar);
+        }
+      }
     });
-    
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Avatar generation failed');
+    }
+    return job.avatars || {};
+  }
+
+  static async getJob(jobId: string): Promise<AIJobStatus> {
+    const response = await api.get<AIJobStatus>(`/ai/jobs/${jobId}`);
     return response.data;
   }
 
+  static async waitForJob(
+    jobId: string,
+    onUpdate?: (job: AIJobStatus) => void
+  ): Promise<AIJobStatus> {
+    try {
+      return await AIService.streamJob(jobId, onUpdate);
+    } catch {
+      // The event stream is unavailable or dropped; fall back to polling
+    }
+
+    while (true) {
+      const job = await AIService.getJob(jobId);
+      onUpdate?.(job);
+      if (job.status === 'completed' || job.status === 'failed') {
+        return job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+  }
+
+  // One WebSocket pushing the job's events instead of polling its status
+  static streamJob(
+    jobId: string,
+    onUpdate?: (job: AIJobStatus) => void
+  ): Promise<AIJobStatus> {
+    const url = `${(api.defaults.baseURL || '').replace(/^http/, 'ws')}/ai/jobs/${jobId}/ws`;
+
+    return new Promise((resolve, reject) => {
+      const socket = new WebSocket(url);
+      const job: AIJobStatus = { job_id: jobId, status: 'queued', created_at: new Date().toISOString() };
+      let done = false;
+
+      socket.onmessage = (message) => {
+        const { event, ...data } = JSON.parse(message.data);
+        switch (event) {
+          case 'queued':
+            Object.assign(job, { status: 'queued', priority: data.priority, created_at: data.created_at });
+            break;
+          case 'started':
+            Object.assign(job, { status: 'running', started_at: data.started_at });
+            break;
+          case 'progress':
+            job.percent = data.percent;
+            break;
+          case 'preview':
+            job.avatars = { ...job.avatars, ...data.avatars };
+            break;
+          case 'done':
+            done = true;
+            Object.assign(job, {
+              status: data.status || 'failed',
+              result: data.result || undefined,
+              error: data.error || undefined,
+              finished_at: data.finished_at || undefined,
+            });
+            break;
+          default:
+            // Heartbeat
+            return;
+        }
+        onUpdate?.({ ...job });
+        if (done) {
+          socket.close();
+          resolve(job);
+        }
+      };
+      socket.onerror = () => socket.close();
+      socket.onclose = () => {
+        if (!done) {
+          reject(new Error('Job event stream closed'));
+        }
+      };
+    });
+  }
+
   static async getAvailableModels() {
     const response = await api.get('/ai/models');
     return response.data;
@@ -1,5 +1,8 @@
 import api from './api';
-import { UploadResponse } from '@/types/api';
+import { BulkUploadResponse, PhotoListResponse, UploadResponse, UploadSession } from '@/types/api';
+
+const CHUNK_SIZE = 1024 * 1024;
+const MAX_CHUNK_ATTEMPTS = 5;
 
 export class UploadService {
   static async uploadPhoto(uri: string, fileName?: string): Promise<UploadResponse> {
@@ -20,4 +23,72 @@ export class UploadService {
     
     return response.data;
   }
-}
\ No newline at end of file
+
+  static async uploadPhotos(uris: string[]): Promise<BulkUploadResponse> {
+    const formData = new FormData();
+
+    // One request for the whole capture session
+    uris.forEach((uri, index) => {
+      formData.append('files', {
+        uri,
+        type: 'image/jpeg',
+        name: `photo-${index + 1}.jpg`,
+      } as any);
+    });
+
+    const response = await api.post('/upload/photos', formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data',
+      },
+    });
+
+    return response.data;
+  }
+
+  // Upload in chunks; after a dropped connection only the bytes the server lacks are resent
+  static async uploadPhotoResumable(
+    uri: string,
+    fileName?: string,
+    onProgress?: (sent: number, total: number) => void
+  ): Promise<UploadResponse> {
+    const file = await (await fetch(uri)).blob();
+    const { data: session } = await api.post<UploadSession>('/upload/sessions', {
+      length: file.size,
+      content_type: 'image/jpeg',
+      filename: fileName || 'photo.jpg',
+    });
+
+    let offset = session.offset;
+    let failures = 0;
+    while (offset < file.size) {
+      try {
+        const response = await api.patch(session.upload_url, file.slice(offset, offset + CHUNK_SIZE), {
+          headers: {
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': String(offset),
+          },
+        });
+        offset = Number(response.headers['upload-offset']);
+        failures = 0;
+        onProgress?.(offset, file.size);
+      } catch (error) {
+        if (++failures >= MAX_CHUNK_ATTEMPTS) {
+          throw error;
+        }
+        // Ask where the server got to; part of the failed chunk may have arrived
+        const response = await api.head(session.upload_url);
+        offset = Number(response.headers['upload-offset']);
+      }
+    }
+
+    const response = await api.post<UploadResponse>(`${session.upload_url}/complete`);
+    return response.data;
+  }
+
+  static async listPhotos(cursor?: string, limit: number = 20): Promise<PhotoListResponse> {
+    const response = await api.get<PhotoListResponse>('/upload/photos', {
+      params: { limit, cursor },
+    });
+    return response.data;
+  }
+}
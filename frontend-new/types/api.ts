@@ -3,7 +3,7 @@ export interface User {
   phone_number: string;
   created_at: string;
   is_active: boolean;
-  profile_photos: string[];
+  photo_count: number;
 }
 
 export interface AuthResponse {
@@ -25,6 +25,49 @@ export interface UploadResponse {
   message: string;
   file_url?: string;
   file_id?: string;
+  variants?: {
+    thumbnail?: string;
+    preview?: string;
+    model?: string;
+  };
+  width?: number;
+  height?: number;
+  filename?: string;
+}
+
+export interface PhotoItem {
+  file_id?: string;
+  file_url: string;
+  variants?: {
+    thumbnail?: string;
+    preview?: string;
+    model?: string;
+  };
+  width?: number;
+  height?: number;
+  created_at: string;
+}
+
+export interface PhotoListResponse {
+  photos: PhotoItem[];
+  next_cursor?: string;
+  total: number;
+}
+
+export interface BulkUploadResponse {
+  success: boolean;
+  message: string;
+  uploaded: number;
+  results: UploadResponse[];
+}
+
+export interface UploadSession {
+  upload_id: string;
+  offset: number;
+  length: number;
+  content_type: string;
+  expires_at: string;
+  upload_url: string;
 }
 
 export interface AIGenerateResponse {
@@ -33,4 +76,27 @@ export interface AIGenerateResponse {
   avatar_url?: string;
   processing_time: number;
   request_id: string;
+  cached?: boolean;
+}
+
+export interface AIJobAccepted {
+  success: boolean;
+  message: string;
+  job_id: string;
+  status: string;
+  status_url: string;
+  events_url?: string;
+}
+
+export interface AIJobStatus {
+  job_id: string;
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  priority?: 'interactive' | 'background';
+  created_at: string;
+  started_at?: string;
+  finished_at?: string;
+  result?: AIGenerateResponse;
+  avatars?: Record<string, AIGenerateResponse>;
+  percent?: number;
+  error?: string;
 }
\ No newline at end of file